@@ -0,0 +1,303 @@
+"""
+Rate limiting and admission control for HaatKhata
+Token buckets per user (or client address before login) and route class
+keep one client from flooding the database, and a global cap on in-flight
+requests turns overload into a fast 503 instead of a slow queue. The state
+lives in a small memory-mapped file, so every gunicorn worker on the host
+shares the same buckets and the same in-flight count.
+"""
+
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from flask import request, session, jsonify, Response
+from flask_login import current_user
+import metrics
+
+# Admission configuration from environment variables
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'haatkhata-limits'
+))
+# Requests per minute (also the burst size) for each route class
+RATE_LIMITS = {
+    'search': int(os.getenv("RATE_LIMIT_SEARCH", 60)),
+    'write': int(os.getenv("RATE_LIMIT_WRITE", 120)),
+    'auth': int(os.getenv("RATE_LIMIT_AUTH", 10)),
+}
+# Requests allowed in flight at once across all workers; 0 disables the cap
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", 16))
+ADMISSION_DEADLINE_MS = int(os.getenv("ADMISSION_DEADLINE_MS", 500))
+
+AUTH_ENDPOINTS = {'login', 'register'}
+# Endpoints whose every request counts as a search
+SEARCH_ENDPOINTS = {'suggest_tasks'}
+# Endpoints that never touch the database, or hold a connection open forever
+EXEMPT_ENDPOINTS = {'static', 'asset', 'events_stream', 'metrics_endpoint'}
+
+# Shared file layout: a header, one row per worker process, then the buckets
+HEADER = struct.Struct('d')          # smoothed request service time
+WORKER = struct.Struct('iII')        # pid, active requests, waiting requests
+BUCKET = struct.Struct('Qdd')        # key hash, tokens, last refill time
+MAX_WORKERS = 256
+BUCKET_SLOTS = 4096
+BUCKET_PROBES = 8
+WORKERS_OFFSET = HEADER.size
+BUCKETS_OFFSET = WORKERS_OFFSET + WORKER.size * MAX_WORKERS
+FILE_SIZE = BUCKETS_OFFSET + BUCKET.size * BUCKET_SLOTS
+
+WAIT_POLL_SECONDS = 0.005
+SERVICE_TIME_SMOOTHING = 0.05
+
+
+class SharedState:
+    """Rate-limit and admission counters shared by all processes on the host"""
+
+    def __init__(self, path=RATE_LIMIT_FILE):
+        self.path = path
+        self._pid = None
+        self._thread_lock = threading.Lock()
+
+    def _open(self):
+        """Map the file once per process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, FILE_SIZE)
+        self._pid = os.getpid()
+
+    def locked(self):
+        """Hold the cross-process lock (and the in-process one) while in use"""
+        self._open()
+        return _Locked(self)
+
+    # Token buckets
+
+    def take(self, key, per_minute, now):
+        """Take one token from key's bucket; return seconds to wait if empty"""
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+        rate = per_minute / 60.0
+        with self.locked():
+            slot = self._find_slot(key_hash, now)
+            stored_hash, tokens, updated = BUCKET.unpack_from(self._map, slot)
+            if stored_hash != key_hash:
+                tokens, updated = float(per_minute), now
+            tokens = min(float(per_minute), tokens + (now - updated) * rate)
+            if tokens >= 1:
+                BUCKET.pack_into(self._map, slot, key_hash, tokens - 1, now)
+                return 0
+            BUCKET.pack_into(self._map, slot, key_hash, tokens, now)
+            return (1 - tokens) / rate
+
+    def _find_slot(self, key_hash, now):
+        """Offset of key's bucket, reusing the stalest probed slot for new keys"""
+        start = key_hash % BUCKET_SLOTS
+        stalest, stalest_time = None, None
+        for probe in range(BUCKET_PROBES):
+            offset = BUCKETS_OFFSET + BUCKET.size * ((start + probe) % BUCKET_SLOTS)
+            stored_hash, _, updated = BUCKET.unpack_from(self._map, offset)
+            if stored_hash == key_hash:
+                return offset
+            if stored_hash == 0:
+                return offset
+            if stalest_time is None or updated < stalest_time:
+                stalest, stalest_time = offset, updated
+        return stalest
+
+    # Admission
+
+    def _worker_offset(self, pid):
+        """Offset of pid's row, claiming a free one if needed"""
+        free = None
+        for index in range(MAX_WORKERS):
+            offset = WORKERS_OFFSET + WORKER.size * index
+            row_pid, active, waiting = WORKER.unpack_from(self._map, offset)
+            if row_pid == pid:
+                return offset
+            if free is None and row_pid == 0:
+                free = offset
+        if free is not None:
+            WORKER.pack_into(self._map, free, pid, 0, 0)
+        return free
+
+    def _totals(self):
+        active = waiting = 0
+        for index in range(MAX_WORKERS):
+            offset = WORKERS_OFFSET + WORKER.size * index
+            row_pid, row_active, row_waiting = WORKER.unpack_from(self._map, offset)
+            if not row_pid:
+                continue
+            if not _alive(row_pid):
+                # Its worker died without child_exit running (e.g. the master was killed);
+                # freeing the row also keeps dead pids from filling the table
+                WORKER.pack_into(self._map, offset, 0, 0, 0)
+                continue
+            active += row_active
+            waiting += row_waiting
+        return active, waiting
+
+    def _add(self, offset, active=0, waiting=0):
+        row_pid, row_active, row_waiting = WORKER.unpack_from(self._map, offset)
+        WORKER.pack_into(self._map, offset, row_pid, max(0, row_active + active), max(0, row_waiting + waiting))
+
+    def admit(self, max_active, deadline):
+        """Wait for an in-flight slot; return None when admitted, else seconds to retry after"""
+        pid = os.getpid()
+        give_up = time.monotonic() + deadline
+        queued = False
+        while True:
+            with self.locked():
+                offset = self._worker_offset(pid)
+                if offset is None:
+                    # Out of worker rows; never block on bookkeeping
+                    return None
+                active, waiting = self._totals()
+                if active < max_active:
+                    self._add(offset, active=1, waiting=-1 if queued else 0)
+                    return None
+
+                # Everyone queued ahead needs a slot first
+                service_time, = HEADER.unpack_from(self._map, 0)
+                expected_wait = (waiting + (0 if queued else 1)) * service_time / max_active
+                if expected_wait > deadline or time.monotonic() >= give_up:
+                    if queued:
+                        self._add(offset, waiting=-1)
+                    return max(expected_wait, WAIT_POLL_SECONDS)
+                if not queued:
+                    self._add(offset, waiting=1)
+                    queued = True
+            time.sleep(WAIT_POLL_SECONDS)
+
+    def release(self, service_seconds):
+        """Give back an in-flight slot and update the smoothed service time"""
+        with self.locked():
+            offset = self._worker_offset(os.getpid())
+            if offset is not None:
+                self._add(offset, active=-1)
+            service_time, = HEADER.unpack_from(self._map, 0)
+            service_time += SERVICE_TIME_SMOOTHING * (service_seconds - service_time)
+            HEADER.pack_into(self._map, 0, service_time)
+
+    def reset_workers(self):
+        """Clear every worker row, left over from an earlier run of the server"""
+        with self.locked():
+            self._map[WORKERS_OFFSET:BUCKETS_OFFSET] = bytes(BUCKETS_OFFSET - WORKERS_OFFSET)
+
+    def forget_worker(self, pid):
+        """Drop a dead worker's row so its slots do not leak"""
+        with self.locked():
+            for index in range(MAX_WORKERS):
+                offset = WORKERS_OFFSET + WORKER.size * index
+                if WORKER.unpack_from(self._map, offset)[0] == pid:
+                    WORKER.pack_into(self._map, offset, 0, 0, 0)
+
+
+def _alive(pid):
+    """Whether a process with this pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Locked:
+    def __init__(self, state):
+        self.state = state
+
+    def __enter__(self):
+        self.state._thread_lock.acquire()
+        fcntl.lockf(self.state._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.state._fd, fcntl.LOCK_UN)
+        self.state._thread_lock.release()
+
+
+state = SharedState()
+
+
+def route_class():
+    """Rate-limit class of the current request, or None for unlimited"""
+    if request.endpoint in AUTH_ENDPOINTS and request.method == 'POST':
+        return 'auth'
+    if request.endpoint in SEARCH_ENDPOINTS or request.args.get('search'):
+        return 'search'
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return 'write'
+    return None
+
+
+def session_user_id():
+    """The logged-in user's id, read from the session without loading the user row"""
+    user_id = session.get('_user_id')
+    if user_id is not None:
+        return int(user_id)
+    # Only a remember-me login without a session needs the login manager
+    return current_user.id if current_user.is_authenticated else None
+
+
+def client_key():
+    """The user's id once logged in, their address before that"""
+    user_id = session_user_id()
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"addr:{request.remote_addr}"
+
+
+def refuse(status, message, retry_after):
+    """Fast rejection with a Retry-After hint"""
+    if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+        response = jsonify(error=message)
+    else:
+        response = Response(message, mimetype='text/plain')
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def init_app(app):
+    """Check rate limits and admit requests before they reach a view"""
+    if not RATE_LIMIT_ENABLED:
+        return
+
+    @app.before_request
+    def check_admission():
+        if request.endpoint in EXEMPT_ENDPOINTS or request.endpoint is None:
+            return None
+
+        limit_class = route_class()
+        if limit_class:
+            wait = state.take(f"{limit_class}:{client_key()}", RATE_LIMITS[limit_class], time.time())
+            if wait:
+                metrics.incr(f'rate_limited_{limit_class}')
+                return refuse(429, 'Too many requests, please slow down.', wait)
+
+        if ADMISSION_MAX_ACTIVE:
+            retry_after = state.admit(ADMISSION_MAX_ACTIVE, ADMISSION_DEADLINE_MS / 1000)
+            if retry_after is not None:
+                metrics.incr('admission_rejected')
+                return refuse(503, 'The server is busy, please try again shortly.', retry_after)
+            request.environ['admission.started'] = time.monotonic()
+        return None
+
+    @app.teardown_request
+    def release_admission(exc):
+        started = request.environ.pop('admission.started', None)
+        if started is not None:
+            state.release(time.monotonic() - started)
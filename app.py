@@ -1,13 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
-from database import db_manager, User, Task, Category
+from database import (db_manager, User, Task, Category, Notification, Digest, SmartList, data_version, clean_tags,
+                      TASK_STATUSES, TASK_PRIORITIES, SMART_LIST_MAX_PER_USER)
+import task_transfer
+import task_sync
+import task_rollup
+import events
+import assets
+import metrics
+import template_cache
+import page_cache
+import profiling
+import admission
+import typeahead
+import recurrence
+import tag_index
+import smart_lists
+from compression import CompressionMiddleware
 from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
+import time
 
-# Load environment variables
-load_dotenv()
+# Environment variables from .env are loaded once when database is imported
+
+# Used to report how long a worker takes from import to its first response
+BOOT_STARTED = time.perf_counter()
 
 # Template constants to avoid duplication
 TEMPLATE_REGISTER = 'register.html'
@@ -18,6 +36,7 @@ TEMPLATE_CREATE_TASK = 'create_task.html'
 TEMPLATE_EDIT_TASK = 'edit_task.html'
 TEMPLATE_CATEGORIES = 'categories.html'
 TEMPLATE_PROFILE = 'profile.html'
+TEMPLATE_HISTORY = 'history.html'
 TEMPLATE_INDEX = 'index.html'
 
 app = Flask(__name__)
@@ -25,6 +44,21 @@ app = Flask(__name__)
 # Configuration
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
+# Fingerprinted static assets (built by assets.py)
+assets.init_app(app)
+
+# Compiled templates are shared between workers through a bytecode cache
+template_cache.init_app(app)
+
+# Opt-in sampling profiler (PROFILE_ENABLED); adds nothing when disabled
+profiling.init_app(app)
+
+# Per-user rate limits and a global cap on in-flight requests
+admission.init_app(app)
+
+# Negotiated gzip/brotli compression of HTML and JSON responses
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -38,6 +72,38 @@ login_manager.login_message = 'Please log in to access this page.'
 def load_user(user_id):
     return User.get_by_id(int(user_id))
 
+_first_response_recorded = False
+
+@app.after_request
+def record_first_response(response):
+    """Record the worker's boot-to-first-response time once"""
+    global _first_response_recorded
+    if not _first_response_recorded:
+        _first_response_recorded = True
+        metrics.set_value('worker_first_response_seconds', time.perf_counter() - BOOT_STARTED)
+    return response
+
+def warm_up():
+    """Prime pooled connections and caches before the worker takes traffic"""
+    started = time.perf_counter()
+    template_cache.load_all(app)
+    connections = db_manager.warm_up()
+    Category.get_shared()
+    elapsed = time.perf_counter() - started
+    metrics.set_value('worker_warm_up_seconds', elapsed)
+    return connections, elapsed
+
+@app.context_processor
+def inject_events_url():
+    """URL of the live task event stream for the logged-in user"""
+    if not current_user.is_authenticated:
+        return {}
+    url = events.events_url(app.config['SECRET_KEY'], current_user.id)
+    if url is None and events.local_stream_enabled:
+        url = url_for('events_stream')
+    # Without a broker, sync workers must not be tied up by open streams
+    return {'events_url': url} if url else {}
+
 # Routes
 
 @app.route('/')
@@ -113,19 +179,55 @@ def logout():
 @login_required
 def dashboard():
     """User dashboard with statistics"""
+    # Pending flash messages are rendered into the page, so never cache those
+    key = None
+    if '_flashes' not in session:
+        key = page_cache.page_key('dashboard', current_user.id, data_version(current_user.id))
+        body = page_cache.cache.get(key)
+        if body is not None:
+            metrics.incr('dashboard_cache_hit')
+            return Response(body, mimetype='text/html')
+        metrics.incr('dashboard_cache_miss')
+    
     # Get user's task statistics using raw SQL
     stats = Task.get_stats_by_user(current_user.id)
     
     # Get recent tasks
     recent_tasks = Task.get_by_user(current_user.id)[:5]  # Get first 5 tasks
     
-    return render_template(TEMPLATE_DASHBOARD,
+    # Due-date reminders recorded by the reminder scheduler
+    notifications = Notification.get_unread_by_user(current_user.id)
+    
+    # Today's digest from task_digest.py, if it has run
+    digest = Digest.get_for_user(current_user.id)
+    
+    html = render_template(TEMPLATE_DASHBOARD,
                          total_tasks=stats['total'],
                          completed_tasks=stats['completed'],
                          pending_tasks=stats['pending'],
                          in_progress_tasks=stats['in_progress'],
                          recent_tasks=recent_tasks,
-                         overdue_tasks=stats['overdue'])
+                         overdue_tasks=stats['overdue'],
+                         notifications=notifications,
+                         digest=digest)
+    
+    if key:
+        # The overdue count changes on its own once the next due date passes
+        ttl = page_cache.ttl_until(Task.get_next_due(current_user.id))
+        if ttl > 0:
+            page_cache.cache.set(key, html.encode('utf-8'), ttl)
+    return html
+
+@app.route('/notifications/read', methods=['POST'])
+@login_required
+def read_notifications():
+    """Mark all notifications as read"""
+    try:
+        Notification.mark_all_read(current_user.id)
+    except Exception as e:
+        flash('Failed to update notifications. Please try again.', 'error')
+    
+    return redirect(url_for('dashboard'))
 
 @app.route('/tasks')
 @login_required
@@ -136,34 +238,200 @@ def tasks():
     category_filter = request.args.get('category', '')
     priority_filter = request.args.get('priority', '')
     search_query = request.args.get('search', '')
+    tag_filter = request.args.get('tags', '').strip()
+    # Archived (long-completed) tasks are only read when asked for
+    show_history = request.args.get('history') == '1'
+    sort = request.args.get('sort', 'created')
+    if sort not in Task.SORT_ORDERS:
+        sort = 'created'
     
     # Use raw SQL to get filtered tasks
     category_id = int(category_filter) if category_filter else None
-    tasks = Task.get_by_user(
-        user_id=current_user.id,
-        status=status_filter if status_filter else None,
-        category_id=category_id,
-        search=search_query if search_query else None
-    )
+    saved_lists = smart_lists.cache.get_for_user(current_user.id)
+    smart_list = None
+    pager = None
+    list_id = request.args.get('list', type=int)
+    if list_id:
+        # A page of the list's cached ids, fetched by primary key
+        opened = smart_lists.cache.open(current_user.id, list_id, request.args.get('page', 1, type=int))
+        if opened is None:
+            flash('Smart list not found!', 'error')
+            return redirect(url_for('tasks'))
+        smart_list, tasks, pager = opened
+        status_filter = smart_list.status or ''
+        category_filter = str(smart_list.category_id or '')
+        priority_filter = smart_list.priority or ''
+        search_query = smart_list.search or ''
+        tag_filter = ''
+        show_history = False
+        sort = smart_list.sort
+    elif tag_filter:
+        # Tags and the other exact filters are matched and sorted in this
+        # worker's bitmap index; SQL narrows a search and fetches one page
+        within = None
+        if search_query:
+            within = Task.get_ids_matching(current_user.id, search_query, include_archived=show_history)
+        page_ids, pager = tag_index.cache.page(
+            current_user.id,
+            tag_filter,
+            status=status_filter if status_filter else None,
+            category_id=category_id,
+            priority=priority_filter if priority_filter else None,
+            include_archived=show_history,
+            sort=sort,
+            within=within,
+            page=request.args.get('page', 1, type=int)
+        )
+        tasks = Task.get_by_user(
+            user_id=current_user.id,
+            include_archived=show_history,
+            task_ids=page_ids
+        )
+        position = {task_id: index for index, task_id in enumerate(page_ids)}
+        tasks.sort(key=lambda task: position[task.id])
+    else:
+        tasks = Task.get_by_user(
+            user_id=current_user.id,
+            status=status_filter if status_filter else None,
+            category_id=category_id,
+            priority=priority_filter if priority_filter else None,
+            search=search_query if search_query else None,
+            include_archived=show_history,
+            sort=sort
+        )
+    
+    # The plain list folds subtasks under their top-level task; they load when expanded
+    filtered = (status_filter or category_filter or priority_filter or search_query or tag_filter
+                or show_history)
+    if not filtered:
+        tasks = [task for task in tasks if not task.parent_id]
+    Task.attach_tags(tasks)
+    progress = Task.get_progress(current_user.id, [task.id for task in tasks])
     
-    # Filter by priority if specified
-    if priority_filter:
-        tasks = [task for task in tasks if task.priority == priority_filter]
+    categories = Category.get_for_user(current_user.id)
     
-    categories = Category.get_all()
+    # Repeating tasks: upcoming occurrences are expanded, not stored
+    window = recurrence.upcoming(current_user.id)
     
     return render_template(TEMPLATE_TASKS, 
                          tasks=tasks, 
                          categories=categories,
+                         progress=progress,
+                         smart_lists=saved_lists,
+                         smart_list=smart_list,
+                         pager=pager,
+                         upcoming=window.occurrences,
+                         repeating=window.by_task,
                          current_status=status_filter,
                          current_category=category_filter,
                          current_priority=priority_filter,
-                         current_search=search_query)
+                         current_search=search_query,
+                         current_tags=tag_filter,
+                         current_history=show_history,
+                         current_sort=sort)
+
+@app.route('/lists/new', methods=['POST'])
+@login_required
+def create_smart_list():
+    """Save the current Tasks page filters as a smart list"""
+    name = request.form.get('name', '').strip()
+    status = request.form.get('status', '')
+    category = request.form.get('category', '')
+    priority = request.form.get('priority', '')
+    search = request.form.get('search', '').strip()
+    sort = request.form.get('sort', 'created')
+    back = url_for('tasks', status=status, category=category, priority=priority, search=search, sort=sort)
+    
+    if not name or len(name) > 50:
+        flash('Smart list names must be 1 to 50 characters!', 'error')
+        return redirect(back)
+    if (status and status not in TASK_STATUSES) or (priority and priority not in TASK_PRIORITIES) \
+            or sort not in Task.SORT_ORDERS or len(search) > 200:
+        flash('Invalid filters!', 'error')
+        return redirect(back)
+    if not (status or category or priority or search):
+        flash('Pick at least one filter to save!', 'error')
+        return redirect(back)
+    if category and not (category.isdigit() and Category.lookup(int(category), current_user.id)):
+        flash('Invalid category selected!', 'error')
+        return redirect(back)
+    
+    existing = smart_lists.cache.get_for_user(current_user.id)
+    if len(existing) >= SMART_LIST_MAX_PER_USER:
+        flash(f'You can have at most {SMART_LIST_MAX_PER_USER} smart lists!', 'error')
+        return redirect(back)
+    if any(smart_list.name.lower() == name.lower() for smart_list in existing):
+        flash('You already have a smart list with that name!', 'error')
+        return redirect(back)
+    
+    try:
+        smart_list = SmartList.create(
+            user_id=current_user.id,
+            name=name,
+            status=status,
+            category_id=int(category) if category else None,
+            priority=priority,
+            search=search,
+            sort=sort
+        )
+    except Exception as e:
+        flash('Failed to save smart list. Please try again.', 'error')
+        return redirect(back)
+    flash('Smart list saved!', 'success')
+    return redirect(url_for('tasks', list=smart_list.id))
+
+@app.route('/lists/<int:list_id>/delete', methods=['POST'])
+@login_required
+def delete_smart_list(list_id):
+    """Delete a smart list; its tasks are untouched"""
+    smart_list = SmartList.get_by_id(list_id, current_user.id)
+    if not smart_list:
+        flash('Smart list not found!', 'error')
+    else:
+        smart_list.delete()
+        flash('Smart list deleted!', 'success')
+    return redirect(url_for('tasks'))
+
+def repeat_rule(form, due_date):
+    """Recurrence fields from the task form: (fields or None, error message or None)"""
+    frequency = form.get('repeat', '')
+    if not frequency:
+        return None, None
+    if frequency not in recurrence.FREQUENCIES:
+        return None, 'Invalid repeat option!'
+    if not due_date:
+        return None, 'A repeating task needs a due date!'
+    
+    try:
+        every = int(form.get('repeat_every') or 1)
+        times = int(form['repeat_times']) if form.get('repeat_times') else None
+        until = datetime.strptime(form['repeat_until'], '%Y-%m-%d').date() if form.get('repeat_until') else None
+        weekdays = recurrence.weekday_mask(day for day in form.getlist('repeat_weekdays') if 0 <= int(day) < 7)
+    except ValueError:
+        return None, 'Invalid repeat settings!'
+    if not 1 <= every <= recurrence.RECURRENCE_MAX_EVERY or (times is not None and times < 1):
+        return None, 'Invalid repeat settings!'
+    if until and until < due_date.date():
+        return None, 'The repeat end date is before the due date!'
+    
+    return {
+        'frequency': frequency,
+        'every': every,
+        'weekdays': weekdays if frequency == 'weekly' else 0,
+        'until': until,
+        'times': times,
+    }, None
 
 @app.route('/task/new', methods=['GET', 'POST'])
 @login_required
 def create_task():
-    """Create new task"""
+    """Create new task, as a subtask when a parent is given"""
+    parent_id = request.values.get('parent', type=int)
+    parent = Task.get_by_id(parent_id, user_id=current_user.id) if parent_id else None
+    if parent_id and not parent:
+        flash('Parent task not found!', 'error')
+        return redirect(url_for('tasks'))
+    
     if request.method == 'POST':
         title = request.form['title']
         description = request.form['description']
@@ -177,7 +445,37 @@ def create_task():
                 due_date = datetime.strptime(due_date_str, '%Y-%m-%d')
             except ValueError:
                 flash('Invalid date format!', 'error')
-                return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_all())
+                return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_for_user(current_user.id), parent=parent)
+        
+        if category_id and not Category.lookup(int(category_id), current_user.id):
+            flash('Invalid category!', 'error')
+            return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_for_user(current_user.id), parent=parent)
+        
+        rule, error = repeat_rule(request.form, due_date)
+        if rule and parent:
+            error = 'Subtasks cannot repeat!'
+        elif rule and clean_tags(request.form.get('tags', '')):
+            error = 'Repeating tasks cannot have tags yet!'
+        if error:
+            flash(error, 'error')
+            return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_for_user(current_user.id), parent=parent)
+        
+        if rule:
+            try:
+                recurrence.Recurrence.create(
+                    user_id=current_user.id,
+                    title=title,
+                    description=description,
+                    priority=priority,
+                    category_id=int(category_id) if category_id else None,
+                    starts_at=due_date,
+                    **rule
+                )
+                flash('Repeating task created successfully!', 'success')
+                return redirect(url_for('tasks'))
+            except Exception as e:
+                flash('Failed to create task. Please try again.', 'error')
+                return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_for_user(current_user.id), parent=parent)
         
         try:
             task = Task.create(
@@ -186,22 +484,38 @@ def create_task():
                 priority=priority,
                 due_date=due_date,
                 category_id=int(category_id) if category_id else None,
-                user_id=current_user.id
+                user_id=current_user.id,
+                parent_id=parent.id if parent else None,
+                tags=request.form.get('tags', '')
             )
             flash('Task created successfully!', 'success')
+            if parent:
+                return redirect(url_for('edit_task', task_id=parent.id))
             return redirect(url_for('tasks'))
         except Exception as e:
             flash('Failed to create task. Please try again.', 'error')
-            return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_all())
+            return render_template(TEMPLATE_CREATE_TASK, categories=Category.get_for_user(current_user.id), parent=parent)
     
-    categories = Category.get_all()
-    return render_template(TEMPLATE_CREATE_TASK, categories=categories)
+    categories = Category.get_for_user(current_user.id)
+    return render_template(TEMPLATE_CREATE_TASK, categories=categories, parent=parent)
+
+def render_edit_task(task):
+    """The edit page with the task's series, place in its tree and subtasks"""
+    Task.attach_tags([task])
+    subtasks = Task.get_subtree(task.id, current_user.id)
+    return render_template(TEMPLATE_EDIT_TASK,
+                           task=task,
+                           categories=Category.get_for_user(current_user.id),
+                           series=recurrence.Recurrence.get_by_task(task.id, current_user.id),
+                           ancestors=Task.get_ancestors(task.id, current_user.id),
+                           subtasks=subtasks,
+                           progress=Task.get_progress(current_user.id, [task.id]).get(task.id))
 
 @app.route('/task/<int:task_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_task(task_id):
     """Edit existing task"""
-    task = Task.get_by_id(task_id)
+    task = Task.get_by_id(task_id, user_id=current_user.id)
     if not task or task.user_id != current_user.id:
         flash('Task not found!', 'error')
         return redirect(url_for('tasks'))
@@ -212,6 +526,7 @@ def edit_task(task_id):
         priority = request.form['priority']
         status = request.form['status']
         category_id = request.form.get('category_id') or None
+        parent_id = request.form.get('parent_id', type=int)
         
         due_date = None
         due_date_str = request.form.get('due_date')
@@ -220,30 +535,38 @@ def edit_task(task_id):
                 due_date = datetime.strptime(due_date_str, '%Y-%m-%d')
             except ValueError:
                 flash('Invalid date format!', 'error')
-                return render_template(TEMPLATE_EDIT_TASK, task=task, categories=Category.get_all())
+                return render_edit_task(task)
+        
+        if category_id and not Category.lookup(int(category_id), current_user.id):
+            flash('Invalid category!', 'error')
+            return render_edit_task(task)
         
         try:
+            # A new parent moves the task in the same transaction as the edit
             task.update(
                 title=title,
                 description=description,
                 priority=priority,
                 status=status,
                 category_id=int(category_id) if category_id else None,
-                due_date=due_date
+                due_date=due_date,
+                parent_id=parent_id,
+                tags=request.form.get('tags', '')
             )
             flash('Task updated successfully!', 'success')
             return redirect(url_for('tasks'))
+        except ValueError:
+            flash('A task cannot move under itself or one of its subtasks!', 'error')
         except Exception as e:
             flash('Failed to update task. Please try again.', 'error')
     
-    categories = Category.get_all()
-    return render_template(TEMPLATE_EDIT_TASK, task=task, categories=categories)
+    return render_edit_task(task)
 
 @app.route('/task/<int:task_id>/delete', methods=['POST'])
 @login_required
 def delete_task(task_id):
     """Delete task"""
-    task = Task.get_by_id(task_id)
+    task = Task.get_by_id(task_id, user_id=current_user.id)
     if not task or task.user_id != current_user.id:
         flash('Task not found!', 'error')
         return redirect(url_for('tasks'))
@@ -256,12 +579,67 @@ def delete_task(task_id):
     
     return redirect(url_for('tasks'))
 
+def occurrence_from_form(series_id):
+    """The user's series and the occurrence time posted with a form, or (None, None)"""
+    series = recurrence.Recurrence.get_by_id(series_id, current_user.id)
+    try:
+        when = datetime.strptime(request.form.get('due', ''), '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        when = None
+    return (series, when) if series and when else (None, None)
+
+@app.route('/recurrence/<int:series_id>/skip', methods=['POST'])
+@login_required
+def skip_occurrence(series_id):
+    """Skip one upcoming occurrence of a repeating task"""
+    series, when = occurrence_from_form(series_id)
+    if series and series.skip(when):
+        flash(f'Skipped "{series.title}" on {when.strftime("%Y-%m-%d")}.', 'success')
+    else:
+        flash('Occurrence not found!', 'error')
+    return redirect(url_for('tasks'))
+
+@app.route('/recurrence/<int:series_id>/edit', methods=['POST'])
+@login_required
+def edit_occurrence(series_id):
+    """Turn an upcoming occurrence into its own task and open it for editing"""
+    series, when = occurrence_from_form(series_id)
+    task = series.materialize(when) if series else None
+    if task is None:
+        flash('Occurrence not found!', 'error')
+        return redirect(url_for('tasks'))
+    return redirect(url_for('edit_task', task_id=task.id))
+
+@app.route('/recurrence/<int:series_id>/stop', methods=['POST'])
+@login_required
+def stop_recurrence(series_id):
+    """Stop a task from repeating; existing tasks are kept"""
+    series = recurrence.Recurrence.get_by_id(series_id, current_user.id)
+    if series is None:
+        flash('Repeating task not found!', 'error')
+    else:
+        series.delete()
+        flash(f'"{series.title}" no longer repeats.', 'success')
+    return redirect(url_for('tasks'))
+
+@app.route('/api/recurrences/upcoming')
+@login_required
+def api_upcoming():
+    """Upcoming occurrences of repeating tasks for the next ?days= days"""
+    days = request.args.get('days', recurrence.RECURRENCE_WINDOW_DAYS, type=int)
+    window = recurrence.upcoming(current_user.id, max(1, min(days, 366)))
+    return jsonify(occurrences=[
+        dict(occurrence, due_date=occurrence['due_date'].strftime('%Y-%m-%d %H:%M:%S'))
+        for occurrence in window.occurrences
+    ])
+
 @app.route('/categories')
 @login_required
 def categories():
     """Manage categories"""
-    categories = Category.get_all()
-    return render_template(TEMPLATE_CATEGORIES, categories=categories)
+    categories = Category.get_for_user(current_user.id)
+    task_counts = Task.count_by_category(current_user.id)
+    return render_template(TEMPLATE_CATEGORIES, categories=categories, task_counts=task_counts)
 
 @app.route('/category/new', methods=['POST'])
 @login_required
@@ -271,8 +649,12 @@ def create_category():
     description = request.form.get('description', '')
     color = request.form.get('color', '#007bff')
     
+    if any(category.name.lower() == name.strip().lower() for category in Category.get_for_user(current_user.id)):
+        flash('You already have a category with that name!', 'error')
+        return redirect(url_for('categories'))
+    
     try:
-        category = Category.create(name=name, description=description, color=color)
+        category = Category.create(name=name, user_id=current_user.id, description=description, color=color)
         flash('Category created successfully!', 'success')
     except Exception as e:
         flash('Failed to create category. Please try again.', 'error')
@@ -311,7 +693,180 @@ def edit_profile():
     
     return redirect(url_for('profile'))
 
+def history_args():
+    """The ?days= and ?period= of a history request, clamped to what is offered"""
+    days = request.args.get('days', task_rollup.HISTORY_DAYS, type=int)
+    period = request.args.get('period', 'day')
+    if period not in task_rollup.PERIODS:
+        period = 'day'
+    return days, period
+
+@app.route('/history')
+@login_required
+def history():
+    """Created and completed tasks over time, from the daily rollups"""
+    days, period = history_args()
+    return render_template(TEMPLATE_HISTORY, history=task_rollup.history(current_user.id, days, period),
+                           current_days=days, current_period=period)
+
+@app.route('/api/stats/history')
+@login_required
+def api_history():
+    """The history page's numbers as JSON"""
+    days, period = history_args()
+    return jsonify(task_rollup.history(current_user.id, days, period))
+
+@app.route('/events')
+@login_required
+def events_stream():
+    """Live task events; local stand-in used by the development server without a broker"""
+    if not events.local_stream_enabled:
+        return 'Not Found', 404
+    return Response(
+        stream_with_context(events.stream(current_user.id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/export/<fmt>')
+@login_required
+def export_tasks(fmt):
+    """Stream all of the user's tasks as CSV or NDJSON"""
+    if fmt == 'csv':
+        chunks = task_transfer.export_csv(current_user.id)
+        mimetype = 'text/csv'
+    elif fmt == 'ndjson':
+        chunks = task_transfer.export_ndjson(current_user.id)
+        mimetype = 'application/x-ndjson'
+    else:
+        flash('Unknown export format!', 'error')
+        return redirect(url_for('profile'))
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=haatkhata-tasks.{fmt}'}
+    )
+
+@app.route('/import', methods=['POST'])
+@login_required
+def import_tasks():
+    """Import tasks from an uploaded CSV or NDJSON file"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a file to import.', 'error')
+        return redirect(url_for('profile'))
+    
+    try:
+        records = task_transfer.read_records(upload.stream, upload.filename)
+        count = task_transfer.import_tasks(current_user.id, records)
+        flash(f'Imported {count} tasks successfully!', 'success')
+    except ValueError as e:
+        flash(f'Import stopped: {e}', 'error')
+    except Exception as e:
+        flash('Failed to import tasks. Please try again.', 'error')
+    
+    return redirect(url_for('profile'))
+
+@app.route('/api/sync')
+@login_required
+def api_sync():
+    """Delta sync of the user's tasks
+    
+    With ?since=<cursor> returns the changes after that cursor; "created" and
+    "updated" carry the current task, "deleted" only its id. Without since,
+    returns a paged full snapshot (?after=<last task id>) together with the
+    cursor to continue from once the snapshot is complete.
+    """
+    limit = request.args.get('limit', task_sync.SYNC_BATCH_SIZE, type=int)
+    limit = max(1, min(limit, task_sync.SYNC_BATCH_SIZE))
+    since = request.args.get('since', type=int)
+    
+    if since is None:
+        # Take the cursor before the first page so writes made while the
+        # client pages through the snapshot are replayed afterwards
+        cursor = request.args.get('cursor', type=int)
+        if cursor is None:
+            cursor = task_sync.latest_cursor(current_user.id)
+        after = request.args.get('after', 0, type=int)
+        tasks, after, has_more = task_sync.snapshot(current_user.id, after, limit)
+        return jsonify(tasks=tasks, after=after, cursor=cursor, has_more=has_more)
+    
+    try:
+        changes, cursor, has_more = task_sync.changes_since(current_user.id, since, limit)
+    except task_sync.CursorExpired:
+        return jsonify(error='Cursor expired, start a full sync.', reset=True), 410
+    
+    return jsonify(changes=changes, cursor=cursor, has_more=has_more)
+
+@app.route('/api/tasks/<int:task_id>', methods=['PATCH'])
+@login_required
+def patch_task(task_id):
+    """Change a task's status or priority and return only what changed
+    
+    Expects a JSON object with "status" and/or "priority".
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    
+    allowed = {'status': Task.STATUSES, 'priority': Task.PRIORITIES}
+    unknown = set(data) - set(allowed)
+    if unknown or not data:
+        return jsonify(error='Only status and priority can be changed here.'), 400
+    for field, value in data.items():
+        if value not in allowed[field]:
+            return jsonify(error=f'Invalid {field}: {value}'), 400
+    
+    task = Task.patch(task_id, current_user.id, **data)
+    if task is None:
+        return jsonify(error='Task not found.'), 404
+    
+    changed = {'id': task.id, 'is_overdue': task.is_overdue}
+    for field in data:
+        changed[field] = getattr(task, field)
+        changed[f'{field}_color'] = getattr(task, f'{field}_color')
+    return jsonify(changed)
+
+@app.route('/api/tasks/<int:task_id>/subtasks')
+@login_required
+def api_subtasks(task_id):
+    """A task's direct subtasks with their own subtask counts, for expanding a tree"""
+    children = Task.get_children(task_id, current_user.id)
+    progress = Task.get_progress(current_user.id, [child.id for child in children])
+    return jsonify(subtasks=[
+        dict(child.to_dict(),
+             status_color=child.status_color,
+             priority_color=child.priority_color,
+             is_overdue=child.is_overdue,
+             progress=progress.get(child.id))
+        for child in children
+    ])
+
+@app.route('/api/tasks/suggest')
+def suggest_tasks():
+    """Task titles with a word starting with ?q=, for the search box"""
+    # Called on every pause in typing; the session's user id is enough, so
+    # skip login_required and the user row it would load
+    user_id = admission.session_user_id()
+    if user_id is None:
+        return login_manager.unauthorized()
+    prefix = request.args.get('q', '').strip()
+    limit = request.args.get('limit', typeahead.TYPEAHEAD_LIMIT, type=int)
+    limit = max(1, min(limit, typeahead.TYPEAHEAD_LIMIT))
+    matches = typeahead.cache.suggest(user_id, prefix, limit) if prefix else []
+    return jsonify(suggestions=[{'id': task_id, 'title': title} for task_id, title in matches])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Per-worker metrics, only available when METRICS_TOKEN is set"""
+    token = request.headers.get('X-Metrics-Token', '')
+    if not metrics.METRICS_TOKEN or token != metrics.METRICS_TOKEN:
+        return 'Not Found', 404
+    return Response(metrics.render(), mimetype='text/plain')
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
+    events.local_stream_enabled = True
     app.run(host='0.0.0.0', port=port, debug=debug)
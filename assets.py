@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Static asset pipeline for HaatKhata
+Run this script at build time. It minifies the CSS and JS under static/,
+writes content-hashed copies plus .gz and .br siblings to static/dist/ and
+records the mapping in static/dist/manifest.json. The app then links to the
+hashed files and serves them with immutable caching.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from flask import url_for, send_from_directory, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Source files that go through the pipeline, relative to static/
+ASSETS = ['css/style.css', 'js/main.js']
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def minify_css(source):
+    """Strip comments and redundant whitespace from a stylesheet"""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    source = source.replace(';}', '}')
+    return source.strip()
+
+
+def minify_js(source):
+    """Strip comments and indentation from a script, keeping line breaks"""
+    output = []
+    i = 0
+    length = len(source)
+    quote = None
+    while i < length:
+        char = source[i]
+        if quote:
+            output.append(char)
+            if char == '\\' and i + 1 < length:
+                output.append(source[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+            output.append(char)
+        elif source.startswith('//', i) and (not output or output[-1] in ' \t\n;{}(),'):
+            # Line comment; the newline itself is kept for automatic semicolons
+            while i < length and source[i] != '\n':
+                i += 1
+            continue
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            continue
+        else:
+            output.append(char)
+        i += 1
+
+    lines = (line.strip() for line in ''.join(output).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def build():
+    """Minify, fingerprint and pre-compress every asset and write the manifest"""
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(STATIC_DIR, name), encoding='utf-8') as f:
+            source = f.read()
+
+        minified = minify_css(source) if name.endswith('.css') else minify_js(source)
+        content = minified.encode('utf-8')
+        digest = hashlib.sha256(content).hexdigest()[:12]
+
+        root, ext = os.path.splitext(name)
+        hashed_name = f'{root}.{digest}{ext}'
+        target = os.path.join(DIST_DIR, hashed_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, 'wb') as f:
+            f.write(content)
+        with open(target + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(target + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+
+        manifest[name] = hashed_name
+        print(f"{name} -> dist/{hashed_name} ({len(source)} -> {len(content)} bytes)")
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest():
+    """Read the build manifest, or an empty one when assets were not built"""
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_app(app):
+    """Register the asset helper and the immutable asset route on the app"""
+    manifest = load_manifest()
+
+    def asset_url(filename, **values):
+        """url_for('static', ...) that prefers the fingerprinted build output"""
+        hashed_name = manifest.get(filename)
+        if hashed_name is None:
+            return url_for('static', filename=filename, **values)
+        return url_for('asset', filename=hashed_name, **values)
+
+    @app.route('/assets/<path:filename>', endpoint='asset')
+    def asset(filename):
+        """Serve a fingerprinted asset, pre-compressed when the client allows"""
+        accepted = {part.split(';')[0].strip()
+                    for part in request.headers.get('Accept-Encoding', '').split(',')}
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if candidate in accepted and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+                encoding = candidate
+                break
+
+        if encoding:
+            suffix = '.br' if encoding == 'br' else '.gz'
+            response = send_from_directory(DIST_DIR, filename + suffix)
+            # Keep the original type instead of application/gzip
+            response.mimetype = 'text/css' if filename.endswith('.css') else 'application/javascript'
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Disposition', None)
+        else:
+            response = send_from_directory(DIST_DIR, filename)
+
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+
+
+if __name__ == "__main__":
+    build()
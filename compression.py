@@ -0,0 +1,197 @@
+"""
+Response compression middleware for HaatKhata
+Negotiates brotli or gzip from Accept-Encoding and compresses HTML, JSON and
+other text responses on the fly, including streamed ones.
+"""
+
+import itertools
+import os
+import time
+import zlib
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression configuration from environment variables
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 500))
+
+COMPRESSIBLE_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/csv',
+    'application/json',
+    'application/javascript',
+    'application/x-ndjson',
+    'image/svg+xml',
+)
+
+
+def merge_vary(headers, field):
+    """The response's Vary fields with field added, each listed once"""
+    fields = {}
+    for name, value in headers:
+        if name.lower() == 'vary':
+            for part in value.split(','):
+                if part.strip():
+                    fields.setdefault(part.strip().lower(), part.strip())
+    if '*' in fields:
+        return '*'
+    fields.setdefault(field.lower(), field)
+    return ', '.join(fields.values())
+
+
+class CompressionMiddleware:
+    """WSGI middleware that compresses eligible responses"""
+
+    def __init__(self, app, level=COMPRESSION_LEVEL, brotli_quality=COMPRESSION_BROTLI_QUALITY,
+                 min_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+
+    def choose_encoding(self, accept_encoding):
+        """Pick the best encoding the client accepts, or None"""
+        accepted = set()
+        for part in accept_encoding.split(','):
+            name, _, params = part.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+                continue
+            accepted.add(name.strip().lower())
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def compressible(self, status, headers):
+        """Decide from the response status and headers alone
+
+        Anything else, event streams included, is passed through unbuffered.
+        """
+        if status[:3] in ('204', '206', '304'):
+            return False
+        content_type = ''
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == 'content-encoding':
+                return False
+            if lowered == 'content-type':
+                content_type = value.split(';')[0].strip().lower()
+            # Small complete bodies are not worth the CPU or the extra header bytes
+            if lowered == 'content-length' and value.strip().isdigit() and int(value) < self.min_size:
+                return False
+        return content_type in COMPRESSIBLE_TYPES
+
+    def compressor(self, encoding):
+        """Return (compress, flush, finish) callables for the encoding"""
+        if encoding == 'br':
+            engine = brotli.Compressor(quality=self.brotli_quality)
+            return engine.process, engine.flush, engine.finish
+        engine = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return engine.compress, lambda: engine.flush(zlib.Z_SYNC_FLUSH), engine.flush
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        state = {}
+
+        def capture(status, headers, exc_info=None):
+            state['status'] = status
+            state['headers'] = headers
+            state['exc_info'] = exc_info
+            return lambda data: None
+
+        app_iter = self.app(environ, capture)
+        return self.respond(app_iter, state, encoding, start_response)
+
+    def respond(self, app_iter, state, encoding, start_response):
+        """Yield the (possibly compressed) body, deciding once enough is known"""
+        try:
+            chunks = iter(app_iter)
+            pending = []
+            if 'status' not in state:
+                # Some apps only call start_response once the body is iterated
+                pending.extend(itertools.islice(chunks, 1))
+
+            headers = state.get('headers', [])
+            if not self.compressible(state.get('status', '200'), headers):
+                start_response(state['status'], headers, state.get('exc_info'))
+                yield from pending
+                yield from chunks
+                return
+
+            # Buffer until we know the body is big enough or has ended
+            size = sum(len(chunk) for chunk in pending)
+            finished = size < self.min_size
+            if finished:
+                for chunk in chunks:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size >= self.min_size:
+                        finished = False
+                        break
+            if finished:
+                start_response(state['status'], headers, state.get('exc_info'))
+                yield from pending
+                return
+
+            # Bodies with a known length arrive whole and need no intermediate flushes
+            streamed = not finished and not any(
+                name.lower() == 'content-length' for name, _ in headers
+            )
+            headers = [(name, value) for name, value in headers
+                       if name.lower() not in ('content-length', 'vary')] + [
+                ('Content-Encoding', encoding),
+                # Keep the app's own Vary (e.g. Cookie) so shared caches never mix users
+                ('Vary', merge_vary(headers, 'Accept-Encoding')),
+            ]
+            start_response(state['status'], headers, state.get('exc_info'))
+
+            compress, flush, finish = self.compressor(encoding)
+            elapsed = 0.0
+            raw_bytes = size
+            sent_bytes = 0
+
+            started = time.perf_counter()
+            data = compress(b''.join(pending))
+            if streamed:
+                # Streamed bodies are flushed chunk by chunk so clients see progress
+                data += flush()
+            elapsed += time.perf_counter() - started
+            if data:
+                sent_bytes += len(data)
+                yield data
+
+            for chunk in chunks:
+                raw_bytes += len(chunk)
+                started = time.perf_counter()
+                data = compress(chunk)
+                if streamed:
+                    data += flush()
+                elapsed += time.perf_counter() - started
+                if data:
+                    sent_bytes += len(data)
+                    yield data
+
+            started = time.perf_counter()
+            data = finish()
+            elapsed += time.perf_counter() - started
+            sent_bytes += len(data)
+            yield data
+
+            metrics.observe(f'compression_{encoding}', elapsed)
+            metrics.incr('compression_bytes_in', raw_bytes)
+            metrics.incr('compression_bytes_out', sent_bytes)
+            metrics.incr('compression_bytes_saved', raw_bytes - sent_bytes)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
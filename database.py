@@ -1,8 +1,16 @@
 
 import pymysql
+import bisect
+import hashlib
 import os
+import queue
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import lru_cache
+from pymysql.constants import CLIENT
 from werkzeug.security import generate_password_hash, check_password_hash
 from contextlib import contextmanager
 from dotenv import load_dotenv
@@ -19,40 +27,117 @@ DB_NAME = os.getenv("DB_NAME", "task_manager_db")
 DB_CHARSET = os.getenv("DB_CHARSET", "utf8mb4")
 DB_RETRY_SECONDS = int(os.getenv("DB_RETRY_SECONDS", 2))
 DB_RETRY_MAX = int(os.getenv("DB_RETRY_MAX", 10))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_PING_SECONDS = int(os.getenv("DB_POOL_PING_SECONDS", 30))
+CATEGORY_CACHE_SECONDS = int(os.getenv("CATEGORY_CACHE_SECONDS", 30))
+CATEGORY_CACHE_USERS = int(os.getenv("CATEGORY_CACHE_USERS", 10000))
+
+# Extra shards for per-user task data, as "name=host:port/database,..."
+# The database above is always the directory and the first shard
+DB_SHARDS = os.getenv("DB_SHARDS", "")
+SHARD_CACHE_SECONDS = int(os.getenv("SHARD_CACHE_SECONDS", 30))
+SHARD_CACHE_SIZE = 100000
+SHARD_VIRTUAL_NODES = 64
+
+# Each shard hands out ids from its own range so rows can move between shards
+SHARD_TASK_ID_SPAN = 100000000
+SHARD_CHANGE_ID_SPAN = 10 ** 15
+
+# Allowed task values in ascending order; stored as ENUMs, which take one
+# byte and sort in this order, so "high priority first" is an index scan
+TASK_STATUSES = ('pending', 'in_progress', 'completed')
+TASK_PRIORITIES = ('low', 'medium', 'high')
+STATUS_TYPE = f"enum({','.join(repr(value) for value in TASK_STATUSES)})"
+PRIORITY_TYPE = f"enum({','.join(repr(value) for value in TASK_PRIORITIES)})"
+TAG_MAX_LENGTH = 50
+TAG_MAX_PER_TASK = 20
+SMART_LIST_MAX_PER_USER = 20
+RECURRENCE_FREQUENCIES = ('daily', 'weekly', 'monthly')
+RECURRENCE_FREQUENCY_TYPE = f"enum({','.join(repr(value) for value in RECURRENCE_FREQUENCIES)})"
+
+# Categories every user sees; all other categories belong to one user
+DEFAULT_CATEGORIES = [
+    ('Work', 'Work-related tasks', '#007bff'),
+    ('Personal', 'Personal tasks and activities', '#28a745'),
+    ('Shopping', 'Shopping lists and errands', '#ffc107'),
+    ('Health', 'Health and fitness goals', '#dc3545'),
+    ('Learning', 'Educational and skill development', '#6f42c1'),
+]
+
+# Columns shared by task and task_archive
+TASK_ARCHIVE_COLUMNS = ("id, title, description, status, priority, due_date, created_at, updated_at, "
+                        "user_id, category_id, completed_at, parent_id")
+
+# Callbacks run after every task write, called as listener(action, task)
+task_listeners = []
+
+def on_task_change(listener):
+    """Register a callback for task creates, updates and deletes"""
+    task_listeners.append(listener)
+    return listener
+
+# Callbacks run after every statement, called as observer(query, seconds);
+# register them before the first connection is opened
+query_observers = []
+
+def on_query(observer):
+    """Register a callback that times every SQL statement"""
+    query_observers.append(observer)
+    return observer
+
+class TimedDictCursor(pymysql.cursors.DictCursor):
+    """DictCursor that reports each statement to the query observers"""
+    
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            elapsed = time.perf_counter() - started
+            for observer in query_observers:
+                observer(query, elapsed)
 
 class DatabaseManager:
     """Manages database connections and operations with retry logic"""
     
-    def __init__(self):
-        self.host = DB_HOST
-        self.port = DB_PORT
+    def __init__(self, name='default', index=0, host=DB_HOST, port=DB_PORT, database=DB_NAME):
+        self.name = name
+        self.index = index
+        self.host = host
+        self.port = port
         self.user = DB_USER
         self.password = DB_PASS
-        self.database = DB_NAME
+        self.database = database
         self.charset = DB_CHARSET
+        # Idle connections are kept per process; a forked worker starts empty
+        self._pid = os.getpid()
+        self._pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
     
-    @contextmanager
-    def get_connection(self):
-        """Context manager for database connections with retry logic"""
+    def connect(self, **options):
+        """Open a new connection, retrying while the server is unavailable
+        
+        options are passed on to pymysql.connect(), e.g. local_infile=True
+        for bulk loads.
+        """
         last_exc = None
         for attempt in range(1, DB_RETRY_MAX + 1):
             try:
-                connection = pymysql.connect(
+                return pymysql.connect(
                     host=self.host,
                     port=self.port,
                     user=self.user,
                     password=self.password,
                     database=self.database,
                     charset=self.charset,
-                    cursorclass=pymysql.cursors.DictCursor,
+                    # Untimed unless something observes queries
+                    cursorclass=TimedDictCursor if query_observers else pymysql.cursors.DictCursor,
                     autocommit=True,
-                    connect_timeout=5
+                    connect_timeout=5,
+                    # Count matched rather than changed rows, so an owner-scoped
+                    # UPDATE can tell "not yours" from "nothing to change"
+                    client_flag=CLIENT.FOUND_ROWS,
+                    **options
                 )
-                try:
-                    yield connection
-                finally:
-                    connection.close()
-                return
             except Exception as e:
                 last_exc = e
                 print(f"DB connection attempt {attempt}/{DB_RETRY_MAX} failed: {e}")
@@ -62,6 +147,100 @@ class DatabaseManager:
         # If we get here all retries failed — raise the last exception
         raise last_exc
     
+    def reset(self, close=True):
+        """Forget all pooled connections, e.g. in a freshly forked worker"""
+        old_pool = self._pool
+        self._pid = os.getpid()
+        self._pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        # Sockets inherited from the parent process must not be closed
+        # politely from the child, or the parent's session would end too
+        while close:
+            try:
+                connection, _ = old_pool.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+    
+    def warm_up(self, count=DB_POOL_SIZE):
+        """Open pooled connections ahead of the first requests"""
+        connections = [self.acquire() for _ in range(min(count, DB_POOL_SIZE))]
+        for connection in connections:
+            self.release(connection)
+        return len(connections)
+    
+    def acquire(self):
+        """Take an idle connection from the pool or open a new one"""
+        if self._pid != os.getpid():
+            self.reset(close=False)
+        while True:
+            try:
+                connection, last_used = self._pool.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if time.monotonic() - last_used < DB_POOL_PING_SECONDS:
+                return connection
+            # Connections idle for a while may have been dropped by the server
+            try:
+                connection.ping(reconnect=False)
+                return connection
+            except Exception:
+                self._discard(connection)
+    
+    def release(self, connection):
+        """Return a healthy connection to the pool"""
+        if self._pid != os.getpid() or not connection.open:
+            self._discard(connection)
+            return
+        try:
+            self._pool.put_nowait((connection, time.monotonic()))
+        except queue.Full:
+            self._discard(connection)
+    
+    def _discard(self, connection):
+        """Close a connection, ignoring errors from already closed ones"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+    
+    @contextmanager
+    def get_connection(self):
+        """Context manager for pooled database connections with retry logic"""
+        # Only connecting is retried; errors raised by the caller propagate
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            # A failed statement may leave the connection in an unknown state
+            self._discard(connection)
+            raise
+        else:
+            self.release(connection)
+    
+    @contextmanager
+    def transaction(self):
+        """Context manager yielding a cursor whose statements commit together"""
+        with self.get_connection() as conn:
+            conn.begin()
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def stream_query(self, query, params=None, chunk_size=1000):
+        """Yield lists of rows from an unbuffered server-side cursor"""
+        with self.get_connection() as conn:
+            with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+                cursor.execute(query, params or ())
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+    
     def execute_query(self, query, params=None, fetch=False, fetch_all=True):
         """Execute SQL query and return results"""
         with self.get_connection() as conn:
@@ -73,11 +252,341 @@ class DatabaseManager:
                     else:
                         return cursor.fetchone()
                 else:
+                    # Statements without a result set (INSERT/UPDATE/DELETE)
+                    # return the new row id so create() can load the row back
+                    if cursor.description is None:
+                        return cursor.lastrowid
                     try:
                         return cursor.fetchall()
                     except:
                         return None
     
+    def ensure_column_type(self, table, name, column_type, definition):
+        """Change a column's definition unless it already has column_type"""
+        existing = self.execute_query(
+            """
+            SELECT COLUMN_TYPE as column_type FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            """,
+            (table, name),
+            fetch=True,
+            fetch_all=False
+        )
+        if existing and existing['column_type'] != column_type:
+            self.execute_query(f"ALTER TABLE {table} MODIFY COLUMN {name} {definition}")
+    
+    def ensure_index(self, table, name, columns):
+        """Create an index on an existing table if it is missing"""
+        existing = self.execute_query(
+            """
+            SELECT COUNT(*) as count FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            """,
+            (table, name),
+            fetch=True,
+            fetch_all=False
+        )
+        if existing['count'] == 0:
+            self.execute_query(f"CREATE INDEX {name} ON {table} ({columns})")
+    
+    def ensure_column(self, table, name, definition):
+        """Add a column to an existing table if it is missing; True if it was added"""
+        existing = self.execute_query(
+            """
+            SELECT COUNT(*) as count FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            """,
+            (table, name),
+            fetch=True,
+            fetch_all=False
+        )
+        if existing['count'] == 0:
+            self.execute_query(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+            return True
+        return False
+    
+    def init_shard_tables(self, foreign_keys=False):
+        """Create the per-user tables that live on every shard"""
+        # Only the directory database also holds user and category, so only
+        # there can the per-user tables reference them
+        user_fk = ",\n            FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE" if foreign_keys else ""
+        category_fk = ",\n            FOREIGN KEY (category_id) REFERENCES category(id) ON DELETE SET NULL" if foreign_keys else ""
+        
+        # Create tasks table
+        tasks_table = f"""
+        CREATE TABLE IF NOT EXISTS task (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            title VARCHAR(100) NOT NULL,
+            description TEXT,
+            status {STATUS_TYPE} DEFAULT 'pending',
+            priority {PRIORITY_TYPE} DEFAULT 'medium',
+            due_date DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            user_id INT NOT NULL,
+            category_id INT,
+            completed_at DATETIME,
+            parent_id INT{user_fk}{category_fk}
+        )
+        """
+        
+        # In-app notifications (due-date reminders and friends)
+        notifications_table = f"""
+        CREATE TABLE IF NOT EXISTS notification (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            task_id INT,
+            kind VARCHAR(20) NOT NULL,
+            message VARCHAR(255) NOT NULL,
+            due_date DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            read_at DATETIME,
+            UNIQUE KEY uq_notification_task_due (task_id, kind, due_date),
+            INDEX idx_notification_user (user_id, read_at),
+            FOREIGN KEY (task_id) REFERENCES task(id) ON DELETE CASCADE{user_fk}
+        )
+        """
+        
+        # Tasks whose due date changed since the reminder scheduler last looked
+        due_changes_table = """
+        CREATE TABLE IF NOT EXISTS task_due_change (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            task_id INT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        
+        # Append-only per-user log of task writes for delta sync
+        task_changes_table = """
+        CREATE TABLE IF NOT EXISTS task_changes (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            task_id INT NOT NULL,
+            action VARCHAR(10) NOT NULL,
+            changed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_task_changes_user (user_id, id)
+        )
+        """
+        
+        # Completed tasks moved out of the hot task table by task_archive.py
+        archive_table = f"""
+        CREATE TABLE IF NOT EXISTS task_archive (
+            id INT PRIMARY KEY,
+            title VARCHAR(100) NOT NULL,
+            description TEXT,
+            status {STATUS_TYPE},
+            priority {PRIORITY_TYPE},
+            due_date DATETIME,
+            created_at DATETIME,
+            updated_at DATETIME,
+            user_id INT NOT NULL,
+            category_id INT,
+            completed_at DATETIME,
+            parent_id INT,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_task_archive_user (user_id){user_fk}
+        )
+        """
+        
+        # Archived completed tasks per user, so stats never read the archive
+        archive_count_table = """
+        CREATE TABLE IF NOT EXISTS task_archive_count (
+            user_id INT PRIMARY KEY,
+            completed INT NOT NULL DEFAULT 0
+        )
+        """
+        
+        # One row per user, locked to serialize that user's task writes; its
+        # version goes up with every change to the user's data
+        owner_lock_table = """
+        CREATE TABLE IF NOT EXISTS task_owner_lock (
+            user_id INT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        """
+        
+        # Tasks created and completed per user, day and category (0 for
+        # none), kept current by task writes and rebuilt by task_rollup.py
+        rollup_table = """
+        CREATE TABLE IF NOT EXISTS task_daily_rollup (
+            user_id INT NOT NULL,
+            day DATE NOT NULL,
+            category_id INT NOT NULL DEFAULT 0,
+            created INT NOT NULL DEFAULT 0,
+            completed INT NOT NULL DEFAULT 0,
+            lead_seconds BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, category_id)
+        )
+        """
+        
+        # Every ancestor and descendant pair of the subtask trees, so a
+        # subtree, a breadcrumb or a progress count is one indexed read.
+        # task.parent_id is the source; Task.rebuild_closure recomputes it
+        closure_table = """
+        CREATE TABLE IF NOT EXISTS task_closure (
+            ancestor_id INT NOT NULL,
+            descendant_id INT NOT NULL,
+            depth INT NOT NULL,
+            user_id INT NOT NULL,
+            PRIMARY KEY (ancestor_id, depth, descendant_id),
+            INDEX idx_task_closure_descendant (descendant_id, depth),
+            INDEX idx_task_closure_user (user_id, ancestor_id)
+        )
+        """
+        
+        # Tags on tasks, any number per task; archived tasks keep theirs
+        tag_table = f"""
+        CREATE TABLE IF NOT EXISTS task_tag (
+            task_id INT NOT NULL,
+            user_id INT NOT NULL,
+            name VARCHAR({TAG_MAX_LENGTH}) NOT NULL,
+            PRIMARY KEY (task_id, name),
+            INDEX idx_task_tag_user (user_id, name)
+        )
+        """
+        
+        # Repeating tasks: the rule and the fields each occurrence gets. Only
+        # the current occurrence is a task row; the rest are expanded on demand
+        recurrence_table = f"""
+        CREATE TABLE IF NOT EXISTS task_recurrence (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title VARCHAR(100) NOT NULL,
+            description TEXT,
+            priority {PRIORITY_TYPE} DEFAULT 'medium',
+            category_id INT,
+            frequency {RECURRENCE_FREQUENCY_TYPE} NOT NULL,
+            every INT NOT NULL DEFAULT 1,
+            weekdays TINYINT NOT NULL DEFAULT 0,
+            starts_at DATETIME NOT NULL,
+            until DATE,
+            times INT,
+            next_at DATETIME,
+            current_task_id INT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_task_recurrence_user (user_id),
+            INDEX idx_task_recurrence_current (current_task_id)
+        )
+        """
+        # Occurrences that differ from the rule: skipped (no task_id) or
+        # turned into their own task ahead of time to be edited
+        recurrence_exception_table = """
+        CREATE TABLE IF NOT EXISTS task_recurrence_exception (
+            recurrence_id INT NOT NULL,
+            occurrence_at DATETIME NOT NULL,
+            task_id INT,
+            PRIMARY KEY (recurrence_id, occurrence_at),
+            INDEX idx_task_recurrence_exception_task (task_id)
+        )
+        """
+        
+        # Each user's daily digest of overdue and due-today tasks, written
+        # by task_digest.py, with the first few tasks listed
+        digest_table = """
+        CREATE TABLE IF NOT EXISTS task_digest (
+            user_id INT NOT NULL,
+            day DATE NOT NULL,
+            overdue INT NOT NULL DEFAULT 0,
+            due_today INT NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, day)
+        )
+        """
+        digest_item_table = f"""
+        CREATE TABLE IF NOT EXISTS task_digest_item (
+            user_id INT NOT NULL,
+            day DATE NOT NULL,
+            task_id INT NOT NULL,
+            title VARCHAR(100) NOT NULL,
+            priority {PRIORITY_TYPE},
+            due_date DATETIME NOT NULL,
+            PRIMARY KEY (user_id, day, task_id)
+        )
+        """
+        # Where each day's digest run has got to in its scan
+        digest_run_table = f"""
+        CREATE TABLE IF NOT EXISTS task_digest_run (
+            day DATE PRIMARY KEY,
+            last_due_date DATETIME,
+            last_status {STATUS_TYPE},
+            last_user_id INT,
+            last_task_id INT,
+            finished_at DATETIME
+        )
+        """
+        
+        # Small key/value table for background job state
+        sync_state_table = """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name VARCHAR(50) PRIMARY KEY,
+            value BIGINT NOT NULL
+        )
+        """
+        
+        self.execute_query(tasks_table)
+        self.execute_query(notifications_table)
+        self.execute_query(due_changes_table)
+        self.execute_query(task_changes_table)
+        self.execute_query(archive_table)
+        self.execute_query(archive_count_table)
+        self.execute_query(owner_lock_table)
+        self.execute_query(rollup_table)
+        self.execute_query(closure_table)
+        self.execute_query(tag_table)
+        self.execute_query(recurrence_table)
+        self.execute_query(recurrence_exception_table)
+        self.execute_query(digest_table)
+        self.execute_query(digest_item_table)
+        self.execute_query(digest_run_table)
+        self.execute_query(sync_state_table)
+        
+        self.ensure_column('task_owner_lock', 'version', 'BIGINT NOT NULL DEFAULT 0')
+        
+        # Older tables had no completion time; the last update stands in
+        for table in ('task', 'task_archive'):
+            if self.ensure_column(table, 'completed_at', 'DATETIME'):
+                self.execute_query(
+                    f"UPDATE {table} SET completed_at = updated_at WHERE status = 'completed'"
+                )
+        
+        # Older tables had no subtasks
+        for table in ('task', 'task_archive'):
+            self.ensure_column(table, 'parent_id', 'INT')
+        
+        # Older tables stored status and priority as VARCHAR
+        for table in ('task', 'task_archive'):
+            default = " DEFAULT 'pending'" if table == 'task' else ""
+            self.ensure_column_type(table, 'status', STATUS_TYPE, STATUS_TYPE + default)
+            default = " DEFAULT 'medium'" if table == 'task' else ""
+            self.ensure_column_type(table, 'priority', PRIORITY_TYPE, PRIORITY_TYPE + default)
+        
+        # Without the user foreign key there is no implicit user_id index
+        if not foreign_keys:
+            self.ensure_index('task', 'idx_task_user', 'user_id')
+        
+        # The reminder scheduler reads upcoming due dates in order
+        self.ensure_index('task', 'idx_task_due_date', 'due_date')
+        # Sort orders offered on the tasks page
+        self.ensure_index('task', 'idx_task_user_priority', 'user_id, priority, created_at')
+        self.ensure_index('task', 'idx_task_user_due', 'user_id, due_date')
+        # The archive job looks for tasks completed before its cutoff
+        self.ensure_index('task', 'idx_task_status_updated', 'status, updated_at')
+        # The digest job reads every open task due by today from this index alone
+        self.ensure_index('task', 'idx_task_due_status', 'due_date, status, user_id')
+        
+        # Start this shard's ids in its own range
+        if self.index:
+            for table, span in (('task', SHARD_TASK_ID_SPAN),
+                                ('notification', SHARD_TASK_ID_SPAN),
+                                ('task_recurrence', SHARD_TASK_ID_SPAN),
+                                ('task_changes', SHARD_CHANGE_ID_SPAN)):
+                self.execute_query(f"ALTER TABLE {table} AUTO_INCREMENT = {self.index * span + 1}")
+    
+    def change_id_range(self):
+        """Range (start, end) of task_changes ids handed out by this shard"""
+        start = self.index * SHARD_CHANGE_ID_SPAN
+        return start, start + SHARD_CHANGE_ID_SPAN
+    
     def init_database(self):
         """Initialize database tables"""
         # Create users table
@@ -93,50 +602,72 @@ class DatabaseManager:
         )
         """
         
-        # Create categories table
+        # Create categories table; shared defaults have no user_id
         categories_table = """
         CREATE TABLE IF NOT EXISTS category (
             id INT AUTO_INCREMENT PRIMARY KEY,
             name VARCHAR(50) NOT NULL,
             description TEXT,
             color VARCHAR(7) DEFAULT '#007bff',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_id INT,
+            FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
         )
         """
         
-        # Create tasks table
-        tasks_table = """
-        CREATE TABLE IF NOT EXISTS task (
+        # Which shard holds each user's tasks
+        user_shard_table = """
+        CREATE TABLE IF NOT EXISTS user_shard (
+            user_id INT PRIMARY KEY,
+            shard VARCHAR(50) NOT NULL
+        )
+        """
+        
+        # Progress of users being moved between shards
+        shard_move_table = """
+        CREATE TABLE IF NOT EXISTS shard_move (
+            user_id INT PRIMARY KEY,
+            source VARCHAR(50) NOT NULL,
+            target VARCHAR(50) NOT NULL,
+            phase VARCHAR(20) NOT NULL,
+            change_cursor BIGINT NOT NULL DEFAULT 0,
+            last_task_id INT NOT NULL DEFAULT 0,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """
+        
+        # Saved task filters; a list goes when its user or category does
+        smart_list_table = f"""
+        CREATE TABLE IF NOT EXISTS smart_list (
             id INT AUTO_INCREMENT PRIMARY KEY,
-            title VARCHAR(100) NOT NULL,
-            description TEXT,
-            status VARCHAR(20) DEFAULT 'pending',
-            priority VARCHAR(10) DEFAULT 'medium',
-            due_date DATETIME,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
             user_id INT NOT NULL,
+            name VARCHAR(50) NOT NULL,
+            status {STATUS_TYPE},
             category_id INT,
+            priority {PRIORITY_TYPE},
+            search VARCHAR(200),
+            sort VARCHAR(20) NOT NULL DEFAULT 'created',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_smart_list_user_name (user_id, name),
             FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE,
-            FOREIGN KEY (category_id) REFERENCES category(id) ON DELETE SET NULL
+            FOREIGN KEY (category_id) REFERENCES category(id) ON DELETE CASCADE
         )
         """
         
         # Execute table creation
         self.execute_query(users_table)
         self.execute_query(categories_table)
-        self.execute_query(tasks_table)
+        self.execute_query(user_shard_table)
+        self.execute_query(shard_move_table)
+        self.execute_query(smart_list_table)
+        self.init_shard_tables(foreign_keys=True)
+        
+        # Categories used to be global; each user now loads only the shared
+        # ones (user_id NULL) and their own
+        self.ensure_column('category', 'user_id', 'INT')
+        self.ensure_index('category', 'idx_category_user_name', 'user_id, name')
         
         # Insert default categories if they don't exist
-        default_categories = [
-            ('Work', 'Work-related tasks', '#007bff'),
-            ('Personal', 'Personal tasks and activities', '#28a745'),
-            ('Shopping', 'Shopping lists and errands', '#ffc107'),
-            ('Health', 'Health and fitness goals', '#dc3545'),
-            ('Learning', 'Educational and skill development', '#6f42c1'),
-        ]
-        
-        # Check if categories exist
         existing_count = self.execute_query(
             "SELECT COUNT(*) as count FROM category", 
             fetch=True, 
@@ -144,14 +675,262 @@ class DatabaseManager:
         )
         
         if existing_count['count'] == 0:
-            for name, desc, color in default_categories:
+            for name, desc, color in DEFAULT_CATEGORIES:
                 self.execute_query(
                     "INSERT INTO category (name, description, color) VALUES (%s, %s, %s)",
                     (name, desc, color)
                 )
 
-# Initialize database manager
+def parse_shards(spec):
+    """Build a DatabaseManager for every entry of DB_SHARDS"""
+    managers = []
+    entries = [entry.strip() for entry in spec.split(',') if entry.strip()]
+    for index, entry in enumerate(entries, start=1):
+        name, _, location = entry.partition('=')
+        address, _, database = location.partition('/')
+        host, _, port = address.partition(':')
+        managers.append(DatabaseManager(
+            name=name.strip(),
+            index=index,
+            host=host,
+            port=int(port or 3306),
+            database=database or DB_NAME
+        ))
+    return managers
+
+class ShardMap:
+    """Routes each user's task data to the shard that holds it"""
+    
+    def __init__(self, directory, extra_shards=()):
+        self.directory = directory
+        self.shards = {directory.name: directory}
+        for shard in extra_shards:
+            self.shards[shard.name] = shard
+        
+        # Consistent-hash ring used to place new users
+        ring = sorted(
+            (self._hash(f"{name}#{node}"), name)
+            for name in self.shards
+            for node in range(SHARD_VIRTUAL_NODES)
+        )
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_names = [name for _, name in ring]
+        
+        self._cache = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+    
+    @property
+    def is_sharded(self):
+        return len(self.shards) > 1
+    
+    def all(self):
+        """Every shard, directory first"""
+        return list(self.shards.values())
+    
+    def get(self, name):
+        """Shard by name"""
+        return self.shards[name]
+    
+    def place(self, user_id):
+        """Pick the shard for a new user"""
+        if not self.is_sharded:
+            return self.directory.name
+        position = bisect.bisect(self._ring_hashes, self._hash(str(user_id)))
+        return self._ring_names[position % len(self._ring_names)]
+    
+    def assign(self, user_id, shard_name=None):
+        """Record the user's shard in the directory"""
+        shard_name = shard_name or self.place(user_id)
+        self.directory.execute_query(
+            """
+            INSERT INTO user_shard (user_id, shard) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE shard = VALUES(shard)
+            """,
+            (user_id, shard_name)
+        )
+        self.forget(user_id)
+        return shard_name
+    
+    def forget(self, user_id):
+        """Drop a cached directory entry"""
+        with self._lock:
+            self._cache.pop(user_id, None)
+    
+    def shard_name_for(self, user_id):
+        """Name of the shard holding the user's tasks"""
+        if not self.is_sharded:
+            return self.directory.name
+        
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        
+        row = self.directory.execute_query(
+            "SELECT shard FROM user_shard WHERE user_id = %s",
+            (user_id,),
+            fetch=True,
+            fetch_all=False
+        )
+        # Users from before sharding have no entry and stay on the directory
+        name = row['shard'] if row and row['shard'] in self.shards else self.directory.name
+        with self._lock:
+            if len(self._cache) >= SHARD_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[user_id] = (name, now + SHARD_CACHE_SECONDS)
+        return name
+    
+    def for_user(self, user_id):
+        """DatabaseManager of the shard holding the user's tasks"""
+        return self.shards[self.shard_name_for(user_id)]
+    
+    def scatter_gather(self, query, params=None, sort_key=None, reverse=False, limit=None):
+        """Run a read query on every shard in parallel and merge the rows
+        
+        Meant for the rare cross-user admin query; per-user code should use
+        for_user() so it only touches one shard.
+        """
+        if self.is_sharded:
+            with ThreadPoolExecutor(max_workers=len(self.shards)) as pool:
+                results = pool.map(
+                    lambda shard: shard.execute_query(query, params, fetch=True),
+                    self.shards.values()
+                )
+                rows = [row for result in results for row in result]
+        else:
+            rows = list(self.directory.execute_query(query, params, fetch=True))
+        
+        if sort_key:
+            rows.sort(key=sort_key, reverse=reverse)
+        return rows[:limit] if limit is not None else rows
+    
+    def init_all(self):
+        """Create tables on the directory and on every other shard"""
+        self.directory.init_database()
+        for shard in self.all():
+            if shard is not self.directory:
+                shard.init_shard_tables()
+
+# Initialize database manager (the directory) and the shard map
 db_manager = DatabaseManager()
+shards = ShardMap(db_manager, parse_shards(DB_SHARDS))
+
+def clean_tags(names):
+    """Tag names as stored, from a list or a comma-separated string
+    
+    Names are case-folded, with runs of spaces turned into single dashes,
+    and duplicates dropped.
+    """
+    if isinstance(names, str):
+        names = names.split(',')
+    cleaned = []
+    for name in names:
+        # Spaces, "|" and a leading "-" would clash with the filter syntax
+        name = '-'.join(name.casefold().replace('|', ' ').split()).lstrip('-')[:TAG_MAX_LENGTH]
+        if name and name not in cleaned:
+            cleaned.append(name)
+    return cleaned[:TAG_MAX_PER_TASK]
+
+@lru_cache(maxsize=64)
+def task_filter_query(status=False, category=False, priority=False, search=False, ids=False,
+                      include_archived=False, order='created_at DESC'):
+    """SELECT for Task.get_by_user with the given filters, built once per shape"""
+    conditions = "WHERE t.user_id = %s"
+    if status:
+        conditions += " AND t.status = %s"
+    if category:
+        conditions += " AND t.category_id = %s"
+    if priority:
+        conditions += " AND t.priority = %s"
+    if search:
+        conditions += " AND (t.title LIKE %s OR t.description LIKE %s)"
+    if ids:
+        # The id list is passed as one sequence, so the shape stays the same
+        conditions += " AND t.id IN %s"
+    
+    if include_archived:
+        return f"""
+        SELECT {TASK_ARCHIVE_COLUMNS}, NULL as archived_at FROM task t {conditions}
+        UNION ALL
+        SELECT {TASK_ARCHIVE_COLUMNS}, archived_at FROM task_archive t {conditions}
+        ORDER BY {order}
+        """
+    return f"SELECT t.* FROM task t {conditions} ORDER BY {order}"
+
+@lru_cache(maxsize=256)
+def update_statement(table, fields, touch_updated_at=False, owner_scoped=False):
+    """UPDATE ... WHERE id = %s for a tuple of columns, built once per shape
+    
+    owner_scoped adds "AND user_id = %s" after the id.
+    """
+    assignments = [f"{field} = %s" for field in fields]
+    if table == 'task' and 'status' in fields:
+        # Assignments see the new status; a task that stays completed keeps its time
+        assignments.append("completed_at = IF(status = 'completed', COALESCE(completed_at, NOW()), NULL)")
+    if touch_updated_at:
+        assignments.append("updated_at = NOW()")
+    where = "id = %s AND user_id = %s" if owner_scoped else "id = %s"
+    return f"UPDATE {table} SET {', '.join(assignments)} WHERE {where}"
+
+@lru_cache(maxsize=16)
+def rollup_statement(where):
+    """INSERT adding the daily rollup contribution of the task rows matching where
+    
+    A task counts as created on its creation day and, once completed, as
+    completed with its lead time on its completion day. Parameters are the
+    sign (1 or -1), the where parameters, the sign twice and the where
+    parameters again.
+    """
+    return f"""
+    INSERT INTO task_daily_rollup (user_id, day, category_id, created, completed, lead_seconds)
+    SELECT * FROM (
+        SELECT user_id, DATE(created_at) as day, COALESCE(category_id, 0) as category_id,
+               %s as created, 0 as completed, 0 as lead_seconds
+        FROM task WHERE {where}
+        UNION ALL
+        SELECT user_id, DATE(completed_at), COALESCE(category_id, 0),
+               0, %s, %s * TIMESTAMPDIFF(SECOND, created_at, completed_at)
+        FROM task WHERE {where} AND completed_at IS NOT NULL
+    ) AS contribution
+    ON DUPLICATE KEY UPDATE
+        created = task_daily_rollup.created + VALUES(created),
+        completed = task_daily_rollup.completed + VALUES(completed),
+        lead_seconds = task_daily_rollup.lead_seconds + VALUES(lead_seconds)
+    """
+
+# Puts a task and its subtree under a parent and all of the parent's
+# ancestors. Parameters: user id, parent id twice, task id twice
+LINK_SUBTREE_QUERY = """
+INSERT INTO task_closure (ancestor_id, descendant_id, depth, user_id)
+SELECT up.ancestor_id, down.descendant_id, up.depth + down.depth + 1, %s
+FROM (SELECT %s as ancestor_id, 0 as depth
+      UNION ALL SELECT ancestor_id, depth FROM task_closure WHERE descendant_id = %s) AS up
+CROSS JOIN (SELECT %s as descendant_id, 0 as depth
+            UNION ALL SELECT descendant_id, depth FROM task_closure WHERE ancestor_id = %s) AS down
+"""
+
+BUMP_DATA_VERSION_QUERY = """
+INSERT INTO task_owner_lock (user_id, version) VALUES (%s, 1)
+ON DUPLICATE KEY UPDATE version = version + 1
+"""
+
+def data_version(user_id):
+    """Version of the user's data; anything cached under an older one is stale"""
+    row = shards.for_user(user_id).execute_query(
+        "SELECT version FROM task_owner_lock WHERE user_id = %s",
+        (user_id,),
+        fetch=True,
+        fetch_all=False
+    )
+    return row['version'] if row else 0
+
+def bump_data_version(user_id):
+    """Mark the user's cached pages stale after a write outside Task"""
+    shards.for_user(user_id).execute_query(BUMP_DATA_VERSION_QUERY, (user_id,))
 
 class User:
     """User model with raw SQL operations"""
@@ -186,12 +965,15 @@ class User:
             query, 
             (username, email, password_hash, first_name, last_name)
         )
+        # User rows stay in the directory; their tasks go to the chosen shard
+        shards.assign(user_id)
         return cls.get_by_id(user_id)
     
     @classmethod
     def get_by_id(cls, user_id):
         """Get user by ID"""
         query = "SELECT * FROM user WHERE id = %s"
+        # Runs on every request through the login manager
         result = db_manager.execute_query(query, (user_id,), fetch=True, fetch_all=False)
         if result:
             return cls(**result)
@@ -225,14 +1007,15 @@ class User:
         values = []
         for key, value in kwargs.items():
             if hasattr(self, key):
-                fields.append(f"{key} = %s")
+                fields.append(key)
                 values.append(value)
                 setattr(self, key, value)
         
         if fields:
             values.append(self.id)
-            query = f"UPDATE user SET {', '.join(fields)} WHERE id = %s"
-            db_manager.execute_query(query, values)
+            db_manager.execute_query(update_statement('user', tuple(fields)), values)
+            # The navigation bar of cached pages shows the user's name
+            bump_data_version(self.id)
     
     # Flask-Login required methods
     def is_authenticated(self):
@@ -248,13 +1031,26 @@ class User:
         return str(self.id)
 
 class Category:
-    """Category model with raw SQL operations"""
+    """Category model with raw SQL operations
+    
+    Categories without a user_id are shared defaults; the rest belong to the
+    user who created them.
+    """
+    
+    # Per-process caches; other workers catch up within CATEGORY_CACHE_SECONDS
+    _shared_cache = None
+    _shared_cache_expires = 0
+    # user_id -> (expires, categories by name, categories by id), least recently used first
+    _user_cache = OrderedDict()
+    _cache_lock = threading.Lock()
     
-    def __init__(self, id=None, name=None, description=None, color=None, created_at=None):
+    def __init__(self, id=None, name=None, description=None, color=None, created_at=None,
+                 user_id=None):
         self.id = id
         self.name = name
         self.description = description
         self.color = color
+        self.user_id = user_id
         
         # Convert created_at string to datetime object if it's a string
         if isinstance(created_at, str):
@@ -266,71 +1062,364 @@ class Category:
             self.created_at = created_at
     
     @classmethod
-    def create(cls, name, description=None, color='#007bff'):
-        """Create a new category"""
+    def create(cls, name, user_id, description=None, color='#007bff'):
+        """Create a new category owned by user_id"""
         query = """
-        INSERT INTO category (name, description, color)
-        VALUES (%s, %s, %s)
+        INSERT INTO category (name, description, color, user_id)
+        VALUES (%s, %s, %s, %s)
         """
-        category_id = db_manager.execute_query(query, (name, description, color))
-        return cls.get_by_id(category_id)
+        category_id = db_manager.execute_query(query, (name, description, color, user_id))
+        cls.invalidate_cache(user_id)
+        return cls.get_by_id(category_id, user_id)
     
     @classmethod
-    def get_by_id(cls, category_id):
-        """Get category by ID"""
-        query = "SELECT * FROM category WHERE id = %s"
-        result = db_manager.execute_query(query, (category_id,), fetch=True, fetch_all=False)
+    def get_by_id(cls, category_id, user_id):
+        """Get a category by ID if it is shared or belongs to user_id"""
+        query = "SELECT * FROM category WHERE id = %s AND (user_id IS NULL OR user_id = %s)"
+        result = db_manager.execute_query(query, (category_id, user_id), fetch=True, fetch_all=False)
         if result:
             return cls(**result)
         return None
     
     @classmethod
-    def get_all(cls):
-        """Get all categories"""
-        query = "SELECT * FROM category ORDER BY name"
-        results = db_manager.execute_query(query, fetch=True)
-        return [cls(**row) for row in results]
+    def get_shared(cls):
+        """The shared default categories, cached for CATEGORY_CACHE_SECONDS"""
+        now = time.monotonic()
+        if cls._shared_cache is None or now >= cls._shared_cache_expires:
+            query = "SELECT * FROM category WHERE user_id IS NULL ORDER BY name"
+            results = db_manager.execute_query(query, fetch=True)
+            cls._shared_cache = [cls(**row) for row in results]
+            cls._shared_cache_expires = now + CATEGORY_CACHE_SECONDS
+        return list(cls._shared_cache)
+    
+    @classmethod
+    def _load_for_user(cls, user_id):
+        """Cache entry of the user's categories, reading them when missing or expired"""
+        now = time.monotonic()
+        with cls._cache_lock:
+            entry = cls._user_cache.get(user_id)
+            if entry is not None and now < entry[0]:
+                cls._user_cache.move_to_end(user_id)
+                return entry
+        
+        # Served by idx_category_user_name, so the cost does not grow with other users
+        query = "SELECT * FROM category WHERE user_id = %s ORDER BY name"
+        own = [cls(**row) for row in db_manager.execute_query(query, (user_id,), fetch=True)]
+        categories = sorted(cls.get_shared() + own, key=lambda category: category.name.lower())
+        entry = (now + CATEGORY_CACHE_SECONDS, categories,
+                 {category.id: category for category in categories})
+        with cls._cache_lock:
+            cls._user_cache[user_id] = entry
+            cls._user_cache.move_to_end(user_id)
+            while len(cls._user_cache) > CATEGORY_CACHE_USERS:
+                cls._user_cache.popitem(last=False)
+        return entry
+    
+    @classmethod
+    def get_for_user(cls, user_id):
+        """The shared categories plus the user's own, by name"""
+        return list(cls._load_for_user(user_id)[1])
+    
+    @classmethod
+    def lookup(cls, category_id, user_id):
+        """Cached category by id among the user's; reloads once for ids created elsewhere"""
+        category = cls._load_for_user(user_id)[2].get(category_id)
+        if category is None and category_id is not None:
+            cls.invalidate_cache(user_id)
+            category = cls._load_for_user(user_id)[2].get(category_id)
+        return category
+    
+    @classmethod
+    def invalidate_cache(cls, user_id=None):
+        """Drop cached categories after a change to the user's, or to the shared ones"""
+        with cls._cache_lock:
+            if user_id is None:
+                cls._shared_cache = None
+                cls._user_cache.clear()
+            else:
+                cls._user_cache.pop(user_id, None)
+    
+    @classmethod
+    def assign_owners(cls):
+        """Hand categories from the days before per-user categories to the users of them
+        
+        Each non-default shared category goes to the first user whose tasks use
+        it; every other such user gets a copy and their tasks move to it.
+        Categories nobody uses stay shared. Returns the number reassigned.
+        """
+        defaults = {name for name, _, _ in DEFAULT_CATEGORIES}
+        legacy = [row for row in db_manager.execute_query(
+                      "SELECT * FROM category WHERE user_id IS NULL", fetch=True)
+                  if row['name'] not in defaults]
+        if not legacy:
+            return 0
+        
+        placeholders = ', '.join(['%s'] * len(legacy))
+        users = {}
+        for shard in shards.all():
+            for table in ('task', 'task_archive'):
+                rows = shard.execute_query(
+                    f"SELECT DISTINCT category_id, user_id FROM {table} WHERE category_id IN ({placeholders})",
+                    [row['id'] for row in legacy],
+                    fetch=True
+                )
+                for row in rows:
+                    users.setdefault(row['category_id'], set()).add(row['user_id'])
+        
+        assigned = 0
+        for row in legacy:
+            owners = sorted(users.get(row['id'], ()))
+            if not owners:
+                continue
+            db_manager.execute_query("UPDATE category SET user_id = %s WHERE id = %s", (owners[0], row['id']))
+            for user_id in owners[1:]:
+                copy_id = db_manager.execute_query(
+                    "INSERT INTO category (name, description, color, created_at, user_id) VALUES (%s, %s, %s, %s, %s)",
+                    (row['name'], row['description'], row['color'], row['created_at'], user_id)
+                )
+                db = shards.for_user(user_id)
+                for table in ('task', 'task_archive', 'task_daily_rollup'):
+                    db.execute_query(
+                        f"UPDATE {table} SET category_id = %s WHERE user_id = %s AND category_id = %s",
+                        (copy_id, user_id, row['id'])
+                    )
+            assigned += 1
+        cls.invalidate_cache()
+        return assigned
     
     def update(self, **kwargs):
         """Update category fields"""
         fields = []
         values = []
         for key, value in kwargs.items():
-            if hasattr(self, key):
-                fields.append(f"{key} = %s")
+            if hasattr(self, key) and key not in ['id', 'user_id']:
+                fields.append(key)
                 values.append(value)
                 setattr(self, key, value)
         
         if fields:
             values.append(self.id)
-            query = f"UPDATE category SET {', '.join(fields)} WHERE id = %s"
-            db_manager.execute_query(query, values)
+            db_manager.execute_query(update_statement('category', tuple(fields)), values)
+            Category.invalidate_cache(self.user_id)
     
     def delete(self):
         """Delete category"""
         query = "DELETE FROM category WHERE id = %s"
         db_manager.execute_query(query, (self.id,))
+        # Shards and the archive have no foreign key to category, so clear
+        # references by hand; only the owner's shard can hold a user's category
+        affected = shards.all() if self.user_id is None else [shards.for_user(self.user_id)]
+        for shard in affected:
+            if shard is not db_manager:
+                shard.execute_query("UPDATE task SET category_id = NULL WHERE category_id = %s", (self.id,))
+            shard.execute_query("UPDATE task_archive SET category_id = NULL WHERE category_id = %s", (self.id,))
+            shard.execute_query("UPDATE task_recurrence SET category_id = NULL WHERE category_id = %s", (self.id,))
+        Category.invalidate_cache(self.user_id)
+
+class Notification:
+    """In-app notification model with raw SQL operations"""
+    
+    def __init__(self, id=None, user_id=None, task_id=None, kind=None, message=None,
+                 due_date=None, created_at=None, read_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.task_id = task_id
+        self.kind = kind
+        self.message = message
+        self.due_date = due_date
+        self.created_at = created_at
+        self.read_at = read_at
+    
+    @classmethod
+    def create(cls, user_id, kind, message, task_id=None, due_date=None):
+        """Create a notification, ignoring duplicates for the same task and due date"""
+        query = """
+        INSERT IGNORE INTO notification (user_id, task_id, kind, message, due_date)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        notification_id = shards.for_user(user_id).execute_query(
+            query, (user_id, task_id, kind, message, due_date)
+        )
+        # Ignored duplicates come back without an id
+        if notification_id:
+            bump_data_version(user_id)
+        return notification_id
+    
+    @classmethod
+    def get_unread_by_user(cls, user_id, limit=10):
+        """Get the newest unread notifications for user"""
+        query = """
+        SELECT * FROM notification
+        WHERE user_id = %s AND read_at IS NULL
+        ORDER BY created_at DESC
+        LIMIT %s
+        """
+        results = shards.for_user(user_id).execute_query(query, (user_id, limit), fetch=True)
+        return [cls(**row) for row in results]
+    
+    @classmethod
+    def mark_all_read(cls, user_id):
+        """Mark every unread notification of user as read"""
+        query = "UPDATE notification SET read_at = NOW() WHERE user_id = %s AND read_at IS NULL"
+        shards.for_user(user_id).execute_query(query, (user_id,))
+        bump_data_version(user_id)
+
+class Digest:
+    """A user's daily digest of overdue and due-today tasks, made by task_digest.py"""
+    
+    def __init__(self, user_id=None, day=None, overdue=0, due_today=0, created_at=None, tasks=()):
+        self.user_id = user_id
+        self.day = day
+        self.overdue = overdue
+        self.due_today = due_today
+        self.created_at = created_at
+        # The first listed tasks, most overdue first
+        self.tasks = list(tasks)
     
     @property
-    def tasks(self):
-        """Get all tasks associated with this category"""
+    def total(self):
+        return self.overdue + self.due_today
+    
+    @classmethod
+    def get_for_user(cls, user_id, day=None):
+        """The user's digest for day (today by default), or None"""
+        day = day or date.today()
+        db = shards.for_user(user_id)
+        row = db.execute_query(
+            "SELECT * FROM task_digest WHERE user_id = %s AND day = %s",
+            (user_id, day),
+            fetch=True,
+            fetch_all=False
+        )
+        if not row:
+            return None
+        tasks = db.execute_query(
+            """
+            SELECT task_id, title, priority, due_date FROM task_digest_item
+            WHERE user_id = %s AND day = %s
+            ORDER BY due_date, task_id
+            """,
+            (user_id, day),
+            fetch=True
+        )
+        start_of_day = datetime.combine(day, datetime.min.time())
+        for task in tasks:
+            task['overdue'] = task['due_date'] < start_of_day
+        return cls(**row, tasks=tasks)
+
+class SmartList:
+    """A saved set of Tasks page filters
+    
+    The list lives in the directory database with the user's categories;
+    the tasks it matches are on the user's shard.
+    """
+    
+    def __init__(self, id=None, user_id=None, name=None, status=None, category_id=None,
+                 priority=None, search=None, sort='created', created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.status = status
+        self.category_id = category_id
+        self.priority = priority
+        self.search = search
+        self.sort = sort
+        self.created_at = created_at
+    
+    @classmethod
+    def create(cls, user_id, name, status=None, category_id=None, priority=None, search=None,
+               sort='created'):
+        """Save a smart list for user_id"""
         query = """
-        SELECT t.*, c.name as category_name, c.color as category_color
-        FROM task t
-        LEFT JOIN category c ON t.category_id = c.id
-        WHERE t.category_id = %s
-        ORDER BY t.created_at DESC
-        """
-        results = db_manager.execute_query(query, (self.id,), fetch=True)
-        # We'll define Task class later in this module, so we can reference it directly
-        return [Task(**row) for row in results] if results else []
+        INSERT INTO smart_list (user_id, name, status, category_id, priority, search, sort)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        list_id = db_manager.execute_query(
+            query, (user_id, name, status or None, category_id, priority or None, search or None, sort)
+        )
+        # Cached lists and pages of the user's other workers reload
+        bump_data_version(user_id)
+        return cls.get_by_id(list_id, user_id)
+    
+    @classmethod
+    def get_by_id(cls, list_id, user_id):
+        """Get a smart list by ID if it belongs to user_id"""
+        query = "SELECT * FROM smart_list WHERE id = %s AND user_id = %s"
+        result = db_manager.execute_query(query, (list_id, user_id), fetch=True, fetch_all=False)
+        if result:
+            return cls(**result)
+        return None
+    
+    @classmethod
+    def get_for_user(cls, user_id):
+        """The user's smart lists by name"""
+        query = "SELECT * FROM smart_list WHERE user_id = %s ORDER BY name"
+        return [cls(**row) for row in db_manager.execute_query(query, (user_id,), fetch=True)]
+    
+    def predicate(self):
+        """The list's filters as one WHERE clause over task t, with its parameters"""
+        conditions = ["t.user_id = %s"]
+        params = [self.user_id]
+        if self.status:
+            conditions.append("t.status = %s")
+            params.append(self.status)
+        if self.category_id:
+            conditions.append("t.category_id = %s")
+            params.append(self.category_id)
+        if self.priority:
+            conditions.append("t.priority = %s")
+            params.append(self.priority)
+        if self.search:
+            conditions.append("(t.title LIKE %s OR t.description LIKE %s)")
+            params.extend([f"%{self.search}%"] * 2)
+        return " AND ".join(conditions), params
+    
+    def get_task_ids(self):
+        """Ids of the tasks the list matches, in its sort order"""
+        where, params = self.predicate()
+        if self.sort == 'due':
+            # Tasks without a due date go last, as on the Tasks page
+            order = 'due_date IS NULL, due_date, id'
+        else:
+            order = Task.SORT_ORDERS.get(self.sort, Task.SORT_ORDERS['created'])
+        rows = shards.for_user(self.user_id).execute_query(
+            f"SELECT t.id FROM task t WHERE {where} ORDER BY {order}", params, fetch=True
+        )
+        return [row['id'] for row in rows]
+    
+    def could_match(self, task):
+        """Whether the task passes the list's exact filters; the search is left to SQL"""
+        return ((not self.status or task.status == self.status)
+                and (not self.category_id or task.category_id == self.category_id)
+                and (not self.priority or task.priority == self.priority))
+    
+    def delete(self):
+        """Delete smart list"""
+        db_manager.execute_query("DELETE FROM smart_list WHERE id = %s", (self.id,))
+        bump_data_version(self.user_id)
 
 class Task:
     """Task model with raw SQL operations"""
     
+    STATUSES = TASK_STATUSES
+    PRIORITIES = TASK_PRIORITIES
+    
+    # ORDER BY clauses for get_by_user; each one is served by an index
+    SORT_ORDERS = {
+        'created': 'created_at DESC',
+        'priority': 'priority DESC, created_at DESC',
+        'due': 'due_date, id',
+    }
+    # A UNION returns priority as a string, so rank it explicitly there
+    ARCHIVED_SORT_ORDERS = dict(
+        SORT_ORDERS,
+        priority=f"FIELD(priority, {', '.join(repr(value) for value in TASK_PRIORITIES)}) DESC, created_at DESC",
+    )
+    
     def __init__(self, id=None, title=None, description=None, status='pending', 
                  priority='medium', due_date=None, created_at=None, updated_at=None,
-                 user_id=None, category_id=None, category_name=None, category_color=None):
+                 user_id=None, category_id=None, category_name=None, category_color=None,
+                 archived_at=None, completed_at=None, parent_id=None, tags=None):
         self.id = id
         self.title = title
         self.description = description
@@ -369,99 +1458,499 @@ class Task:
         self.category_id = category_id
         self.category_name = category_name
         self.category_color = category_color
+        self.completed_at = completed_at
+        self.parent_id = parent_id
+        # None until loaded with attach_tags, or set by a write
+        self.tags = tags
+        # Set for read-only tasks loaded from task_archive
+        self.archived_at = archived_at
     
     @classmethod
     def create(cls, title, user_id, description=None, status='pending', 
-               priority='medium', due_date=None, category_id=None):
-        """Create a new task"""
+               priority='medium', due_date=None, category_id=None, parent_id=None, tags=()):
+        """Create a new task, as a subtask of parent_id if given
+        
+        Raises ValueError when parent_id is not one of the user's tasks.
+        """
+        tags = clean_tags(tags)
+        with shards.for_user(user_id).transaction() as cursor:
+            cls.lock_owner(cursor, user_id)
+            if parent_id is not None:
+                cls.check_parent(cursor, user_id, parent_id)
+            task_id = cls.insert(cursor, title, user_id, description, status, priority, due_date, category_id,
+                                 parent_id)
+            if tags:
+                cls.set_tags(cursor, user_id, task_id, tags)
+        task = cls.get_by_id(task_id, user_id=user_id)
+        task.tags = tags
+        task.notify_listeners('created')
+        return task
+    
+    @classmethod
+    def insert(cls, cursor, title, user_id, description=None, status='pending',
+               priority='medium', due_date=None, category_id=None, parent_id=None):
+        """Insert a task inside the caller's transaction (which holds the owner lock) and return its id"""
         query = """
-        INSERT INTO task (title, description, status, priority, due_date, user_id, category_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO task (title, description, status, priority, due_date, user_id, category_id, parent_id,
+                          completed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, IF(%s = 'completed', NOW(), NULL))
         """
-        task_id = db_manager.execute_query(
+        cursor.execute(
             query, 
-            (title, description, status, priority, due_date, user_id, category_id)
+            (title, description, status, priority, due_date, user_id, category_id, parent_id, status)
         )
-        return cls.get_by_id(task_id)
+        task_id = cursor.lastrowid
+        if parent_id is not None:
+            cls.link_subtree(cursor, user_id, task_id, parent_id)
+        cls.record_change(cursor, user_id, task_id, 'created', due_changed=bool(due_date))
+        cls.roll_up(cursor, "id = %s", (task_id,))
+        return task_id
     
     @classmethod
-    def get_by_id(cls, task_id):
-        """Get task by ID with category info"""
-        query = """
-        SELECT t.*, c.name as category_name, c.color as category_color
-        FROM task t
-        LEFT JOIN category c ON t.category_id = c.id
-        WHERE t.id = %s
+    def from_row(cls, row):
+        """Build a task from a task row, filling category info from the cache"""
+        task = cls(**row)
+        category = Category.lookup(task.category_id, task.user_id) if task.category_id else None
+        if category:
+            task.category_name = category.name
+            task.category_color = category.color
+        return task
+    
+    @classmethod
+    def get_by_id(cls, task_id, user_id=None):
+        """Get task by ID with category info
+        
+        Pass the owner's user_id to read only their shard; without it every
+        shard is asked.
         """
-        result = db_manager.execute_query(query, (task_id,), fetch=True, fetch_all=False)
+        query = "SELECT * FROM task WHERE id = %s"
+        if user_id is not None:
+            result = shards.for_user(user_id).execute_query(query, (task_id,), fetch=True, fetch_all=False)
+        else:
+            rows = shards.scatter_gather(query, (task_id,))
+            result = rows[0] if rows else None
         if result:
-            return cls(**result)
+            return cls.from_row(result)
         return None
     
     @classmethod
-    def get_by_user(cls, user_id, status=None, category_id=None, search=None):
-        """Get tasks by user with optional filters"""
-        query = """
-        SELECT t.*, c.name as category_name, c.color as category_color
-        FROM task t
-        LEFT JOIN category c ON t.category_id = c.id
-        WHERE t.user_id = %s
+    def get_by_user(cls, user_id, status=None, category_id=None, search=None,
+                    include_archived=False, sort='created', priority=None, task_ids=None):
+        """Get tasks by user with optional filters
+        
+        Archived tasks are only read when include_archived is set. sort is a
+        key of SORT_ORDERS. task_ids limits the result to those tasks.
         """
         params = [user_id]
-        
         if status:
-            query += " AND t.status = %s"
             params.append(status)
-        
         if category_id:
-            query += " AND t.category_id = %s"
             params.append(category_id)
-        
+        if priority:
+            params.append(priority)
         if search:
-            query += " AND (t.title LIKE %s OR t.description LIKE %s)"
             search_term = f"%{search}%"
             params.extend([search_term, search_term])
+        if task_ids is not None:
+            if not task_ids:
+                return []
+            params.append(tuple(task_ids))
+        if include_archived:
+            params = params * 2
         
-        query += " ORDER BY t.created_at DESC"
+        sort_orders = cls.ARCHIVED_SORT_ORDERS if include_archived else cls.SORT_ORDERS
+        order = sort_orders.get(sort, sort_orders['created'])
+        query = task_filter_query(status=bool(status), category=bool(category_id), priority=bool(priority),
+                                  search=bool(search), ids=task_ids is not None,
+                                  include_archived=include_archived, order=order)
+        results = shards.for_user(user_id).execute_query(query, params, fetch=True)
+        tasks = [cls.from_row(row) for row in results]
+        if sort == 'due':
+            # MySQL sorts NULL first; tasks without a due date go last instead
+            tasks = [task for task in tasks if task.due_date] + [task for task in tasks if not task.due_date]
+        return tasks
+    
+    @classmethod
+    def get_ids_matching(cls, user_id, search, include_archived=False):
+        """Ids of the user's tasks whose title or description contains search"""
+        search_term = f"%{search}%"
+        query = "SELECT id FROM task WHERE user_id = %s AND (title LIKE %s OR description LIKE %s)"
+        params = [user_id, search_term, search_term]
+        if include_archived:
+            query += (" UNION ALL SELECT id FROM task_archive"
+                      " WHERE user_id = %s AND (title LIKE %s OR description LIKE %s)")
+            params = params * 2
+        rows = shards.for_user(user_id).execute_query(query, params, fetch=True)
+        return {row['id'] for row in rows}
+    
+    @classmethod
+    def attach_tags(cls, tasks):
+        """Load the tags of one user's tasks into their tags attribute"""
+        if not tasks:
+            return tasks
+        by_id = {}
+        for task in tasks:
+            task.tags = []
+            by_id[task.id] = task
+        rows = shards.for_user(tasks[0].user_id).execute_query(
+            f"SELECT task_id, name FROM task_tag WHERE task_id IN ({', '.join(['%s'] * len(by_id))}) ORDER BY name",
+            list(by_id),
+            fetch=True
+        )
+        for row in rows:
+            by_id[row['task_id']].tags.append(row['name'])
+        return tasks
+    
+    @classmethod
+    def get_children(cls, task_id, user_id):
+        """The task's direct subtasks, oldest first"""
+        query = """
+        SELECT t.* FROM task_closure c JOIN task t ON t.id = c.descendant_id
+        WHERE c.ancestor_id = %s AND c.depth = 1 AND t.user_id = %s
+        ORDER BY t.created_at, t.id
+        """
+        rows = shards.for_user(user_id).execute_query(query, (task_id, user_id), fetch=True)
+        return [cls.from_row(row) for row in rows]
+    
+    @classmethod
+    def get_subtree(cls, task_id, user_id):
+        """All of the task's subtasks in tree order, each with its depth below the task"""
+        query = """
+        SELECT t.*, c.depth FROM task_closure c JOIN task t ON t.id = c.descendant_id
+        WHERE c.ancestor_id = %s AND t.user_id = %s
+        ORDER BY t.created_at, t.id
+        """
+        rows = shards.for_user(user_id).execute_query(query, (task_id, user_id), fetch=True)
+        children = {}
+        for row in rows:
+            depth = row.pop('depth')
+            task = cls.from_row(row)
+            task.depth = depth
+            children.setdefault(task.parent_id, []).append(task)
         
-        results = db_manager.execute_query(query, params, fetch=True)
-        return [cls(**row) for row in results]
+        # The rows are already all there; this only puts them in order
+        ordered = []
+        stack = list(reversed(children.get(task_id, [])))
+        while stack:
+            task = stack.pop()
+            ordered.append(task)
+            stack.extend(reversed(children.get(task.id, [])))
+        return ordered
+    
+    @classmethod
+    def get_ancestors(cls, task_id, user_id):
+        """The task's parent, grandparent and so on, outermost first"""
+        query = """
+        SELECT t.* FROM task_closure c JOIN task t ON t.id = c.ancestor_id
+        WHERE c.descendant_id = %s AND t.user_id = %s
+        ORDER BY c.depth DESC
+        """
+        rows = shards.for_user(user_id).execute_query(query, (task_id, user_id), fetch=True)
+        return [cls.from_row(row) for row in rows]
+    
+    @classmethod
+    def get_progress(cls, user_id, task_ids=None):
+        """Subtask counts of the user's tasks that have subtasks
+        
+        Returns {task_id: {'total': n, 'completed': n}} counting subtasks at
+        every depth, for all such tasks or only those in task_ids.
+        """
+        query = """
+        SELECT c.ancestor_id, COUNT(*) as total, SUM(t.status = 'completed') as completed
+        FROM task_closure c JOIN task t ON t.id = c.descendant_id
+        WHERE c.user_id = %s
+        """
+        params = [user_id]
+        if task_ids is not None:
+            if not task_ids:
+                return {}
+            query += f" AND c.ancestor_id IN ({', '.join(['%s'] * len(task_ids))})"
+            params.extend(task_ids)
+        query += " GROUP BY c.ancestor_id"
+        rows = shards.for_user(user_id).execute_query(query, params, fetch=True)
+        return {row['ancestor_id']: {'total': int(row['total']), 'completed': int(row['completed'])}
+                for row in rows}
     
     @classmethod
     def get_stats_by_user(cls, user_id):
         """Get task statistics for user"""
-        query = """
+        # Archived tasks are all completed and counted in task_archive_count
+        archived = "(SELECT COALESCE(SUM(completed), 0) FROM task_archive_count WHERE user_id = %s)"
+        query = f"""
         SELECT 
-            COUNT(*) as total,
+            COUNT(*) + {archived} as total,
             SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending,
             SUM(CASE WHEN status = 'in_progress' THEN 1 ELSE 0 END) as in_progress,
-            SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
+            COALESCE(SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END), 0) + {archived} as completed,
             SUM(CASE WHEN due_date < NOW() AND status != 'completed' THEN 1 ELSE 0 END) as overdue
         FROM task 
         WHERE user_id = %s
         """
-        result = db_manager.execute_query(query, (user_id,), fetch=True, fetch_all=False)
+        result = shards.for_user(user_id).execute_query(
+            query, (user_id, user_id, user_id), fetch=True, fetch_all=False
+        )
         return result or {'total': 0, 'pending': 0, 'in_progress': 0, 'completed': 0, 'overdue': 0}
     
+    @classmethod
+    def get_next_due(cls, user_id):
+        """Earliest future due date among the user's open tasks, or None"""
+        query = """
+        SELECT MIN(due_date) as next_due FROM task
+        WHERE user_id = %s AND status != 'completed' AND due_date > NOW()
+        """
+        result = shards.for_user(user_id).execute_query(query, (user_id,), fetch=True, fetch_all=False)
+        return result['next_due'] if result else None
+    
+    @classmethod
+    def count_by_category(cls, user_id):
+        """Number of the user's tasks in each category, keyed by category id"""
+        query = """
+        SELECT category_id, COUNT(*) as count FROM task
+        WHERE user_id = %s AND category_id IS NOT NULL GROUP BY category_id
+        """
+        rows = shards.for_user(user_id).execute_query(query, (user_id,), fetch=True)
+        return {row['category_id']: row['count'] for row in rows}
+    
+    @classmethod
+    def get_daily_rollup(cls, user_id, since):
+        """The user's rollup rows from the since date on, oldest first"""
+        query = """
+        SELECT day, category_id, created, completed, lead_seconds
+        FROM task_daily_rollup WHERE user_id = %s AND day >= %s ORDER BY day
+        """
+        return shards.for_user(user_id).execute_query(query, (user_id, since), fetch=True)
+    
     def update(self, **kwargs):
-        """Update task fields"""
+        """Update task fields; tags, if given, replaces the task's tags
+        
+        A new parent_id moves the task, with all its subtasks, in the same
+        transaction. Raises ValueError when parent_id is not the owner's
+        task or lies inside the task's subtree.
+        """
+        tags = kwargs.pop('tags', None)
+        moving = 'parent_id' in kwargs and kwargs['parent_id'] != self.parent_id
+        parent_id = kwargs.pop('parent_id', None)
         fields = []
         values = []
         for key, value in kwargs.items():
-            if hasattr(self, key) and key not in ['id', 'created_at', 'category_name', 'category_color']:
-                fields.append(f"{key} = %s")
+            if hasattr(self, key) and key not in ['id', 'created_at', 'category_name', 'category_color',
+                                                  'archived_at', 'completed_at', 'parent_id']:
+                fields.append(key)
                 values.append(value)
                 setattr(self, key, value)
         
-        if fields:
+        if fields or tags is not None or moving:
+            if moving:
+                fields.append('parent_id')
+                values.append(parent_id)
             values.append(self.id)
-            query = f"UPDATE task SET {', '.join(fields)}, updated_at = NOW() WHERE id = %s"
-            db_manager.execute_query(query, values)
+            query = update_statement('task', tuple(fields), touch_updated_at=True)
+            rolled_up = 'status' in fields or 'category_id' in fields
+            with shards.for_user(self.user_id).transaction() as cursor:
+                Task.lock_owner(cursor, self.user_id)
+                if moving:
+                    Task.relink(cursor, self.user_id, self.id, parent_id)
+                if rolled_up:
+                    Task.roll_up(cursor, "id = %s", (self.id,), sign=-1)
+                # With only tags changing this still marks the task updated
+                cursor.execute(query, values)
+                if rolled_up:
+                    Task.roll_up(cursor, "id = %s", (self.id,))
+                if tags is not None:
+                    self.tags = clean_tags(tags)
+                    Task.set_tags(cursor, self.user_id, self.id, self.tags)
+                Task.record_change(cursor, self.user_id, self.id, 'updated',
+                                   due_changed='due_date' in kwargs or 'status' in kwargs)
+            if moving:
+                self.parent_id = parent_id
+            self.notify_listeners('updated')
+    
+    @classmethod
+    def patch(cls, task_id, user_id, **changes):
+        """Change a task the user owns, checking ownership in the UPDATE itself
+        
+        Returns the updated task, or None when the user has no such task.
+        """
+        query = update_statement('task', tuple(changes), touch_updated_at=True, owner_scoped=True)
+        owned = "id = %s AND user_id = %s"
+        with shards.for_user(user_id).transaction() as cursor:
+            cls.lock_owner(cursor, user_id)
+            cls.roll_up(cursor, owned, (task_id, user_id), sign=-1)
+            cursor.execute(query, list(changes.values()) + [task_id, user_id])
+            if not cursor.rowcount:
+                # Nothing changed, so undo the version bump lock_owner made
+                cursor.connection.rollback()
+                return None
+            cls.roll_up(cursor, owned, (task_id, user_id))
+            cls.record_change(cursor, user_id, task_id, 'updated', due_changed='status' in changes)
+            cursor.execute("SELECT * FROM task WHERE id = %s", (task_id,))
+            task = cls.from_row(cursor.fetchone())
+        task.notify_listeners('updated')
+        return task
     
     def delete(self):
-        """Delete task"""
-        query = "DELETE FROM task WHERE id = %s"
-        db_manager.execute_query(query, (self.id,))
+        """Delete the task together with all its subtasks"""
+        with shards.for_user(self.user_id).transaction() as cursor:
+            Task.lock_owner(cursor, self.user_id)
+            cursor.execute(
+                "SELECT t.* FROM task_closure c JOIN task t ON t.id = c.descendant_id WHERE c.ancestor_id = %s",
+                (self.id,)
+            )
+            deleted = [self] + [Task.from_row(row) for row in cursor.fetchall()]
+            if len(deleted) > 1:
+                # Worker-local indexes count one version per task passed to the listeners
+                cursor.execute(
+                    "UPDATE task_owner_lock SET version = version + %s WHERE user_id = %s",
+                    (len(deleted) - 1, self.user_id)
+                )
+            task_ids = [task.id for task in deleted]
+            placeholders = ', '.join(['%s'] * len(task_ids))
+            Task.roll_up(cursor, f"id IN ({placeholders})", task_ids, sign=-1)
+            cursor.execute(f"DELETE FROM task WHERE id IN ({placeholders})", task_ids)
+            cursor.execute(f"DELETE FROM task_closure WHERE descendant_id IN ({placeholders})", task_ids)
+            cursor.execute(f"DELETE FROM task_tag WHERE task_id IN ({placeholders})", task_ids)
+            # The change log entries double as the tombstones for sync clients
+            for task in deleted:
+                Task.record_change(cursor, self.user_id, task.id, 'deleted',
+                                   due_changed=bool(task.due_date))
+        for task in deleted:
+            task.notify_listeners('deleted')
+    
+    def notify_listeners(self, action):
+        """Run the registered task listeners; a failing listener never fails the write"""
+        for listener in task_listeners:
+            try:
+                listener(action, self)
+            except Exception as e:
+                print(f"Task listener {listener.__name__} failed: {e}")
+    
+    @staticmethod
+    def lock_owner(cursor, user_id):
+        """Serialize one user's task writes so their change ids commit in order
+        
+        Taking the lock also bumps the user's data version.
+        """
+        # Without this a sync cursor could move past a change id that is
+        # still uncommitted and never see it
+        cursor.execute(BUMP_DATA_VERSION_QUERY, (user_id,))
+    
+    @staticmethod
+    def record_change(cursor, user_id, task_id, action, due_changed=False):
+        """Log a task write for sync clients and the reminder scheduler"""
+        cursor.execute(
+            "INSERT INTO task_changes (user_id, task_id, action) VALUES (%s, %s, %s)",
+            (user_id, task_id, action)
+        )
+        if due_changed:
+            cursor.execute("INSERT INTO task_due_change (task_id) VALUES (%s)", (task_id,))
+    
+    @staticmethod
+    def relink(cursor, user_id, task_id, parent_id):
+        """Move the task's subtree under parent_id (None for top level) in the closure table"""
+        if parent_id is not None:
+            Task.check_parent(cursor, user_id, parent_id, task_id)
+        cursor.execute("SELECT descendant_id FROM task_closure WHERE ancestor_id = %s", (task_id,))
+        subtree = [task_id] + [row['descendant_id'] for row in cursor.fetchall()]
+        placeholders = ', '.join(['%s'] * len(subtree))
+        # Cut the subtree loose from its old ancestors, keeping its inner links
+        cursor.execute(
+            f"""
+            DELETE FROM task_closure
+            WHERE descendant_id IN ({placeholders}) AND ancestor_id NOT IN ({placeholders})
+            """,
+            subtree * 2
+        )
+        if parent_id is not None:
+            Task.link_subtree(cursor, user_id, task_id, parent_id)
+    
+    @staticmethod
+    def check_parent(cursor, user_id, parent_id, task_id=None):
+        """Raise ValueError unless parent_id can take task_id (or a new task) as a subtask"""
+        # Locking the parent keeps the archive job from moving it away meanwhile
+        cursor.execute("SELECT id FROM task WHERE id = %s AND user_id = %s FOR UPDATE", (parent_id, user_id))
+        if not cursor.fetchone():
+            raise ValueError("Parent task not found")
+        if task_id is not None:
+            cursor.execute(
+                "SELECT 1 FROM task_closure WHERE descendant_id = %s AND ancestor_id = %s", (parent_id, task_id)
+            )
+            if parent_id == task_id or cursor.fetchone():
+                raise ValueError("A task cannot become a subtask of its own subtask")
+    
+    @staticmethod
+    def set_tags(cursor, user_id, task_id, names):
+        """Replace a task's tags inside the caller's transaction; names are already clean"""
+        cursor.execute("DELETE FROM task_tag WHERE task_id = %s", (task_id,))
+        if names:
+            cursor.execute(
+                f"INSERT INTO task_tag (task_id, user_id, name) VALUES {', '.join(['(%s, %s, %s)'] * len(names))}",
+                [value for name in names for value in (task_id, user_id, name)]
+            )
+    
+    @staticmethod
+    def link_subtree(cursor, user_id, task_id, parent_id):
+        """Add the closure rows putting task_id and its subtree under parent_id"""
+        cursor.execute(LINK_SUBTREE_QUERY, (user_id, parent_id, parent_id, task_id, task_id))
+    
+    @staticmethod
+    def rebuild_closure(cursor, user_id):
+        """Recompute the user's task_closure rows from task.parent_id
+        
+        Takes one INSERT per level of the deepest tree. The caller holds the
+        owner lock.
+        """
+        cursor.execute("DELETE FROM task_closure WHERE user_id = %s", (user_id,))
+        cursor.execute(
+            """
+            INSERT INTO task_closure (ancestor_id, descendant_id, depth, user_id)
+            SELECT t.parent_id, t.id, 1, t.user_id FROM task t JOIN task p ON p.id = t.parent_id
+            WHERE t.user_id = %s
+            """,
+            (user_id,)
+        )
+        depth = 1
+        while cursor.rowcount:
+            # Pairs one level further apart: a pair at depth plus one more step down
+            cursor.execute(
+                """
+                INSERT INTO task_closure (ancestor_id, descendant_id, depth, user_id)
+                SELECT up.ancestor_id, step.descendant_id, up.depth + 1, up.user_id
+                FROM task_closure up
+                JOIN task_closure step ON step.ancestor_id = up.descendant_id AND step.depth = 1
+                WHERE up.user_id = %s AND up.depth = %s
+                """,
+                (user_id, depth)
+            )
+            depth += 1
+    
+    @staticmethod
+    def roll_up(cursor, where, params, sign=1):
+        """Add (or with sign=-1 take back) the daily rollup counts of the tasks matching where
+        
+        Writes take back a task's counts before changing it and add them again
+        afterwards, so the rollup follows status and category changes.
+        """
+        params = list(params)
+        cursor.execute(rollup_statement(where), [sign] + params + [sign, sign] + params)
+    
+    def to_dict(self):
+        """JSON-friendly representation of the task"""
+        def iso(value):
+            return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+        
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'status': self.status,
+            'priority': self.priority,
+            'due_date': iso(self.due_date),
+            'created_at': iso(self.created_at),
+            'updated_at': iso(self.updated_at),
+            'category_id': self.category_id,
+            'category_name': self.category_name,
+            'parent_id': self.parent_id,
+        }
     
     @property
     def is_overdue(self):
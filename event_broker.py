@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Event broker for HaatKhata live updates
+Run this script as its own process. App workers publish task events to it
+over UDP and it fans them out to the browsers' Server-Sent Events streams
+with asyncio, so thousands of open dashboards cost no gunicorn workers.
+
+Point EVENTS_BROKER_ADDR (for the app) at the UDP address below and
+EVENTS_BROKER_URL at the public URL of the /events path served here.
+"""
+
+import asyncio
+import json
+import os
+from urllib.parse import urlsplit, parse_qs
+import events
+
+# Broker configuration from environment variables
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
+BROKER_HOST = os.getenv("EVENTS_BROKER_HOST", "127.0.0.1")
+BROKER_HTTP_PORT = int(os.getenv("EVENTS_BROKER_HTTP_PORT", 5002))
+BROKER_UDP_PORT = int(os.getenv("EVENTS_BROKER_UDP_PORT", 5001))
+ALLOW_ORIGIN = os.getenv("EVENTS_ALLOW_ORIGIN", "*")
+
+# user_id -> set of asyncio queues, one per open stream
+subscribers = {}
+
+
+class PublishProtocol(asyncio.DatagramProtocol):
+    """Receives events from app workers and queues them for subscribers"""
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            user_id = message['user_id']
+            text = events.format_sse(message['event'], message['data'])
+        except (ValueError, KeyError):
+            return
+        for queue in list(subscribers.get(user_id, ())):
+            if not queue.full():
+                queue.put_nowait(text)
+
+
+async def respond(writer, status, body=''):
+    """Write a short plain-text response and close the connection"""
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}".encode('utf-8')
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def handle_client(reader, writer):
+    """Serve one GET /events?token=... stream"""
+    try:
+        request_line = (await reader.readline()).decode('latin-1')
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        method, target, _ = request_line.split(' ', 2)
+    except (ValueError, ConnectionError):
+        writer.close()
+        return
+
+    url = urlsplit(target)
+    if method != 'GET' or url.path.rstrip('/') != '/events':
+        await respond(writer, '404 Not Found')
+        return
+
+    token = parse_qs(url.query).get('token', [''])[0]
+    user_id = events.read_token(SECRET_KEY, token)
+    if user_id is None:
+        await respond(writer, '403 Forbidden')
+        return
+
+    queue = asyncio.Queue(maxsize=events.EVENTS_QUEUE_SIZE)
+    subscribers.setdefault(user_id, set()).add(queue)
+    try:
+        writer.write(
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: keep-alive\r\n"
+            "X-Accel-Buffering: no\r\n"
+            f"Access-Control-Allow-Origin: {ALLOW_ORIGIN}\r\n"
+            "\r\n"
+            "retry: 3000\n\n".encode('utf-8')
+        )
+        await writer.drain()
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), events.EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                message = ": keep-alive\n\n"
+            writer.write(message.encode('utf-8'))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        user_queues = subscribers.get(user_id)
+        if user_queues is not None:
+            user_queues.discard(queue)
+            if not user_queues:
+                del subscribers[user_id]
+        writer.close()
+
+
+async def run():
+    """Start the UDP publish endpoint and the SSE server"""
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(PublishProtocol, local_addr=(BROKER_HOST, BROKER_UDP_PORT))
+    server = await asyncio.start_server(handle_client, BROKER_HOST, BROKER_HTTP_PORT)
+    print(f"Event broker listening on http://{BROKER_HOST}:{BROKER_HTTP_PORT}/events "
+          f"(publish on udp {BROKER_HOST}:{BROKER_UDP_PORT})")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Start the event broker"""
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Event broker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Live task change events for HaatKhata
+Every task write is published as a small JSON event. In production events go
+over UDP to event_broker.py, which holds the browsers' Server-Sent Events
+connections so no gunicorn worker is tied up by an open stream. Without a
+broker, only the threaded development server (python app.py) streams events
+itself, from an in-process stand-in; gunicorn's sync workers never hold one
+open, so without a broker pages simply do not update live.
+"""
+
+import json
+import os
+import queue
+import socket
+import threading
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from database import Task, on_task_change
+
+# Event configuration from environment variables
+EVENTS_BROKER_ADDR = os.getenv("EVENTS_BROKER_ADDR", "")
+EVENTS_BROKER_URL = os.getenv("EVENTS_BROKER_URL", "")
+EVENTS_KEEPALIVE_SECONDS = int(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+EVENTS_TOKEN_MAX_AGE = int(os.getenv("EVENTS_TOKEN_MAX_AGE", 86400))
+EVENTS_QUEUE_SIZE = 100
+
+# Set by the development server, whose threads can each hold a stream open
+local_stream_enabled = False
+
+
+def format_sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def make_token(secret_key, user_id):
+    """Sign a user id for connecting to the event broker"""
+    return URLSafeTimedSerializer(secret_key, salt='task-events').dumps(user_id)
+
+
+def read_token(secret_key, token, max_age=EVENTS_TOKEN_MAX_AGE):
+    """Return the user id from a broker token, or None if it is invalid"""
+    try:
+        return URLSafeTimedSerializer(secret_key, salt='task-events').loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+
+
+def events_url(secret_key, user_id):
+    """Broker URL for the user's stream, or None to use the local stand-in"""
+    if not EVENTS_BROKER_URL:
+        return None
+    return f"{EVENTS_BROKER_URL}?token={make_token(secret_key, user_id)}"
+
+
+class LocalBroker:
+    """In-process fan-out of events to the streams open in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        """Open a queue that receives the user's events"""
+        subscriber = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        """Close a queue opened with subscribe()"""
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        """Whether the user has a stream open in this process"""
+        with self._lock:
+            return user_id in self._subscribers
+
+    def publish(self, user_id, message):
+        """Deliver a formatted message to every queue of the user"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A stalled client misses events rather than blocking writers
+                pass
+
+
+local_broker = LocalBroker()
+
+_socket = None
+_socket_pid = None
+
+
+def _broker_socket():
+    """UDP socket for publishing to the broker, created once per process"""
+    global _socket, _socket_pid
+    if _socket is None or _socket_pid != os.getpid():
+        _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _socket.setblocking(False)
+        _socket_pid = os.getpid()
+    return _socket
+
+
+def has_listeners(user_id):
+    """Whether an event for user can reach an open stream"""
+    return bool(EVENTS_BROKER_ADDR) or local_broker.has_subscribers(user_id)
+
+
+def publish(user_id, event, data):
+    """Send an event to every open stream of user"""
+    if not EVENTS_BROKER_ADDR:
+        local_broker.publish(user_id, format_sse(event, data))
+        return
+    host, port = EVENTS_BROKER_ADDR.rsplit(':', 1)
+    message = json.dumps({'user_id': user_id, 'event': event, 'data': data}, default=str)
+    try:
+        _broker_socket().sendto(message.encode('utf-8'), (host, int(port)))
+    except OSError as e:
+        print(f"Publishing event failed: {e}")
+
+
+def stream(user_id):
+    """Yield the user's events for the local stand-in stream"""
+    subscriber = local_broker.subscribe(user_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                yield subscriber.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+    finally:
+        local_broker.unsubscribe(user_id, subscriber)
+
+
+def task_payload(task):
+    """The fields the browser needs to patch a task in place"""
+    return {
+        'id': task.id,
+        'title': task.title,
+        'status': task.status,
+        'status_color': task.status_color,
+        'priority': task.priority,
+        'priority_color': task.priority_color,
+        'due_date': task.due_date.strftime('%Y-%m-%d') if task.due_date else None,
+        'is_overdue': task.is_overdue,
+        'parent_id': task.parent_id,
+    }
+
+
+@on_task_change
+def publish_task_change(action, task):
+    """Push the changed task and fresh counters to the owner's streams"""
+    # Nobody is watching, so skip the stats query
+    if not has_listeners(task.user_id):
+        return
+    publish(task.user_id, 'task', {'action': action, 'task': task_payload(task)})
+    stats = Task.get_stats_by_user(task.user_id)
+    publish(task.user_id, 'stats', {key: int(value or 0) for key, value in stats.items()})
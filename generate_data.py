@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator for HaatKhata
+Fills a test database with users, categories, tasks and tags for scale
+testing.
+Task counts per user are long-tailed like real usage, statuses, priorities
+and due dates follow the task's age, and titles mix Bangla and English.
+Everything is derived from the seed, so the same seed gives the same data
+(relative to the time it is run). Rows are written in large multi-row
+INSERTs, or with LOAD DATA LOCAL INFILE when GENERATE_LOAD_DATA is set, and
+the secondary task indexes are dropped during the load and rebuilt at the
+end. Generated users all have the password GENERATE_PASSWORD.
+
+Only run this against a database set aside for testing: ids are handed out
+by the generator, so the app must not be writing at the same time.
+
+Usage:
+    python generate_data.py <users> [seed]
+"""
+
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from werkzeug.security import generate_password_hash
+from database import shards, Category, SHARD_TASK_ID_SPAN
+from task_rollup import insert_rollups
+
+# Generator configuration from environment variables
+GENERATE_TASKS_PER_USER = float(os.getenv("GENERATE_TASKS_PER_USER", 40))
+GENERATE_MAX_TASKS_PER_USER = int(os.getenv("GENERATE_MAX_TASKS_PER_USER", 20000))
+GENERATE_DAYS = int(os.getenv("GENERATE_DAYS", 365))
+GENERATE_BATCH_ROWS = int(os.getenv("GENERATE_BATCH_ROWS", 2000))
+GENERATE_LOAD_DATA = os.getenv("GENERATE_LOAD_DATA", "false").lower() == "true"
+GENERATE_DEFER_INDEXES = os.getenv("GENERATE_DEFER_INDEXES", "true").lower() == "true"
+GENERATE_PASSWORD = os.getenv("GENERATE_PASSWORD", "password")
+# Share of titles and descriptions written in Bangla
+GENERATE_BANGLA_SHARE = float(os.getenv("GENERATE_BANGLA_SHARE", 0.5))
+
+# Spread of the log-normal task count per user; most users have a few
+# tasks, a few have thousands
+TASKS_SIGMA = 1.3
+# Users whose rollups and due-date feed are filled in one statement
+DERIVED_USERS_PER_STATEMENT = 5000
+PROGRESS_EVERY = 10000
+
+# Indexes init_shard_tables() creates on task; the foreign key indexes stay
+DEFERRED_INDEXES = ('idx_task_user', 'idx_task_due_date', 'idx_task_user_priority',
+                    'idx_task_user_due', 'idx_task_status_updated', 'idx_task_due_status')
+
+USER_FIELDS = ['id', 'username', 'email', 'password_hash', 'first_name', 'last_name', 'created_at']
+CATEGORY_FIELDS = ['id', 'name', 'description', 'color', 'created_at', 'user_id']
+TASK_FIELDS = ['id', 'title', 'description', 'status', 'priority', 'due_date',
+               'created_at', 'updated_at', 'user_id', 'category_id', 'completed_at']
+TAG_FIELDS = ['task_id', 'user_id', 'name']
+
+FIRST_NAMES = ['Rahim', 'Karim', 'Nasrin', 'Farhana', 'Tanvir', 'Sabbir', 'Nusrat', 'Mehedi',
+               'Ayesha', 'Imran', 'Sadia', 'Arif', 'Tahmina', 'Rafiq', 'Shirin', 'Jamal',
+               'Anika', 'Fahim', 'Rumana', 'Habib']
+LAST_NAMES = ['Ahmed', 'Hossain', 'Rahman', 'Islam', 'Chowdhury', 'Khan', 'Akter', 'Uddin',
+              'Sarkar', 'Das', 'Roy', 'Begum', 'Alam', 'Mia', 'Haque']
+
+ENGLISH_TITLES = [
+    ('Buy {}', ['groceries', 'milk and eggs', 'printer ink', 'a birthday gift', 'train tickets',
+                'new shoes', 'school supplies', 'medicine']),
+    ('Call {} about the {}', ['the landlord', 'Rahim', 'the bank', 'the plumber', 'mom', 'the client'],
+     ['rent', 'invoice', 'repairs', 'weekend plan', 'contract', 'delivery']),
+    ('Finish the {} report', ['monthly', 'quarterly', 'sales', 'budget', 'project status']),
+    ('Review {}', ['pull requests', 'the draft proposal', 'meeting notes', 'the lease', 'exam answers']),
+    ('Pay the {} bill', ['electricity', 'gas', 'water', 'internet', 'phone', 'credit card']),
+    ('Book {}', ['a doctor appointment', 'bus tickets to Sylhet', 'a table for Friday', 'the hall']),
+    ('Prepare slides for the {}', ['team meeting', 'client demo', 'workshop', 'thesis defense']),
+    ('Fix the {}', ['leaking tap', 'login bug', 'bike chain', 'laptop charger', 'broken shelf']),
+    ('Email {} the {}', ['the team', 'my manager', 'the supplier', 'the professor'],
+     ['agenda', 'updated quote', 'signed form', 'photos', 'schedule']),
+    ('Practice {} for 30 minutes', ['guitar', 'English speaking', 'coding problems', 'yoga']),
+]
+BANGLA_TITLES = [
+    ('বাজার থেকে {} কিনতে হবে', ['চাল', 'ডাল', 'তেল', 'পেঁয়াজ', 'আলু', 'মাছ', 'সবজি', 'দুধ', 'ডিম']),
+    ('{}-কে ফোন করা', ['আম্মু', 'আব্বু', 'রহিম ভাই', 'করিম স্যার', 'নাসরিন আপা', 'বড় ভাই']),
+    ('{} বিল পরিশোধ করা', ['বিদ্যুৎ', 'গ্যাস', 'পানির', 'ইন্টারনেট', 'মোবাইল']),
+    ('{} এসাইনমেন্ট জমা দেওয়া', ['গণিতের', 'পদার্থবিজ্ঞানের', 'ইংরেজির', 'হিসাববিজ্ঞানের']),
+    ('অফিসের {} রিপোর্ট তৈরি করা', ['মাসিক', 'সাপ্তাহিক', 'বিক্রয়', 'বাজেট']),
+    ('{} অ্যাপয়েন্টমেন্ট নেওয়া', ['ডাক্তারের', 'দাঁতের ডাক্তারের', 'ব্যাংকের']),
+    ('{} পরিষ্কার করা', ['ঘর', 'রান্নাঘর', 'বারান্দা', 'আলমারি']),
+    ('{} জন্য টিকিট কাটা', ['ঢাকা যাওয়ার', 'চট্টগ্রাম যাওয়ার', 'ঈদের ছুটির', 'সিনেমার']),
+    ('{} পড়া শেষ করা', ['উপন্যাসটা', 'পত্রিকার কলাম', 'নতুন বইটা']),
+]
+ENGLISH_DESCRIPTIONS = [
+    'Before the end of the week.', 'Check the details first.', 'Ask for a receipt.',
+    'Keep a copy in the shared folder.', 'Needs follow-up after lunch.', 'Remember to bring the documents.',
+    'Compare prices at two shops.', 'Confirm the time the day before.',
+]
+BANGLA_DESCRIPTIONS = [
+    'সপ্তাহ শেষ হওয়ার আগেই করতে হবে।', 'আগে বিস্তারিত দেখে নিতে হবে।', 'রসিদ নিতে ভুলবেন না।',
+    'দুপুরের পরে আবার খোঁজ নিতে হবে।', 'কাগজপত্র সাথে নিতে হবে।', 'দুই দোকানে দাম মিলিয়ে দেখা।',
+]
+CATEGORY_NAMES = [
+    ('Family', '#20c997'), ('Finance', '#fd7e14'), ('Home', '#17a2b8'), ('Travel', '#e83e8c'),
+    ('Side Project', '#6610f2'), ('Errands', '#ffc107'), ('Fitness', '#dc3545'),
+    ('পরিবার', '#20c997'), ('বাজার', '#ffc107'), ('পড়াশোনা', '#6f42c1'), ('অফিস', '#007bff'),
+    ('ঘরের কাজ', '#17a2b8'),
+]
+# How many categories of their own users make, by weight
+OWN_CATEGORY_WEIGHTS = [40, 25, 20, 10, 5]
+TAG_NAMES = ['urgent', 'waiting', 'someday', 'errands', 'phone', 'email', 'home', 'office',
+             'weekend', 'family', 'money', 'health', 'জরুরি', 'বাজার', 'অফিস', 'বাড়ি']
+# How many tags tasks get, by weight
+TAG_COUNT_WEIGHTS = [45, 30, 15, 10]
+PRIORITIES = ['low', 'medium', 'high']
+PRIORITY_WEIGHTS = [25, 50, 25]
+
+
+def task_count(rng):
+    """Long-tailed number of tasks for one user, averaging GENERATE_TASKS_PER_USER"""
+    mu = math.log(GENERATE_TASKS_PER_USER) - TASKS_SIGMA ** 2 / 2
+    return min(GENERATE_MAX_TASKS_PER_USER, int(rng.lognormvariate(mu, TASKS_SIGMA)))
+
+
+def make_text(rng, templates):
+    """Fill a random template with random choices"""
+    template, *choices = rng.choice(templates)
+    return template.format(*(rng.choice(options) for options in choices))
+
+
+def make_task(rng, task_id, user_id, category_ids, joined, now):
+    """One task row in TASK_FIELDS order"""
+    bangla = rng.random() < GENERATE_BANGLA_SHARE
+    title = make_text(rng, BANGLA_TITLES if bangla else ENGLISH_TITLES)
+    description = None
+    if rng.random() < 0.5:
+        description = rng.choice(BANGLA_DESCRIPTIONS if bangla else ENGLISH_DESCRIPTIONS)
+
+    # Recent days are busier than old ones
+    account_seconds = (now - joined).total_seconds()
+    created_at = now - timedelta(seconds=int(account_seconds * rng.random() ** 2))
+    age_days = (now - created_at).total_seconds() / 86400
+
+    # Old tasks are mostly done, fresh ones mostly open
+    if rng.random() < 0.2 + 0.65 * min(1.0, age_days / 60):
+        status = 'completed'
+    else:
+        status = 'in_progress' if rng.random() < 0.3 else 'pending'
+
+    due_date = None
+    if rng.random() < 0.65:
+        due_date = created_at + timedelta(seconds=int(rng.lognormvariate(math.log(4 * 86400), 1)))
+        due_date = due_date.replace(minute=0, second=0)
+
+    completed_at = None
+    if status == 'completed':
+        completed_at = min(now, created_at + timedelta(seconds=int(rng.expovariate(1 / (3 * 86400)))))
+        updated_at = completed_at
+    else:
+        updated_at = created_at + (now - created_at) * (rng.random() * 0.3)
+        updated_at = updated_at.replace(microsecond=0)
+
+    category_id = rng.choice(category_ids) if category_ids and rng.random() < 0.8 else None
+    return (task_id, title, description, status, rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0],
+            due_date, created_at, updated_at, user_id, category_id, completed_at)
+
+
+def make_tags(rng):
+    """Tag names for one task; most tasks have none or one"""
+    count = rng.choices(range(len(TAG_COUNT_WEIGHTS)), TAG_COUNT_WEIGHTS)[0]
+    return rng.sample(TAG_NAMES, count)
+
+
+def _tsv_value(value):
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class BatchWriter:
+    """Buffers rows for one table and writes them GENERATE_BATCH_ROWS at a time"""
+
+    def __init__(self, connection, table, fields, load_data=GENERATE_LOAD_DATA):
+        self.connection = connection
+        self.table = table
+        self.fields = fields
+        self.load_data = load_data
+        self.rows = []
+        self.written = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= GENERATE_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with self.connection.cursor() as cursor:
+            if self.load_data:
+                self._load(cursor)
+            else:
+                placeholder = '(' + ', '.join(['%s'] * len(self.fields)) + ')'
+                cursor.execute(
+                    f"INSERT INTO {self.table} ({', '.join(self.fields)}) "
+                    f"VALUES {', '.join([placeholder] * len(self.rows))}",
+                    [value for row in self.rows for value in row]
+                )
+        self.written += len(self.rows)
+        self.rows = []
+
+    def _load(self, cursor):
+        """Write the buffered rows through a temporary tab-separated file"""
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', delete=False) as f:
+            for row in self.rows:
+                f.write('\t'.join(_tsv_value(value) for value in row) + '\n')
+        try:
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {self.table} CHARACTER SET utf8mb4 "
+                f"({', '.join(self.fields)})",
+                (f.name,)
+            )
+        finally:
+            os.unlink(f.name)
+
+
+def open_loader(db):
+    """A dedicated connection for bulk writes to one shard"""
+    connection = db.connect(local_infile=GENERATE_LOAD_DATA)
+    with connection.cursor() as cursor:
+        # Every row is new and consistent, so skip the per-row checks
+        cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+    return connection
+
+
+def next_id(db, tables, floor=0):
+    """First id after the highest one in tables, and not below floor"""
+    highest = floor
+    for table in tables:
+        row = db.execute_query(f"SELECT MAX(id) as id FROM {table}", fetch=True, fetch_all=False)
+        highest = max(highest, row['id'] or 0)
+    return highest + 1
+
+
+def drop_deferred_indexes(db):
+    """Drop the secondary task indexes that exist on a shard"""
+    rows = db.execute_query(
+        f"""
+        SELECT DISTINCT index_name as name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = 'task'
+        AND index_name IN ({', '.join(['%s'] * len(DEFERRED_INDEXES))})
+        """,
+        DEFERRED_INDEXES,
+        fetch=True
+    )
+    names = [row['name'] for row in rows]
+    if names:
+        db.execute_query(f"ALTER TABLE task {', '.join(f'DROP INDEX {name}' for name in names)}")
+
+
+def fill_derived(db, first_user_id, last_user_id):
+    """Rollups and the reminder feed for a range of generated users on a shard"""
+    for start in range(first_user_id, last_user_id + 1, DERIVED_USERS_PER_STATEMENT):
+        end = min(last_user_id, start + DERIVED_USERS_PER_STATEMENT - 1)
+        with db.transaction() as cursor:
+            insert_rollups(cursor, "user_id BETWEEN %s AND %s", (start, end))
+            # Upcoming due dates go through the same feed as app writes
+            cursor.execute(
+                """
+                INSERT INTO task_due_change (task_id)
+                SELECT id FROM task
+                WHERE user_id BETWEEN %s AND %s AND due_date > NOW() AND status != 'completed'
+                """,
+                (start, end)
+            )
+
+
+def generate(users, seed):
+    """Write users with their categories, tasks and tags; return row counts"""
+    now = datetime.now().replace(microsecond=0)
+    directory = shards.directory
+    password_hash = generate_password_hash(GENERATE_PASSWORD)
+    shared_ids = [category.id for category in Category.get_shared()]
+
+    prefix = f"gen{seed}_"
+    taken = directory.execute_query(
+        "SELECT COUNT(*) as count FROM user WHERE username LIKE %s", (prefix + '%',),
+        fetch=True, fetch_all=False
+    )
+    if taken['count']:
+        raise ValueError(f"Users from seed {seed} already exist, pick another seed")
+
+    first_user_id = next_id(directory, ['user'])
+    category_id = next_id(directory, ['category'])
+    task_ids = {shard.name: next_id(shard, ['task', 'task_archive'], shard.index * SHARD_TASK_ID_SPAN)
+                for shard in shards.all()}
+
+    loaders = {shard.name: open_loader(shard) for shard in shards.all()}
+    user_writer = BatchWriter(loaders[directory.name], 'user', USER_FIELDS)
+    shard_writer = BatchWriter(loaders[directory.name], 'user_shard', ['user_id', 'shard'])
+    category_writer = BatchWriter(loaders[directory.name], 'category', CATEGORY_FIELDS)
+    task_writers = {name: BatchWriter(connection, 'task', TASK_FIELDS) for name, connection in loaders.items()}
+    tag_writers = {name: BatchWriter(connection, 'task_tag', TAG_FIELDS) for name, connection in loaders.items()}
+
+    started = time.monotonic()
+    try:
+        for index in range(users):
+            # Each user has their own stream, so the data does not depend on batching
+            rng = random.Random(f"{seed}:{index}")
+            user_id = first_user_id + index
+            username = f"{prefix}{index}"
+            joined = now - timedelta(seconds=int(GENERATE_DAYS * 86400 * rng.random() ** 0.5) + 3600)
+            user_writer.add((user_id, username, f"{username}@example.com", password_hash,
+                             rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), joined))
+            shard_name = shards.place(user_id)
+            shard_writer.add((user_id, shard_name))
+
+            own_ids = []
+            own = rng.choices(range(len(OWN_CATEGORY_WEIGHTS)), OWN_CATEGORY_WEIGHTS)[0]
+            for name, color in rng.sample(CATEGORY_NAMES, own):
+                category_writer.add((category_id, name, None, color, joined, user_id))
+                own_ids.append(category_id)
+                category_id += 1
+
+            category_ids = shared_ids + own_ids
+            for _ in range(task_count(rng)):
+                task_writers[shard_name].add(
+                    make_task(rng, task_ids[shard_name], user_id, category_ids, joined, now)
+                )
+                for name in make_tags(rng):
+                    tag_writers[shard_name].add((task_ids[shard_name], user_id, name))
+                task_ids[shard_name] += 1
+
+            if (index + 1) % PROGRESS_EVERY == 0:
+                elapsed = time.monotonic() - started
+                written = sum(writer.written for writer in task_writers.values())
+                print(f"  {index + 1} users, {written} tasks ({written / elapsed * 60:,.0f} tasks/min)")
+
+        for writer in [user_writer, shard_writer, category_writer, *task_writers.values(),
+                       *tag_writers.values()]:
+            writer.flush()
+    finally:
+        for connection in loaders.values():
+            connection.close()
+
+    return {
+        'users': user_writer.written,
+        'categories': category_writer.written,
+        'tasks': sum(writer.written for writer in task_writers.values()),
+        'tags': sum(writer.written for writer in tag_writers.values()),
+        'first_user_id': first_user_id,
+        'last_user_id': first_user_id + users - 1,
+        'seconds': time.monotonic() - started,
+    }
+
+
+def main():
+    """Command line entry point"""
+    if len(sys.argv) not in (2, 3) or not all(arg.isdigit() for arg in sys.argv[1:]):
+        print(__doc__.strip().split('Usage:')[1])
+        sys.exit(1)
+    users = int(sys.argv[1])
+    seed = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+
+    shards.init_all()
+    if GENERATE_DEFER_INDEXES:
+        for shard in shards.all():
+            drop_deferred_indexes(shard)
+    try:
+        print(f"Generating {users} users with seed {seed}...")
+        counts = generate(users, seed)
+    finally:
+        if GENERATE_DEFER_INDEXES:
+            print("Rebuilding task indexes...")
+            for shard in shards.all():
+                shard.init_shard_tables(foreign_keys=shard is shards.directory)
+
+    print("Filling rollups and reminders...")
+    for shard in shards.all():
+        fill_derived(shard, counts['first_user_id'], counts['last_user_id'])
+
+    rows = counts['users'] + counts['categories'] + counts['tasks'] + counts['tags']
+    print(f"Generated {counts['users']} users, {counts['categories']} categories, "
+          f"{counts['tasks']} tasks and {counts['tags']} tags in {counts['seconds']:.1f}s "
+          f"({rows / counts['seconds'] * 60:,.0f} rows/min)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Gunicorn configuration for HaatKhata
+Gunicorn picks this file up automatically when started from the project root:
+
+    gunicorn app:app
+
+With GUNICORN_PRELOAD enabled the app and its compiled templates are loaded
+once in the master and shared with workers through copy-on-write. Database
+state is never shared: every worker starts with an empty connection pool and
+warms it up before accepting requests.
+"""
+
+import os
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+accesslog = "-"
+
+_master_started = time.perf_counter()
+
+
+def _shared_memory_kb():
+    """Shared (copy-on-write) memory of the current process, Linux only"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            values = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return sum(int(values.get(key, '0 kB').split()[0]) for key in ('Shared_Clean', 'Shared_Dirty'))
+
+
+def on_starting(server):
+    """Runs in the master before anything else"""
+    import admission
+    # Rows of workers from a previous run that ended without child_exit
+    if admission.RATE_LIMIT_ENABLED:
+        admission.state.reset_workers()
+
+
+def when_ready(server):
+    """Runs in the master once it is ready to spawn workers"""
+    if preload_app:
+        # Compile every template once so workers inherit them
+        from app import app
+        import template_cache
+        template_cache.load_all(app)
+    server.log.info("Master ready in %.2fs (preload_app=%s)",
+                    time.perf_counter() - _master_started, preload_app)
+
+
+def post_fork(server, worker):
+    """Runs in each worker right after it is forked"""
+    if preload_app:
+        import app
+        from database import shards
+        # Connections opened in the master belong to the master
+        for shard in shards.all():
+            shard.reset(close=False)
+        app.BOOT_STARTED = time.perf_counter()
+
+
+def post_worker_init(worker):
+    """Runs in each worker after the app is loaded, before it accepts traffic"""
+    import app
+    import metrics
+    try:
+        connections, elapsed = app.warm_up()
+        worker.log.info("Worker %s warmed up %d connections in %.3fs",
+                        worker.pid, connections, elapsed)
+    except Exception as e:
+        # A cold worker is still better than no worker
+        worker.log.warning("Worker %s warm-up failed: %s", worker.pid, e)
+
+    shared = _shared_memory_kb()
+    if shared is not None:
+        metrics.set_value('worker_shared_memory_kb', shared)
+        worker.log.info("Worker %s shares %d kB with the master", worker.pid, shared)
+
+
+def child_exit(server, worker):
+    """Runs in the master after a worker exits"""
+    import admission
+    # A killed worker never releases its in-flight slots itself
+    admission.state.forget_worker(worker.pid)
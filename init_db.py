@@ -4,15 +4,20 @@ Database initialization script for HaatKhata
 Run this script to create database tables and insert default data.
 """
 
-from database import DatabaseManager
+from database import shards, Category
 
 def main():
     """Initialize database tables and default data"""
     try:
-        db_manager = DatabaseManager()
         print("Initializing database...")
         
-        db_manager.init_database()
+        # Directory tables first, then the task tables on every shard
+        shards.init_all()
+        
+        # Categories created before they were per user go to their users
+        assigned = Category.assign_owners()
+        if assigned:
+            print(f"Assigned {assigned} shared categories to the users of them")
         print("Database initialized successfully!")
         
     except Exception as e:
@@ -0,0 +1,44 @@
+"""
+Lightweight in-process metrics for HaatKhata
+Counters and timings are kept per worker process and exposed in plain text
+at /metrics when METRICS_TOKEN is configured.
+"""
+
+import os
+import threading
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+_lock = threading.Lock()
+_values = {}
+
+
+def incr(name, value=1):
+    """Add value to a counter"""
+    with _lock:
+        _values[name] = _values.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """Record one timing sample as a running total and a count"""
+    with _lock:
+        _values[f'{name}_seconds_total'] = _values.get(f'{name}_seconds_total', 0) + seconds
+        _values[f'{name}_count'] = _values.get(f'{name}_count', 0) + 1
+
+
+def set_value(name, value):
+    """Set a gauge to value"""
+    with _lock:
+        _values[name] = value
+
+
+def snapshot():
+    """Return a copy of all current values"""
+    with _lock:
+        return dict(_values)
+
+
+def render():
+    """Render all values as 'name value' lines"""
+    lines = [f'{name} {value}' for name, value in sorted(snapshot().items())]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,126 @@
+"""
+Rendered page cache for HaatKhata
+Pages are cached per user under a key that contains the user's data
+version, which every task, notification and profile write bumps. A stale
+entry is therefore never read again and simply ages out. Entries live in an
+in-process LRU by default; set PAGE_CACHE_URL to share them between workers
+through Redis (requires the redis package).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Cache configuration from environment variables
+PAGE_CACHE_URL = os.getenv("PAGE_CACHE_URL", "")
+PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 1000))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_MB", 32)) * 1024 * 1024
+DASHBOARD_CACHE_SECONDS = int(os.getenv("DASHBOARD_CACHE_SECONDS", 300))
+
+
+class MemoryCache:
+    """Thread-safe LRU of byte strings bounded by entry count and total size"""
+
+    def __init__(self, max_entries=PAGE_CACHE_MAX_ENTRIES, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value for key, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds, evicting the least recently used entries"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Drop key if cached"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+class RedisCache:
+    """Same interface as MemoryCache, backed by a Redis server
+
+    Memory is bounded by the server's maxmemory setting; use an LRU
+    eviction policy such as allkeys-lru.
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except redis.RedisError:
+            # A cache outage only costs a render
+            return None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ex=max(1, int(ttl)))
+        except redis.RedisError:
+            pass
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except redis.RedisError:
+            pass
+
+
+def make_cache():
+    """Build the configured cache backend"""
+    if PAGE_CACHE_URL:
+        if redis is None:
+            raise RuntimeError("PAGE_CACHE_URL is set but the redis package is not installed")
+        return RedisCache(PAGE_CACHE_URL)
+    return MemoryCache()
+
+
+cache = make_cache()
+
+
+def page_key(page, user_id, version):
+    """Cache key of a user's page at a data version"""
+    return f"page:{page}:{user_id}:{version}"
+
+
+def ttl_until(expires_at, max_seconds=DASHBOARD_CACHE_SECONDS):
+    """Seconds to keep an entry whose content goes stale at expires_at"""
+    if expires_at is None:
+        return max_seconds
+    # Time alone changes the page once a due date passes
+    remaining = (expires_at - datetime.now()).total_seconds()
+    return max(0, min(max_seconds, remaining))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+On-demand request profiling for HaatKhata
+With PROFILE_ENABLED set, selected requests are profiled by a sampling
+thread that records the request thread's stack every few milliseconds.
+A request is selected when it carries a valid X-Profile-Token header or
+falls within PROFILE_SAMPLE_RATE. Each profile is written to
+PROFILE_DIR/<endpoint>/ as a collapsed-stack file (for flamegraph.pl) and a
+speedscope file, and indexed in PROFILE_DIR/index.ndjson with the route,
+query count and database time. Without PROFILE_ENABLED nothing is hooked
+into the app or the database layer.
+
+Usage:
+    python profiling.py token    # print a token for the X-Profile-Token header
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from flask import g, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from database import on_query
+
+# Profiling configuration from environment variables
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", 3600))
+
+# Per-thread query totals of the request being profiled, if any
+_local = threading.local()
+
+
+def make_token(secret_key=SECRET_KEY):
+    """Sign a token that turns on profiling for requests carrying it"""
+    return URLSafeTimedSerializer(secret_key, salt='profile').dumps('profile')
+
+
+def token_is_valid(secret_key, token, max_age=PROFILE_TOKEN_MAX_AGE):
+    """Whether token was made by make_token() and has not expired"""
+    try:
+        URLSafeTimedSerializer(secret_key, salt='profile').loads(token, max_age=max_age)
+        return True
+    except BadSignature:
+        return False
+
+
+class Sampler:
+    """Samples one thread's Python stack on a background thread"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return the wall time in seconds"""
+        self._stop.set()
+        self._thread.join()
+        return time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                # Root first, as flame graphs expect
+                stack = tuple(reversed(stack))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+
+def _frame_label(frame):
+    name, filename, _ = frame
+    return f"{name} ({os.path.basename(filename)})"
+
+
+def write_collapsed(path, samples):
+    """Write samples as 'frame;frame;frame count' lines"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in samples.items():
+            f.write(';'.join(_frame_label(frame) for frame in stack) + f" {count}\n")
+
+
+def write_speedscope(path, samples, name, interval_ms, metadata):
+    """Write samples in speedscope's sampled-profile format"""
+    frames = []
+    frame_index = {}
+    stacks = []
+    weights = []
+    for stack, count in samples.items():
+        indexes = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            indexes.append(frame_index[frame])
+        stacks.append(indexes)
+        weights.append(count * interval_ms)
+
+    document = {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'haatkhata-profiling',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': stacks,
+            'weights': weights,
+        }],
+        # Ignored by speedscope, kept for whoever reads the file
+        'metadata': metadata,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+
+
+def record_query(query, seconds):
+    """Query observer: add the statement to the current request's totals"""
+    totals = getattr(_local, 'totals', None)
+    if totals is not None:
+        totals['queries'] += 1
+        totals['db_seconds'] += seconds
+
+
+def should_profile(app):
+    """Decide whether the current request is profiled"""
+    token = request.headers.get('X-Profile-Token')
+    if token:
+        return token_is_valid(app.config['SECRET_KEY'], token)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def save_profile(sampler, wall_seconds, totals, status_code):
+    """Write the request's profile files and index entry"""
+    endpoint = request.endpoint or 'unknown'
+    directory = os.path.join(PROFILE_DIR, endpoint)
+    os.makedirs(directory, exist_ok=True)
+
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    base = os.path.join(directory, f"{stamp}-{wall_seconds * 1000:.0f}ms")
+    metadata = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': status_code,
+        'wall_ms': round(wall_seconds * 1000, 2),
+        'queries': totals['queries'],
+        'db_ms': round(totals['db_seconds'] * 1000, 2),
+        'samples': sum(sampler.samples.values()),
+        'pid': os.getpid(),
+    }
+    name = (f"{request.method} {request.path} - {metadata['wall_ms']} ms, "
+            f"{metadata['queries']} queries, {metadata['db_ms']} ms in the database")
+
+    write_collapsed(base + '.collapsed', sampler.samples)
+    write_speedscope(base + '.speedscope.json', sampler.samples, name, PROFILE_INTERVAL_MS, metadata)
+    metadata['file'] = os.path.relpath(base, PROFILE_DIR)
+    with open(os.path.join(PROFILE_DIR, 'index.ndjson'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(metadata) + '\n')
+
+
+def init_app(app):
+    """Hook the profiler into the app when PROFILE_ENABLED is set"""
+    if not PROFILE_ENABLED:
+        return
+
+    # Must run before the first pooled connection is opened
+    on_query(record_query)
+
+    @app.before_request
+    def start_profile():
+        if not should_profile(app):
+            return
+        _local.totals = {'queries': 0, 'db_seconds': 0.0}
+        g.profile_sampler = Sampler(threading.get_ident())
+        g.profile_sampler.start()
+
+    @app.after_request
+    def note_status(response):
+        if 'profile_sampler' in g:
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        # Teardown also runs after unhandled errors, so the sampler always stops
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        wall_seconds = sampler.stop()
+        totals = _local.totals
+        _local.totals = None
+        try:
+            save_profile(sampler, wall_seconds, totals, g.pop('profile_status', 500))
+        except OSError as e:
+            print(f"Writing profile failed: {e}")
+
+
+def main():
+    """Command line entry point"""
+    if len(sys.argv) != 2 or sys.argv[1] != 'token':
+        print(__doc__.strip().split('Usage:')[1])
+        sys.exit(1)
+    print(make_token())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+Repeating tasks for HaatKhata
+A series is a row in task_recurrence holding the rule (daily, weekly on
+chosen weekdays, or monthly, every N periods, optionally until a date or for
+a number of times) and the fields each occurrence gets. Only the current
+occurrence is a real task. Completing or deleting it creates the next one.
+Later occurrences are expanded from the rule for the window being shown,
+and each worker caches the expanded windows until the user's data version
+moves. Skipped occurrences, and occurrences turned into a task ahead of time
+to be edited, are the only ones stored, in task_recurrence_exception.
+"""
+
+import calendar
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from database import shards, data_version, on_task_change, Task, Category, RECURRENCE_FREQUENCIES
+import metrics
+
+# Recurrence configuration from environment variables
+RECURRENCE_WINDOW_DAYS = int(os.getenv("RECURRENCE_WINDOW_DAYS", 14))
+RECURRENCE_WINDOW_LIMIT = int(os.getenv("RECURRENCE_WINDOW_LIMIT", 200))
+RECURRENCE_CACHE_WINDOWS = int(os.getenv("RECURRENCE_CACHE_WINDOWS", 1000))
+RECURRENCE_MAX_EVERY = 365
+
+FREQUENCIES = RECURRENCE_FREQUENCIES
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+UNITS = {'daily': 'day', 'weekly': 'week', 'monthly': 'month'}
+
+
+def weekday_list(mask):
+    """Weekday numbers (Monday is 0) set in a weekdays bit mask"""
+    return [day for day in range(7) if mask & (1 << day)]
+
+
+def weekday_mask(days):
+    """Bit mask for an iterable of weekday numbers"""
+    mask = 0
+    for day in days:
+        mask |= 1 << int(day)
+    return mask
+
+
+def add_months(value, months):
+    """value moved by whole months, on the last day of shorter months"""
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def _candidates(rule, since):
+    """(number, time) of the rule's occurrences from shortly before since on
+
+    Numbers count occurrences from the start of the series, so the times
+    limit holds without walking every earlier occurrence.
+    """
+    start = rule.starts_at
+    every = max(1, rule.every)
+    if rule.frequency == 'daily':
+        period = max(0, (since - start).days // every)
+        while True:
+            yield period, start + timedelta(days=period * every)
+            period += 1
+    elif rule.frequency == 'monthly':
+        months = (since.year - start.year) * 12 + since.month - start.month
+        period = max(0, months // every - 1)
+        while True:
+            yield period, add_months(start, period * every)
+            period += 1
+    else:
+        days = weekday_list(rule.weekdays) or [start.weekday()]
+        first_week = [day for day in days if day >= start.weekday()]
+        monday = start - timedelta(days=start.weekday())
+        period = max(0, (since - monday).days // (7 * every))
+        number = len(first_week) + (period - 1) * len(days) if period else 0
+        while True:
+            week = monday + timedelta(weeks=period * every)
+            for day in (first_week if period == 0 else days):
+                yield number, week + timedelta(days=day)
+                number += 1
+            period += 1
+
+
+def occurrences(rule, since=None):
+    """Yield (number, time) of each occurrence of rule at or after since, in order"""
+    since = max(since or rule.starts_at, rule.starts_at)
+    for number, when in _candidates(rule, since):
+        if rule.until and when.date() > rule.until:
+            return
+        if rule.times and number >= rule.times:
+            return
+        if when >= since:
+            yield number, when
+
+
+def describe(rule):
+    """Short human description, e.g. 'Every 2 weeks on Mon, Thu'"""
+    unit = UNITS[rule.frequency]
+    text = f"Every {rule.every} {unit}s" if rule.every > 1 else f"Every {unit}"
+    if rule.frequency == 'weekly':
+        days = weekday_list(rule.weekdays) or [rule.starts_at.weekday()]
+        text += ' on ' + ', '.join(WEEKDAY_NAMES[day] for day in days)
+    if rule.until:
+        text += f" until {rule.until.strftime('%Y-%m-%d')}"
+    if rule.times:
+        text += f", {rule.times} times"
+    return text
+
+
+class Recurrence:
+    """A repeating task series with raw SQL operations"""
+
+    def __init__(self, id=None, user_id=None, title=None, description=None, priority='medium',
+                 category_id=None, frequency='daily', every=1, weekdays=0, starts_at=None,
+                 until=None, times=None, next_at=None, current_task_id=None, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.title = title
+        self.description = description
+        self.priority = priority
+        self.category_id = category_id
+        self.frequency = frequency
+        self.every = every
+        self.weekdays = weekdays
+        self.starts_at = starts_at
+        self.until = until
+        self.times = times
+        # First occurrence without a task yet; None once the series has ended
+        self.next_at = next_at
+        self.current_task_id = current_task_id
+        self.created_at = created_at
+
+    @property
+    def description_text(self):
+        return describe(self)
+
+    @classmethod
+    def create(cls, user_id, title, frequency, starts_at, description=None, priority='medium',
+               category_id=None, every=1, weekdays=0, until=None, times=None):
+        """Start a series and create its first occurrence; return the series"""
+        with shards.for_user(user_id).transaction() as cursor:
+            Task.lock_owner(cursor, user_id)
+            cursor.execute(
+                """
+                INSERT INTO task_recurrence (user_id, title, description, priority, category_id,
+                                             frequency, every, weekdays, starts_at, until, times, next_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (user_id, title, description, priority, category_id, frequency, every, weekdays,
+                 starts_at, until, times, starts_at)
+            )
+            series_id = cursor.lastrowid
+            task_id = cls._advance(cursor, series_id)
+        if task_id:
+            Task.get_by_id(task_id, user_id=user_id).notify_listeners('created')
+        return cls.get_by_id(series_id, user_id)
+
+    @classmethod
+    def get_by_id(cls, series_id, user_id):
+        """The user's series by id, or None"""
+        row = shards.for_user(user_id).execute_query(
+            "SELECT * FROM task_recurrence WHERE id = %s AND user_id = %s",
+            (series_id, user_id),
+            fetch=True,
+            fetch_all=False
+        )
+        return cls(**row) if row else None
+
+    @classmethod
+    def get_by_user(cls, user_id):
+        """Every series of the user, with their exceptions from the next occurrence on"""
+        db = shards.for_user(user_id)
+        series = [cls(**row) for row in db.execute_query(
+            "SELECT * FROM task_recurrence WHERE user_id = %s ORDER BY id", (user_id,), fetch=True
+        )]
+        exceptions = {}
+        if series:
+            rows = db.execute_query(
+                f"""
+                SELECT recurrence_id, occurrence_at, task_id FROM task_recurrence_exception
+                WHERE recurrence_id IN ({', '.join(['%s'] * len(series))})
+                """,
+                [item.id for item in series],
+                fetch=True
+            )
+            for row in rows:
+                exceptions.setdefault(row['recurrence_id'], {})[row['occurrence_at']] = row['task_id']
+        for item in series:
+            item.exceptions = exceptions.get(item.id, {})
+        return series
+
+    @classmethod
+    def get_by_task(cls, task_id, user_id):
+        """The series whose current occurrence is the task, or None"""
+        row = shards.for_user(user_id).execute_query(
+            "SELECT * FROM task_recurrence WHERE current_task_id = %s AND user_id = %s",
+            (task_id, user_id),
+            fetch=True,
+            fetch_all=False
+        )
+        return cls(**row) if row else None
+
+    @classmethod
+    def _advance(cls, cursor, series_id, after_task_id=None):
+        """Give a series its next current occurrence inside the caller's transaction
+
+        With after_task_id, nothing happens unless that task is still the
+        current occurrence, so concurrent completions advance only once.
+        Returns the id of a newly created task, if any.
+        """
+        cursor.execute("SELECT * FROM task_recurrence WHERE id = %s FOR UPDATE", (series_id,))
+        row = cursor.fetchone()
+        if not row or (after_task_id is not None and row['current_task_id'] != after_task_id):
+            return None
+        series = cls(**row)
+
+        cursor.execute(
+            "SELECT occurrence_at, task_id FROM task_recurrence_exception WHERE recurrence_id = %s",
+            (series_id,)
+        )
+        exceptions = {item['occurrence_at']: item['task_id'] for item in cursor.fetchall()}
+
+        current_id = None
+        created_id = None
+        next_at = None
+        upcoming = occurrences(series, series.next_at) if series.next_at else iter(())
+        for _, when in upcoming:
+            if when not in exceptions:
+                created_id = current_id = Task.insert(
+                    cursor, series.title, series.user_id, series.description,
+                    priority=series.priority, due_date=when, category_id=series.category_id
+                )
+            elif exceptions[when] is not None:
+                # Made ahead of time to be edited; it becomes current unless already done
+                cursor.execute("SELECT status FROM task WHERE id = %s", (exceptions[when],))
+                task = cursor.fetchone()
+                if task and task['status'] != 'completed':
+                    current_id = exceptions[when]
+            if current_id:
+                next_at = next(upcoming, (None, None))[1]
+                break
+
+        cursor.execute(
+            "UPDATE task_recurrence SET current_task_id = %s, next_at = %s WHERE id = %s",
+            (current_id, next_at, series_id)
+        )
+        # Exceptions behind the new current occurrence are no longer needed
+        if next_at:
+            cursor.execute(
+                "DELETE FROM task_recurrence_exception WHERE recurrence_id = %s AND occurrence_at < %s",
+                (series_id, next_at)
+            )
+        else:
+            cursor.execute("DELETE FROM task_recurrence_exception WHERE recurrence_id = %s", (series_id,))
+        return created_id
+
+    @classmethod
+    def advance_after(cls, task):
+        """Move the task's series on once its current occurrence is done or deleted"""
+        series = cls.get_by_task(task.id, task.user_id)
+        if series is None:
+            return None
+        with shards.for_user(task.user_id).transaction() as cursor:
+            Task.lock_owner(cursor, task.user_id)
+            created_id = cls._advance(cursor, series.id, after_task_id=task.id)
+        if created_id:
+            Task.get_by_id(created_id, user_id=task.user_id).notify_listeners('created')
+        return created_id
+
+    def _is_upcoming(self, when):
+        """Whether when is a future occurrence that has no task yet"""
+        if not self.next_at or when < self.next_at:
+            return False
+        # Occurrences are in order, so only the first at or after when can match
+        return next(occurrences(self, when), (None, None))[1] == when
+
+    def skip(self, when):
+        """Skip an upcoming occurrence; False if when is not one"""
+        if not self._is_upcoming(when):
+            return False
+        with shards.for_user(self.user_id).transaction() as cursor:
+            Task.lock_owner(cursor, self.user_id)
+            cursor.execute(
+                """
+                INSERT INTO task_recurrence_exception (recurrence_id, occurrence_at, task_id)
+                VALUES (%s, %s, NULL)
+                ON DUPLICATE KEY UPDATE task_id = task_id
+                """,
+                (self.id, when)
+            )
+        return True
+
+    def materialize(self, when):
+        """Turn an upcoming occurrence into its own task so it can be edited
+
+        Returns the task, or None if when is not an upcoming occurrence.
+        """
+        if not self._is_upcoming(when):
+            return None
+        with shards.for_user(self.user_id).transaction() as cursor:
+            Task.lock_owner(cursor, self.user_id)
+            cursor.execute(
+                """
+                SELECT task_id FROM task_recurrence_exception
+                WHERE recurrence_id = %s AND occurrence_at = %s FOR UPDATE
+                """,
+                (self.id, when)
+            )
+            existing = cursor.fetchone()
+            if existing:
+                # Already skipped, or already made into a task
+                task_id = existing['task_id']
+                created = False
+            else:
+                task_id = Task.insert(cursor, self.title, self.user_id, self.description,
+                                      priority=self.priority, due_date=when, category_id=self.category_id)
+                cursor.execute(
+                    """
+                    INSERT INTO task_recurrence_exception (recurrence_id, occurrence_at, task_id)
+                    VALUES (%s, %s, %s)
+                    """,
+                    (self.id, when, task_id)
+                )
+                created = True
+        if task_id is None:
+            return None
+        task = Task.get_by_id(task_id, user_id=self.user_id)
+        if created:
+            task.notify_listeners('created')
+        return task
+
+    def delete(self):
+        """Stop repeating; tasks already created are kept"""
+        with shards.for_user(self.user_id).transaction() as cursor:
+            Task.lock_owner(cursor, self.user_id)
+            cursor.execute("DELETE FROM task_recurrence_exception WHERE recurrence_id = %s", (self.id,))
+            cursor.execute("DELETE FROM task_recurrence WHERE id = %s", (self.id,))
+
+
+def expand(series, start, end, limit=RECURRENCE_WINDOW_LIMIT):
+    """Upcoming occurrences of the series between start and end, soonest first"""
+    found = []
+    for item in series:
+        if not item.next_at:
+            continue
+        category = Category.lookup(item.category_id, item.user_id) if item.category_id else None
+        for _, when in occurrences(item, max(start, item.next_at)):
+            if when >= end or len(found) >= limit:
+                break
+            if when in item.exceptions:
+                continue
+            found.append({
+                'recurrence_id': item.id,
+                'due_date': when,
+                'title': item.title,
+                'priority': item.priority,
+                'category_name': category.name if category else None,
+                'category_color': category.color if category else None,
+                'repeat': item.description_text,
+            })
+    found.sort(key=lambda occurrence: (occurrence['due_date'], occurrence['recurrence_id']))
+    return found[:limit]
+
+
+class Window:
+    """A user's series and their occurrences in one date range"""
+
+    def __init__(self, version, series, occurrences):
+        self.version = version
+        self.series = series
+        self.occurrences = occurrences
+        # Current task id -> its series, for marking repeating tasks
+        self.by_task = {item.current_task_id: item for item in series if item.current_task_id}
+
+
+class WindowCache:
+    """LRU of expanded windows, checked against the user's data version"""
+
+    def __init__(self, max_windows=RECURRENCE_CACHE_WINDOWS):
+        self.max_windows = max_windows
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, start, end):
+        """The user's window from start to end, expanding it if needed"""
+        key = (user_id, start, end)
+        # Read the version first so a write racing the expansion leaves it stale
+        version = data_version(user_id)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window.version == version:
+                self._windows.move_to_end(key)
+                metrics.incr('recurrence_window_hit')
+                return window
+
+        series = Recurrence.get_by_user(user_id)
+        window = Window(version, series, expand(series, start, end))
+        metrics.incr('recurrence_window_miss')
+        with self._lock:
+            self._windows[key] = window
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+        return window
+
+
+cache = WindowCache()
+
+
+def upcoming(user_id, days=RECURRENCE_WINDOW_DAYS):
+    """The user's window from today for the given number of days"""
+    # Whole days keep the cache key stable through the day
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    return cache.get(user_id, today, today + timedelta(days=days))
+
+
+@on_task_change
+def advance_series(action, task):
+    """Create the next occurrence when the current one is completed or deleted"""
+    if action == 'deleted':
+        # An occurrence made ahead of time and then deleted counts as skipped
+        shards.for_user(task.user_id).execute_query(
+            "UPDATE task_recurrence_exception SET task_id = NULL WHERE task_id = %s", (task.id,)
+        )
+    if action == 'deleted' or (action == 'updated' and task.status == 'completed'):
+        Recurrence.advance_after(task)
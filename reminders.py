@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Due-date reminder scheduler for HaatKhata
+Run this script as its own process next to the web app. It keeps the next
+upcoming due dates in a min-heap and sleeps until the earliest one instead of
+polling the task table.
+
+With DB_SHARDS configured, run one scheduler per shard:
+
+    python reminders.py [shard name]
+"""
+
+import heapq
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from database import db_manager, shards, Notification
+
+# Scheduler configuration from environment variables
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", 500))
+REMINDER_POLL_SECONDS = float(os.getenv("REMINDER_POLL_SECONDS", 0.5))
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", 0))
+
+
+class ReminderScheduler:
+    """Fires due-date reminders from an in-memory min-heap of upcoming tasks"""
+
+    def __init__(self, db=db_manager, batch_size=REMINDER_BATCH, poll_seconds=REMINDER_POLL_SECONDS,
+                 lead_minutes=REMINDER_LEAD_MINUTES):
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lead = timedelta(minutes=lead_minutes)
+        self.heap = []
+        # task_id -> due_date currently scheduled; heap entries that disagree are stale
+        self.scheduled = {}
+        # (due_date, id) of the last task loaded; None means everything is loaded
+        self.horizon = None
+        self.change_cursor = 0
+
+    def load_upcoming(self, after, after_id=0):
+        """Load the next batch of due dates after (due_date, id) into the heap"""
+        query = """
+        SELECT id, user_id, title, due_date FROM task
+        WHERE (due_date > %s OR (due_date = %s AND id > %s)) AND status != 'completed'
+        ORDER BY due_date, id
+        LIMIT %s
+        """
+        rows = self.db.execute_query(
+            query, (after, after, after_id, self.batch_size), fetch=True
+        )
+        for row in rows:
+            self.schedule(row)
+        # A short batch means there is nothing further out to load
+        if len(rows) == self.batch_size:
+            self.horizon = (rows[-1]['due_date'], rows[-1]['id'])
+        else:
+            self.horizon = None
+
+    def schedule(self, row):
+        """Push a task onto the heap, replacing any earlier entry for it"""
+        self.scheduled[row['id']] = row['due_date']
+        heapq.heappush(self.heap, (row['due_date'] - self.lead, row['id'], row['due_date'],
+                                   row['user_id'], row['title']))
+
+    def apply_changes(self):
+        """Reschedule tasks listed in the due-change table since the last poll"""
+        changes = self.db.execute_query(
+            "SELECT id, task_id FROM task_due_change WHERE id > %s ORDER BY id LIMIT 1000",
+            (self.change_cursor,),
+            fetch=True
+        )
+        if not changes:
+            return
+
+        task_ids = list({change['task_id'] for change in changes})
+        placeholders = ', '.join(['%s'] * len(task_ids))
+        rows = self.db.execute_query(
+            f"""
+            SELECT id, user_id, title, due_date, status FROM task
+            WHERE id IN ({placeholders})
+            """,
+            task_ids,
+            fetch=True
+        )
+        current = {row['id']: row for row in rows}
+        now = datetime.now()
+
+        for task_id in task_ids:
+            # Drop the old entry; stale heap items are skipped when popped
+            self.scheduled.pop(task_id, None)
+            row = current.get(task_id)
+            if not row or not row['due_date'] or row['status'] == 'completed':
+                continue
+            if row['due_date'] <= now:
+                continue
+            # Beyond the loaded horizon the task will be picked up by the next refill
+            if self.horizon is None or (row['due_date'], task_id) <= self.horizon:
+                self.schedule(row)
+
+        self.change_cursor = changes[-1]['id']
+        self.db.execute_query(
+            "DELETE FROM task_due_change WHERE id <= %s", (self.change_cursor,)
+        )
+
+    def fire_due(self, now):
+        """Record reminders for every heap entry whose time has come"""
+        fired = 0
+        while self.heap and self.heap[0][0] <= now:
+            _, task_id, due_date, user_id, title = heapq.heappop(self.heap)
+            if self.scheduled.get(task_id) != due_date:
+                continue
+            del self.scheduled[task_id]
+            Notification.create(
+                user_id=user_id,
+                task_id=task_id,
+                kind='due',
+                message=f'"{title}" is due {due_date.strftime("%Y-%m-%d %H:%M")}',
+                due_date=due_date
+            )
+            fired += 1
+
+        # Refill once the loaded window has been used up
+        if not self.scheduled and self.horizon is not None:
+            self.load_upcoming(*self.horizon)
+        return fired
+
+    def seconds_until_next(self, now):
+        """Seconds to sleep before the next reminder or change poll"""
+        if not self.heap:
+            return self.poll_seconds
+        wait = (self.heap[0][0] - now).total_seconds()
+        return max(0, min(wait, self.poll_seconds))
+
+    def run(self):
+        """Run the scheduler loop forever"""
+        # Start the change cursor at the current end of the change table so
+        # the initial load is not immediately re-applied
+        latest = self.db.execute_query(
+            "SELECT COALESCE(MAX(id), 0) as latest FROM task_due_change",
+            fetch=True,
+            fetch_all=False
+        )
+        self.change_cursor = latest['latest']
+        self.load_upcoming(datetime.now())
+        print(f"Reminder scheduler started with {len(self.scheduled)} upcoming due dates")
+
+        while True:
+            self.apply_changes()
+            now = datetime.now()
+            fired = self.fire_due(now)
+            if fired:
+                print(f"Sent {fired} reminder(s)")
+            time.sleep(self.seconds_until_next(datetime.now()))
+
+
+def main():
+    """Start the reminder scheduler"""
+    try:
+        db = shards.get(sys.argv[1]) if len(sys.argv) > 1 else db_manager
+        ReminderScheduler(db).run()
+    except KeyboardInterrupt:
+        print("Reminder scheduler stopped.")
+
+
+if __name__ == "__main__":
+    main()
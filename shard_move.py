@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Move one user's task data to another shard for HaatKhata
+The move copies in batches while the user keeps working, replays their
+change log to catch up, flips the directory entry and finally cleans up the
+old shard. Progress is stored in the shard_move table, so an interrupted
+move picks up where it stopped when the same command is run again.
+
+Usage:
+    python shard_move.py <username> <target shard>
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+from database import db_manager, shards, User, Task, SHARD_CACHE_SECONDS, TASK_ARCHIVE_COLUMNS
+from task_rollup import rebuild_user
+
+# Move configuration from environment variables
+SHARD_MOVE_BATCH = int(os.getenv("SHARD_MOVE_BATCH", 500))
+# Extra wait after the directory flip for requests still using the old entry
+SHARD_MOVE_SETTLE_SECONDS = 5
+
+TASK_FIELDS = ['id', 'title', 'description', 'status', 'priority', 'due_date',
+               'created_at', 'updated_at', 'user_id', 'category_id', 'completed_at', 'parent_id']
+NOTIFICATION_FIELDS = ['user_id', 'task_id', 'kind', 'message', 'due_date', 'created_at', 'read_at']
+RECURRENCE_FIELDS = ['id', 'user_id', 'title', 'description', 'priority', 'category_id', 'frequency',
+                     'every', 'weekdays', 'starts_at', 'until', 'times', 'next_at', 'current_task_id', 'created_at']
+RECURRENCE_EXCEPTION_FIELDS = ['recurrence_id', 'occurrence_at', 'task_id']
+TAG_FIELDS = ['task_id', 'user_id', 'name']
+
+
+def load_state(user_id):
+    """The saved progress of a move, or None"""
+    return db_manager.execute_query(
+        "SELECT * FROM shard_move WHERE user_id = %s", (user_id,), fetch=True, fetch_all=False
+    )
+
+
+def save_state(user_id, **fields):
+    """Persist move progress"""
+    assignments = ', '.join(f"{key} = %s" for key in fields)
+    db_manager.execute_query(
+        f"UPDATE shard_move SET {assignments} WHERE user_id = %s",
+        list(fields.values()) + [user_id]
+    )
+
+
+def start(user_id, target):
+    """Record a new move, taking the change cursor before anything is copied"""
+    source = shards.shard_name_for(user_id)
+    row = shards.get(source).execute_query(
+        "SELECT COALESCE(MAX(id), 0) as latest FROM task_changes WHERE user_id = %s",
+        (user_id,),
+        fetch=True,
+        fetch_all=False
+    )
+    db_manager.execute_query(
+        """
+        INSERT INTO shard_move (user_id, source, target, phase, change_cursor)
+        VALUES (%s, %s, %s, 'copying', %s)
+        """,
+        (user_id, source, target, row['latest'])
+    )
+    return load_state(user_id)
+
+
+def upsert_tasks(db, rows):
+    """Write task rows to a shard, keeping their ids"""
+    if not rows:
+        return
+    placeholder = f"({', '.join(['%s'] * len(TASK_FIELDS))})"
+    updates = ', '.join(f"{field} = VALUES({field})" for field in TASK_FIELDS if field != 'id')
+    with db.transaction() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO task ({', '.join(TASK_FIELDS)})
+            VALUES {', '.join([placeholder] * len(rows))}
+            ON DUPLICATE KEY UPDATE {updates}
+            """,
+            [row[field] for row in rows for field in TASK_FIELDS]
+        )
+        # Let the target's reminder scheduler pick up the copied due dates
+        now = datetime.now()
+        upcoming = [row['id'] for row in rows
+                    if row['due_date'] and row['due_date'] > now and row['status'] != 'completed']
+        if upcoming:
+            cursor.execute(
+                f"INSERT INTO task_due_change (task_id) VALUES {', '.join(['(%s)'] * len(upcoming))}",
+                upcoming
+            )
+
+
+def copy_tags(source, target, task_ids):
+    """Replace the target's tags of these tasks with the source's"""
+    if not task_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(task_ids))
+    rows = source.execute_query(
+        f"SELECT {', '.join(TAG_FIELDS)} FROM task_tag WHERE task_id IN ({placeholders})", task_ids, fetch=True
+    )
+    with target.transaction() as cursor:
+        cursor.execute(f"DELETE FROM task_tag WHERE task_id IN ({placeholders})", task_ids)
+        if rows:
+            placeholder = f"({', '.join(['%s'] * len(TAG_FIELDS))})"
+            cursor.execute(
+                f"INSERT INTO task_tag ({', '.join(TAG_FIELDS)}) VALUES {', '.join([placeholder] * len(rows))}",
+                [row[field] for row in rows for field in TAG_FIELDS]
+            )
+
+
+def copy_tasks(state, source, target):
+    """Copy the user's tasks in id order, resuming after last_task_id"""
+    last_task_id = state['last_task_id']
+    while True:
+        rows = source.execute_query(
+            "SELECT * FROM task WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s",
+            (state['user_id'], last_task_id, SHARD_MOVE_BATCH),
+            fetch=True
+        )
+        if not rows:
+            return
+        upsert_tasks(target, rows)
+        copy_tags(source, target, [row['id'] for row in rows])
+        last_task_id = rows[-1]['id']
+        save_state(state['user_id'], last_task_id=last_task_id)
+
+
+def copy_archive(state, source, target):
+    """Copy the user's archived tasks and their count; safe to repeat"""
+    user_id = state['user_id']
+    last_id = 0
+    while True:
+        rows = source.execute_query(
+            f"""
+            SELECT {TASK_ARCHIVE_COLUMNS}, archived_at FROM task_archive
+            WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s
+            """,
+            (user_id, last_id, SHARD_MOVE_BATCH),
+            fetch=True
+        )
+        if not rows:
+            break
+        fields = list(rows[0].keys())
+        placeholder = f"({', '.join(['%s'] * len(fields))})"
+        target.execute_query(
+            f"""
+            INSERT IGNORE INTO task_archive ({', '.join(fields)})
+            VALUES {', '.join([placeholder] * len(rows))}
+            """,
+            [row[field] for row in rows for field in fields]
+        )
+        copy_tags(source, target, [row['id'] for row in rows])
+        last_id = rows[-1]['id']
+
+    count = source.execute_query(
+        "SELECT completed FROM task_archive_count WHERE user_id = %s",
+        (user_id,),
+        fetch=True,
+        fetch_all=False
+    )
+    if count:
+        target.execute_query(
+            """
+            INSERT INTO task_archive_count (user_id, completed) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE completed = VALUES(completed)
+            """,
+            (user_id, count['completed'])
+        )
+
+
+def catch_up(state, source, target):
+    """Replay the user's source change log onto the target"""
+    user_id = state['user_id']
+    while True:
+        changes = source.execute_query(
+            "SELECT id, task_id FROM task_changes WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s",
+            (user_id, state['change_cursor'], SHARD_MOVE_BATCH),
+            fetch=True
+        )
+        if not changes:
+            return
+
+        task_ids = list({change['task_id'] for change in changes})
+        placeholders = ', '.join(['%s'] * len(task_ids))
+        rows = source.execute_query(
+            f"SELECT * FROM task WHERE id IN ({placeholders})", task_ids, fetch=True
+        )
+        upsert_tasks(target, rows)
+
+        # Tag changes are logged as task updates, and deleted tasks lose theirs
+        copy_tags(source, target, task_ids)
+        deleted = list(set(task_ids) - {row['id'] for row in rows})
+        if deleted:
+            target.execute_query(
+                f"DELETE FROM task WHERE id IN ({', '.join(['%s'] * len(deleted))})", deleted
+            )
+
+        state['change_cursor'] = changes[-1]['id']
+        save_state(user_id, change_cursor=state['change_cursor'])
+
+
+def carry_data_version(user_id, source, target):
+    """Start the target's data version above the source's so page cache keys never repeat"""
+    row = source.execute_query(
+        "SELECT version FROM task_owner_lock WHERE user_id = %s", (user_id,), fetch=True, fetch_all=False
+    )
+    target.execute_query(
+        """
+        INSERT INTO task_owner_lock (user_id, version) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE version = GREATEST(version, VALUES(version))
+        """,
+        (user_id, (row['version'] if row else 0) + 1)
+    )
+
+
+def rebuild_closure(db, user_id):
+    """Recompute the user's subtask trees on a shard from the copied parent ids"""
+    with db.transaction() as cursor:
+        Task.lock_owner(cursor, user_id)
+        Task.rebuild_closure(cursor, user_id)
+
+
+def delete_in_batches(db, table, user_id):
+    """Delete the user's rows from a table without one long transaction"""
+    while True:
+        db.execute_query(
+            f"DELETE FROM {table} WHERE user_id = %s LIMIT %s", (user_id, SHARD_MOVE_BATCH)
+        )
+        remaining = db.execute_query(
+            f"SELECT 1 FROM {table} WHERE user_id = %s LIMIT 1", (user_id,), fetch=True
+        )
+        if not remaining:
+            return
+
+
+def copy_rows(source, target, table, fields, where, params):
+    """Copy the rows of a table matching where from source to target in batches"""
+    rows = source.execute_query(
+        f"SELECT {', '.join(fields)} FROM {table} WHERE {where}", params, fetch=True
+    )
+    placeholder = f"({', '.join(['%s'] * len(fields))})"
+    for start_at in range(0, len(rows), SHARD_MOVE_BATCH):
+        batch = rows[start_at:start_at + SHARD_MOVE_BATCH]
+        target.execute_query(
+            f"""
+            INSERT IGNORE INTO {table} ({', '.join(fields)})
+            VALUES {', '.join([placeholder] * len(batch))}
+            """,
+            [row[field] for row in batch for field in fields]
+        )
+
+
+def clean_up(state, source, target):
+    """Bring notifications and repeating tasks over and remove the user's data from the source"""
+    user_id = state['user_id']
+    copy_rows(source, target, 'notification', NOTIFICATION_FIELDS, "user_id = %s", (user_id,))
+    # Series keep their ids, which come from the source shard's own range
+    copy_rows(source, target, 'task_recurrence', RECURRENCE_FIELDS, "user_id = %s", (user_id,))
+    series_ids = "recurrence_id IN (SELECT id FROM task_recurrence WHERE user_id = %s)"
+    copy_rows(source, target, 'task_recurrence_exception', RECURRENCE_EXCEPTION_FIELDS, series_ids, (user_id,))
+    source.execute_query(f"DELETE FROM task_recurrence_exception WHERE {series_ids}", (user_id,))
+
+    for table in ('notification', 'task_changes', 'task', 'task_archive',
+                  'task_archive_count', 'task_owner_lock', 'task_daily_rollup', 'task_closure', 'task_tag',
+                  'task_digest', 'task_digest_item', 'task_recurrence'):
+        delete_in_batches(source, table, user_id)
+
+
+def move_user(user_id, target_name):
+    """Run (or resume) a move of the user's tasks to target_name"""
+    state = load_state(user_id)
+    if state is None:
+        if shards.shard_name_for(user_id) == target_name:
+            print("User is already on that shard")
+            return
+        state = start(user_id, target_name)
+    elif state['target'] != target_name:
+        raise ValueError(f"A move to {state['target']} is already in progress")
+
+    source = shards.get(state['source'])
+    target = shards.get(state['target'])
+
+    if state['phase'] == 'copying':
+        print(f"Copying tasks from {state['source']} to {state['target']}...")
+        copy_tasks(state, source, target)
+        copy_archive(state, source, target)
+        save_state(user_id, phase='catching_up')
+        state['phase'] = 'catching_up'
+
+    if state['phase'] == 'catching_up':
+        print("Replaying changes made during the copy...")
+        catch_up(state, source, target)
+        save_state(user_id, phase='switching')
+        state['phase'] = 'switching'
+
+    if state['phase'] == 'switching':
+        carry_data_version(user_id, source, target)
+        shards.assign(user_id, state['target'])
+        # Workers keep using their cached entry until it expires
+        wait = SHARD_CACHE_SECONDS + SHARD_MOVE_SETTLE_SECONDS
+        print(f"Directory updated, waiting {wait}s for workers to follow...")
+        time.sleep(wait)
+        catch_up(state, source, target)
+        # Writes since the flip updated the target's rollups and trees piecemeal
+        rebuild_user(target, user_id)
+        rebuild_closure(target, user_id)
+        save_state(user_id, phase='cleaning')
+        state['phase'] = 'cleaning'
+
+    if state['phase'] == 'cleaning':
+        print(f"Removing the user's data from {state['source']}...")
+        clean_up(state, source, target)
+        db_manager.execute_query("DELETE FROM shard_move WHERE user_id = %s", (user_id,))
+
+    print("Move complete")
+
+
+def main():
+    """Command line entry point"""
+    if len(sys.argv) != 3:
+        print(__doc__.strip().split('Usage:')[1])
+        sys.exit(1)
+
+    username, target_name = sys.argv[1], sys.argv[2]
+    user = User.get_by_username(username)
+    if not user:
+        print(f"Unknown user: {username}")
+        sys.exit(1)
+    if target_name not in shards.shards:
+        print(f"Unknown shard: {target_name}")
+        sys.exit(1)
+
+    move_user(user.id, target_name)
+
+
+if __name__ == "__main__":
+    main()
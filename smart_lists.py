@@ -0,0 +1,120 @@
+"""
+Smart lists for HaatKhata
+A smart list is a saved set of Tasks page filters. Its status, category,
+priority and search compile to one WHERE clause, and the ids it matches are
+cached per worker in the list's sort order, so opening a page of the list
+only fetches that page's tasks by primary key. A task write drops the cached
+ids of just the lists whose status, category and priority the task now
+passes or whose ids held it; a delete takes the id out. A user's lists are
+held in an LRU over users and compared with the user's data version on
+every open, so changes made by another worker, an import or the archive job
+reload them.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from database import Task, SmartList, data_version, on_task_change
+import metrics
+
+# Smart list configuration from environment variables
+SMART_LIST_CACHE_USERS = int(os.getenv("SMART_LIST_CACHE_USERS", 1000))
+SMART_LIST_PAGE_SIZE = int(os.getenv("SMART_LIST_PAGE_SIZE", 50))
+
+
+class UserLists:
+    """One user's smart lists and the ids of those opened so far"""
+
+    def __init__(self, version, smart_lists):
+        self.version = version
+        self.lists = smart_lists
+        self.by_id = {smart_list.id: smart_list for smart_list in smart_lists}
+        # list id -> (task ids in sort order, the same ids as a set)
+        self.results = {}
+
+    def apply(self, action, task):
+        """Drop or patch the cached ids a task write can change"""
+        for list_id, (ids, members) in list(self.results.items()):
+            if action == 'deleted':
+                if task.id in members:
+                    ids.remove(task.id)
+                    members.discard(task.id)
+            elif task.id in members or self.by_id[list_id].could_match(task):
+                del self.results[list_id]
+                metrics.incr('smart_list_invalidations')
+        # Each task write bumps the data version once
+        self.version += 1
+
+
+class SmartListCache:
+    """LRU of per-user smart lists with their cached ids"""
+
+    def __init__(self, max_users=SMART_LIST_CACHE_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_for_user(self, user_id):
+        """The user's smart lists by name"""
+        return list(self._load(user_id).lists)
+
+    def open(self, user_id, list_id, page=1, page_size=SMART_LIST_PAGE_SIZE):
+        """The list, the tasks on one of its pages and the pager, or None if it is not the user's"""
+        state = self._load(user_id)
+        smart_list = state.by_id.get(list_id)
+        if smart_list is None:
+            return None
+
+        with self._lock:
+            cached = state.results.get(list_id)
+            ids = list(cached[0]) if cached else None
+            version = state.version
+        if ids is None:
+            ids = smart_list.get_task_ids()
+            metrics.incr('smart_list_misses')
+            with self._lock:
+                # A write this worker made meanwhile may not be in the ids
+                if state.version == version:
+                    state.results[list_id] = (list(ids), set(ids))
+
+        pages = max(1, -(-len(ids) // page_size))
+        page = min(max(page, 1), pages)
+        page_ids = ids[(page - 1) * page_size:page * page_size]
+        tasks = Task.get_by_user(user_id, task_ids=page_ids)
+        position = {task_id: index for index, task_id in enumerate(page_ids)}
+        tasks.sort(key=lambda task: position[task.id])
+        return smart_list, tasks, {'page': page, 'pages': pages, 'total': len(ids)}
+
+    def _load(self, user_id):
+        """The user's lists, reloaded if missing or behind the data version"""
+        # Read the version first so a write racing the reload leaves it stale
+        version = data_version(user_id)
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None and state.version == version:
+                self._users.move_to_end(user_id)
+                return state
+
+        state = UserLists(version, SmartList.get_for_user(user_id))
+        with self._lock:
+            self._users[user_id] = state
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return state
+
+    def apply(self, action, task):
+        """Fold one of this worker's task writes into the user's cached ids"""
+        with self._lock:
+            state = self._users.get(task.user_id)
+            if state is not None:
+                state.apply(action, task)
+
+
+cache = SmartListCache()
+
+
+@on_task_change
+def update_smart_lists(action, task):
+    """Keep cached smart list ids in step with task writes"""
+    cache.apply(action, task)
@@ -4,6 +4,24 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize dark mode
     initializeDarkMode();
     
+    // Live task updates pushed by the server
+    initializeLiveUpdates();
+    
+    // One-click status and priority changes
+    initializeQuickEdits();
+    
+    // As-you-type title suggestions in the search box
+    initializeTypeahead();
+    
+    // Pick a new parent task by title on the edit page
+    initializeParentPicker();
+    
+    // Show the repeat settings that fit the chosen frequency
+    initializeRepeatOptions();
+    
+    // Subtask trees load one level at a time as they are expanded
+    initializeSubtasks();
+    
     // Set dynamic category colors
     const categoryBadges = document.querySelectorAll('.category-badge[data-color]');
     categoryBadges.forEach(badge => {
@@ -195,6 +213,339 @@ function setTheme(theme) {
     });
 }
 
+// Live Update Functions
+function initializeLiveUpdates() {
+    const url = document.body.dataset.eventsUrl;
+    if (!url || !window.EventSource) {
+        return;
+    }
+    
+    const source = new EventSource(url);
+    source.addEventListener('task', (e) => applyTaskEvent(JSON.parse(e.data)));
+    source.addEventListener('stats', (e) => applyStatsEvent(JSON.parse(e.data)));
+}
+
+function formatLabel(value) {
+    return value.replace('_', ' ').replace(/\b\w/g, (c) => c.toUpperCase());
+}
+
+function setBadge(badge, color, text) {
+    if (!badge) {
+        return;
+    }
+    badge.className = badge.className.replace(/\bbg-\w+/g, '').trim() + ` bg-${color}`;
+    badge.textContent = text;
+}
+
+// Typeahead Functions
+const TYPEAHEAD_DELAY_MS = 150;
+
+function initializeTypeahead() {
+    const input = document.querySelector('[data-typeahead]');
+    const menu = input && document.getElementById(input.dataset.typeahead);
+    if (!menu) {
+        return;
+    }
+    watchSuggestions(input, menu, (suggestions) => renderSuggestions(menu, suggestions));
+}
+
+function watchSuggestions(input, menu, render) {
+    let timer = null;
+    let pending = null;
+    const hide = () => menu.classList.remove('show');
+    
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        const prefix = input.value.trim();
+        if (!prefix) {
+            hide();
+            return;
+        }
+        // Wait for a pause in typing, and drop answers to older prefixes
+        timer = setTimeout(() => {
+            if (pending) {
+                pending.abort();
+            }
+            pending = new AbortController();
+            fetch(`/api/tasks/suggest?q=${encodeURIComponent(prefix)}`, {signal: pending.signal})
+                .then((response) => response.ok ? response.json() : Promise.reject(response))
+                .then((data) => render(data.suggestions))
+                .catch(() => {});
+        }, TYPEAHEAD_DELAY_MS);
+    });
+    input.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') {
+            hide();
+        }
+    });
+    input.addEventListener('blur', () => setTimeout(hide, 150));
+}
+
+function renderSuggestions(menu, suggestions) {
+    menu.replaceChildren(...suggestions.map((suggestion) => {
+        const link = document.createElement('a');
+        link.className = 'dropdown-item text-truncate';
+        link.href = `/task/${suggestion.id}/edit`;
+        link.textContent = suggestion.title;
+        return link;
+    }));
+    menu.classList.toggle('show', suggestions.length > 0);
+}
+
+function initializeParentPicker() {
+    const input = document.querySelector('[data-parent-picker]');
+    const menu = input && document.getElementById(input.dataset.parentPicker);
+    if (!menu) {
+        return;
+    }
+    
+    const hidden = document.getElementById(input.dataset.parentInput);
+    // The task and its own subtasks cannot become its parent
+    const excluded = new Set(input.dataset.exclude.split(',').filter(Boolean).map(Number));
+    let chosen = input.value;
+    const choose = (id, title) => {
+        hidden.value = id;
+        input.value = chosen = title;
+        menu.classList.remove('show');
+    };
+    
+    watchSuggestions(input, menu, (suggestions) => {
+        menu.replaceChildren(...suggestions.filter((suggestion) => !excluded.has(suggestion.id)).map((suggestion) => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'dropdown-item text-truncate';
+            item.textContent = suggestion.title;
+            // mousedown runs before the input's blur hides the menu
+            item.addEventListener('mousedown', (e) => {
+                e.preventDefault();
+                choose(suggestion.id, suggestion.title);
+            });
+            return item;
+        }));
+        menu.classList.toggle('show', menu.children.length > 0);
+    });
+    // Typing without picking a task keeps the current parent
+    input.addEventListener('change', () => {
+        if (!input.value.trim()) {
+            choose('', '');
+        } else {
+            input.value = chosen;
+        }
+    });
+    document.querySelector(`[data-parent-clear="${input.id}"]`).addEventListener('click', () => choose('', ''));
+}
+
+// Repeat Functions
+function initializeRepeatOptions() {
+    const select = document.querySelector('[data-repeat-select]');
+    if (!select) {
+        return;
+    }
+    
+    const update = () => {
+        document.querySelectorAll('[data-repeat-option]').forEach((option) => {
+            const only = option.dataset.repeatOption;
+            option.hidden = !select.value || (only && only !== select.value);
+        });
+    };
+    select.addEventListener('change', update);
+    update();
+}
+
+// Subtask Functions
+function initializeSubtasks() {
+    document.addEventListener('click', (e) => {
+        const toggle = e.target.closest('[data-subtasks-toggle]');
+        if (!toggle) {
+            return;
+        }
+        
+        const list = toggle.nextElementSibling;
+        const open = toggle.getAttribute('aria-expanded') !== 'true';
+        toggle.setAttribute('aria-expanded', open);
+        list.hidden = !open;
+        if (!open || list.dataset.loaded) {
+            return;
+        }
+        
+        list.dataset.loaded = 'true';
+        fetch(`/api/tasks/${toggle.dataset.subtasksToggle}/subtasks`)
+            .then((response) => response.ok ? response.json() : Promise.reject(response))
+            .then((data) => list.replaceChildren(...data.subtasks.map(buildSubtaskItem)))
+            .catch(() => {
+                delete list.dataset.loaded;
+                showToast('Could not load the subtasks. Please try again.', 'danger');
+            });
+    });
+}
+
+function buildSubtaskItem(task) {
+    const item = document.createElement('li');
+    item.className = 'list-group-item px-0';
+    item.dataset.taskId = task.id;
+    item.innerHTML = `
+        <div class="d-flex justify-content-between align-items-center gap-2">
+            <a class="fw-bold text-decoration-none text-truncate"></a>
+            <button type="button" class="badge border-0 task-status" data-task-patch="status" title="Change status"></button>
+        </div>
+    `;
+    const link = item.querySelector('a');
+    link.href = `/task/${task.id}/edit`;
+    link.textContent = task.title;
+    link.classList.toggle('text-danger', task.is_overdue);
+    setBadge(item.querySelector('.task-status'), task.status_color, formatLabel(task.status));
+    item.querySelector('.task-status').dataset.value = task.status;
+    
+    // Deeper levels stay collapsed until asked for
+    if (task.progress) {
+        const toggle = document.createElement('button');
+        toggle.type = 'button';
+        toggle.className = 'btn btn-link btn-sm p-0 text-decoration-none';
+        toggle.dataset.subtasksToggle = task.id;
+        toggle.setAttribute('aria-expanded', 'false');
+        toggle.textContent = `${task.progress.completed} of ${task.progress.total} subtasks done`;
+        const list = document.createElement('ul');
+        list.className = 'list-group list-group-flush subtask-list';
+        list.hidden = true;
+        item.append(toggle, list);
+    }
+    return item;
+}
+
+// Quick Edit Functions
+const QUICK_EDIT_CYCLES = {
+    status: ['pending', 'in_progress', 'completed'],
+    priority: ['low', 'medium', 'high']
+};
+
+function initializeQuickEdits() {
+    document.addEventListener('click', (e) => {
+        const badge = e.target.closest('[data-task-patch]');
+        const item = badge && badge.closest('[data-task-id]');
+        if (!item || badge.disabled) {
+            return;
+        }
+        
+        const field = badge.dataset.taskPatch;
+        const cycle = QUICK_EDIT_CYCLES[field];
+        const next = cycle[(cycle.indexOf(badge.dataset.value) + 1) % cycle.length];
+        
+        badge.disabled = true;
+        fetch(`/api/tasks/${item.dataset.taskId}`, {
+            method: 'PATCH',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({[field]: next})
+        })
+            .then((response) => response.ok ? response.json() : Promise.reject(response))
+            .then((task) => applyTaskPatch(task))
+            .catch(() => showToast('Could not update the task. Please try again.', 'danger'))
+            .finally(() => { badge.disabled = false; });
+    });
+}
+
+function applyTaskPatch(task) {
+    document.querySelectorAll(`[data-task-id="${task.id}"]`).forEach((element) => {
+        Object.keys(QUICK_EDIT_CYCLES).forEach((field) => {
+            if (task[field] === undefined) {
+                return;
+            }
+            const badge = element.querySelector(`.task-${field}`);
+            setBadge(badge, task[`${field}_color`], formatLabel(task[field]));
+            if (badge) {
+                badge.dataset.value = task[field];
+            }
+            if (field === 'priority') {
+                const card = element.querySelector('.task-card');
+                if (card) {
+                    card.className = card.className.replace(/\bpriority-\w+/g, `priority-${task.priority}`);
+                }
+            }
+        });
+        const card = element.querySelector('.task-card');
+        if (card) {
+            card.classList.toggle('task-overdue', task.is_overdue);
+        }
+    });
+}
+
+function applyTaskEvent(event) {
+    const task = event.task;
+    const elements = document.querySelectorAll(`[data-task-id="${task.id}"]`);
+    
+    if (event.action === 'deleted') {
+        elements.forEach((element) => element.remove());
+        return;
+    }
+    
+    if (event.action === 'created' && elements.length === 0) {
+        // New subtasks show up when their parent is expanded
+        if (task.parent_id) {
+            return;
+        }
+        // A filtered view cannot tell whether the new task belongs in it
+        const list = document.querySelector('[data-task-list]');
+        if (list && !('filtered' in list.dataset)) {
+            list.prepend(buildTaskColumn(task));
+        }
+        return;
+    }
+    
+    elements.forEach((element) => {
+        const title = element.querySelector('.card-title, .fw-bold');
+        if (title) {
+            title.textContent = task.title;
+        }
+        setBadge(element.querySelector('.task-status'), task.status_color, formatLabel(task.status));
+        setBadge(element.querySelector('.task-priority'), task.priority_color, formatLabel(task.priority));
+        element.querySelectorAll('[data-task-patch]').forEach((badge) => {
+            badge.dataset.value = task[badge.dataset.taskPatch];
+        });
+        
+        const card = element.querySelector('.task-card');
+        if (card) {
+            card.className = card.className.replace(/\bpriority-\w+/g, `priority-${task.priority}`);
+            card.classList.toggle('task-overdue', task.is_overdue);
+        }
+    });
+}
+
+function buildTaskColumn(task) {
+    const column = document.createElement('div');
+    column.className = 'col-md-6 col-lg-4 mb-4';
+    column.dataset.taskId = task.id;
+    column.innerHTML = `
+        <div class="card task-card">
+            <div class="card-body">
+                <div class="d-flex justify-content-between align-items-start mb-2">
+                    <h5 class="card-title mb-0"></h5>
+                    <a class="btn btn-sm btn-outline-primary" title="Edit Task" aria-label="Edit Task">Edit</a>
+                </div>
+                <div class="mb-3">
+                    <button type="button" class="badge border-0 me-2 task-status" data-task-patch="status" title="Change status"></button>
+                    <button type="button" class="badge border-0 task-priority" data-task-patch="priority" title="Change priority"></button>
+                </div>
+            </div>
+        </div>
+    `;
+    column.querySelector('a').href = `/task/${task.id}/edit`;
+    column.querySelector('.card-title').textContent = task.title;
+    column.querySelector('.task-card').classList.add(`priority-${task.priority}`);
+    column.querySelector('.task-card').classList.toggle('task-overdue', task.is_overdue);
+    setBadge(column.querySelector('.task-status'), task.status_color, formatLabel(task.status));
+    setBadge(column.querySelector('.task-priority'), task.priority_color, formatLabel(task.priority));
+    column.querySelector('.task-status').dataset.value = task.status;
+    column.querySelector('.task-priority').dataset.value = task.priority;
+    return column;
+}
+
+function applyStatsEvent(stats) {
+    Object.entries(stats).forEach(([name, value]) => {
+        document.querySelectorAll(`[data-stat="${name}"]`).forEach((element) => {
+            element.textContent = value;
+        });
+    });
+}
+
 // Utility functions
 function showToast(message, type = 'info') {
     const toastContainer = document.getElementById('toast-container') || createToastContainer();
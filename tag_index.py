@@ -0,0 +1,269 @@
+"""
+Tag filtering for HaatKhata
+A tag filter on the Tasks page, such as "work|home urgent -someday", is
+answered from a per-worker bitmap index of the user's tasks. Every task,
+archived ones included, gets an ordinal, and each tag, status, priority and
+category has a bitset of the ordinals that carry it. The bitsets are Python
+ints, whose &, | and ~ run a machine word at a time, so a filter costs a
+handful of set operations however many tasks match. The matches are sorted
+on keys kept in the index and SQL only fetches the visible page of rows by
+primary key. Indexes are built on first use, kept
+current by the task listeners and held in an LRU over users. Before each
+filter the index is compared with the user's data version and rebuilt if
+another worker, an import or the archive job changed the user's tasks.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from database import shards, data_version, on_task_change, clean_tags, TASK_PRIORITIES
+import metrics
+
+# Tag index configuration from environment variables
+TAG_INDEX_MAX_USERS = int(os.getenv("TAG_INDEX_MAX_USERS", 1000))
+TAG_INDEX_PAGE_SIZE = int(os.getenv("TAG_INDEX_PAGE_SIZE", 50))
+
+
+def parse(expression):
+    """The terms of a tag filter as (negated, names) pairs, all of which must hold
+
+    Words are ANDed, "a|b" matches either tag and a leading "-" excludes.
+    """
+    terms = []
+    for word in expression.split():
+        names = clean_tags(word.lstrip('-').split('|'))
+        if names:
+            terms.append((word.startswith('-'), names))
+    return terms
+
+
+def bitset(positions):
+    """An int with the given bits set"""
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def positions(bits):
+    """The set bits of an int, lowest first"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def _add(bitsets, key, bit):
+    bitsets[key] = bitsets.get(key, 0) | bit
+
+
+def _clear(bitsets, key, bit):
+    remaining = bitsets.get(key, 0) & ~bit
+    if remaining:
+        bitsets[key] = remaining
+    else:
+        bitsets.pop(key, None)
+
+
+class TagIndex:
+    """Bitsets over one user's tasks by tag, status, priority and category
+
+    Ordinals of deleted tasks are not reused until the next rebuild.
+    """
+
+    def __init__(self, version, rows=(), tag_rows=()):
+        self.version = version
+        self.ids = []
+        # task id -> (ordinal, status, priority, category id, tags, archived, created at, due date)
+        self.entries = {}
+
+        tags = {}
+        for row in tag_rows:
+            tags.setdefault(row['task_id'], []).append(row['name'])
+
+        # Collect positions first; growing big ints one bit at a time is quadratic
+        groups = {'status': {}, 'priority': {}, 'category': {}, 'tag': {}}
+        archived = []
+        for row in rows:
+            ordinal = len(self.ids)
+            task_tags = tuple(tags.get(row['id'], ()))
+            self.ids.append(row['id'])
+            self.entries[row['id']] = (ordinal, row['status'], row['priority'], row['category_id'],
+                                       task_tags, bool(row['archived']), row['created_at'], row['due_date'])
+            groups['status'].setdefault(row['status'], []).append(ordinal)
+            groups['priority'].setdefault(row['priority'], []).append(ordinal)
+            if row['category_id']:
+                groups['category'].setdefault(row['category_id'], []).append(ordinal)
+            for name in task_tags:
+                groups['tag'].setdefault(name, []).append(ordinal)
+            if row['archived']:
+                archived.append(ordinal)
+
+        self.live = bitset(range(len(self.ids)))
+        self.archived = bitset(archived)
+        self.by_status, self.by_priority, self.by_category, self.by_tag = (
+            {key: bitset(ordinals) for key, ordinals in groups[name].items()}
+            for name in ('status', 'priority', 'category', 'tag')
+        )
+
+    def put(self, task_id, status, priority, category_id, tags=None, created_at=None, due_date=None):
+        """Add a task or replace its fields; tags=None keeps its current tags"""
+        entry = self.entries.get(task_id)
+        if entry is None:
+            ordinal = len(self.ids)
+            self.ids.append(task_id)
+            tags = tuple(tags or ())
+        else:
+            ordinal = entry[0]
+            if tags is None:
+                tags = entry[4]
+            self._unset(entry)
+
+        bit = 1 << ordinal
+        self.live |= bit
+        _add(self.by_status, status, bit)
+        _add(self.by_priority, priority, bit)
+        if category_id:
+            _add(self.by_category, category_id, bit)
+        for name in tags:
+            _add(self.by_tag, name, bit)
+        self.entries[task_id] = (ordinal, status, priority, category_id, tuple(tags), False,
+                                 created_at, due_date)
+
+    def remove(self, task_id):
+        """Drop a task if it is indexed"""
+        entry = self.entries.pop(task_id, None)
+        if entry is not None:
+            self._unset(entry)
+            self.live &= ~(1 << entry[0])
+
+    def _unset(self, entry):
+        ordinal, status, priority, category_id, tags, archived = entry[:6]
+        bit = 1 << ordinal
+        _clear(self.by_status, status, bit)
+        _clear(self.by_priority, priority, bit)
+        if category_id:
+            _clear(self.by_category, category_id, bit)
+        for name in tags:
+            _clear(self.by_tag, name, bit)
+        if archived:
+            self.archived &= ~bit
+
+    def match(self, terms, status=None, category_id=None, priority=None, include_archived=False):
+        """Ids of the tasks matching parsed tag terms and the other filters"""
+        bits = self.live if include_archived else self.live & ~self.archived
+        for bitsets, key in ((self.by_status, status), (self.by_category, category_id),
+                             (self.by_priority, priority)):
+            if key:
+                bits &= bitsets.get(key, 0)
+        for negated, names in terms:
+            either = 0
+            for name in names:
+                either |= self.by_tag.get(name, 0)
+            bits = bits & ~either if negated else bits & either
+        return [self.ids[ordinal] for ordinal in positions(bits)]
+
+    def sort(self, task_ids, sort):
+        """Order task ids like Task.get_by_user does for the same sort"""
+        entries = self.entries
+        oldest = datetime.min
+        if sort == 'due':
+            # Tasks without a due date go last
+            task_ids.sort(key=lambda task_id: (entries[task_id][7] is None, entries[task_id][7] or oldest, task_id))
+        elif sort == 'priority':
+            task_ids.sort(key=lambda task_id: (TASK_PRIORITIES.index(entries[task_id][2]),
+                                               entries[task_id][6] or oldest), reverse=True)
+        else:
+            task_ids.sort(key=lambda task_id: entries[task_id][6] or oldest, reverse=True)
+        return task_ids
+
+
+class TagIndexCache:
+    """LRU of per-user tag indexes"""
+
+    def __init__(self, max_users=TAG_INDEX_MAX_USERS):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def page(self, user_id, expression, status=None, category_id=None, priority=None,
+             include_archived=False, sort='created', within=None, page=1, page_size=TAG_INDEX_PAGE_SIZE):
+        """One page of the ids matching a tag filter and the other filters, with the pager
+
+        within, if given, limits the matches to those ids, e.g. a search's.
+        """
+        terms = parse(expression)
+        index = self._load(user_id)
+        with self._lock:
+            task_ids = index.match(terms, status, category_id, priority, include_archived)
+            if within is not None:
+                task_ids = [task_id for task_id in task_ids if task_id in within]
+            index.sort(task_ids, sort)
+
+        pages = max(1, -(-len(task_ids) // page_size))
+        page = min(max(page, 1), pages)
+        return (task_ids[(page - 1) * page_size:page * page_size],
+                {'page': page, 'pages': pages, 'total': len(task_ids)})
+
+    def _load(self, user_id):
+        """The user's index, rebuilt if it is missing or behind the data version"""
+        # Read the version first so a write racing the rebuild leaves it stale
+        version = data_version(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+                return index
+
+        db = shards.for_user(user_id)
+        rows = db.execute_query(
+            """
+            SELECT id, status, priority, category_id, 0 as archived, created_at, due_date
+            FROM task WHERE user_id = %s
+            UNION ALL
+            SELECT id, status, priority, category_id, 1, created_at, due_date
+            FROM task_archive WHERE user_id = %s
+            ORDER BY id
+            """,
+            (user_id, user_id),
+            fetch=True
+        )
+        tag_rows = db.execute_query(
+            "SELECT task_id, name FROM task_tag WHERE user_id = %s", (user_id,), fetch=True
+        )
+        index = TagIndex(version, rows, tag_rows)
+        metrics.incr('tag_index_rebuilds')
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def apply(self, action, task):
+        """Fold one of this worker's task writes into a loaded index"""
+        with self._lock:
+            index = self._indexes.get(task.user_id)
+            if index is None:
+                return
+            if action == 'deleted':
+                index.remove(task.id)
+            else:
+                index.put(task.id, task.status, task.priority, task.category_id, task.tags,
+                          task.created_at, task.due_date)
+            # Each task write bumps the data version once
+            index.version += 1
+
+
+cache = TagIndexCache()
+
+
+@on_task_change
+def update_tag_index(action, task):
+    """Keep loaded tag indexes in step with task writes"""
+    cache.apply(action, task)
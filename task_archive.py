@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Completed task archiving for HaatKhata
+Run this script periodically (e.g. nightly). It moves tasks that were
+completed more than ARCHIVE_AFTER_DAYS ago from the hot task table into
+task_archive in small batches, so everyday task queries only scan tasks that
+are still in play. Archived tasks stay visible in the task history, in
+stats, in exports and to sync clients.
+"""
+
+import os
+from datetime import datetime, timedelta
+from database import db_manager, shards, TASK_ARCHIVE_COLUMNS
+
+# Archive configuration from environment variables
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 500))
+
+
+def archive_shard(db, cutoff, skip_users=(), batch_size=ARCHIVE_BATCH):
+    """Archive one shard's tasks completed before cutoff and return the count"""
+    # Subtask trees are archived whole, once every task in them is old and
+    # completed, so a live task never loses subtasks from its progress
+    query = """
+    SELECT id FROM task WHERE parent_id IS NULL AND status = 'completed' AND updated_at < %s
+    AND NOT EXISTS (
+        SELECT 1 FROM task_closure c JOIN task d ON d.id = c.descendant_id
+        WHERE c.ancestor_id = task.id AND (d.status != 'completed' OR d.updated_at >= %s)
+    )
+    """
+    params = [cutoff, cutoff]
+    if skip_users:
+        query += f" AND user_id NOT IN ({', '.join(['%s'] * len(skip_users))})"
+        params.extend(skip_users)
+    query += " ORDER BY id LIMIT %s FOR UPDATE"
+    params.append(batch_size)
+
+    archived = 0
+    while True:
+        with db.transaction() as cursor:
+            cursor.execute(query, params)
+            roots = [row['id'] for row in cursor.fetchall()]
+            if not roots:
+                break
+            # Lock the subtasks too; one reopened meanwhile keeps its tree live
+            cursor.execute(
+                f"""
+                SELECT c.ancestor_id, t.id, t.status, t.updated_at
+                FROM task_closure c JOIN task t ON t.id = c.descendant_id
+                WHERE c.ancestor_id IN ({', '.join(['%s'] * len(roots))})
+                FOR UPDATE
+                """,
+                roots
+            )
+            subtasks = cursor.fetchall()
+            live = {row['ancestor_id'] for row in subtasks
+                    if row['status'] != 'completed' or row['updated_at'] >= cutoff}
+            task_ids = [root for root in roots if root not in live]
+            task_ids += [row['id'] for row in subtasks if row['ancestor_id'] not in live]
+            if not task_ids:
+                continue
+            placeholders = ', '.join(['%s'] * len(task_ids))
+
+            cursor.execute(
+                f"""
+                INSERT INTO task_archive ({TASK_ARCHIVE_COLUMNS})
+                SELECT {TASK_ARCHIVE_COLUMNS} FROM task WHERE id IN ({placeholders})
+                """,
+                task_ids
+            )
+            # Keep completed counts in the same transaction as the move
+            cursor.execute(
+                f"""
+                INSERT INTO task_archive_count (user_id, completed)
+                SELECT user_id, COUNT(*) FROM task WHERE id IN ({placeholders}) GROUP BY user_id
+                ON DUPLICATE KEY UPDATE completed = completed + VALUES(completed)
+                """,
+                task_ids
+            )
+            # Recent tasks on cached dashboards may have changed
+            cursor.execute(
+                f"""
+                INSERT INTO task_owner_lock (user_id, version)
+                SELECT DISTINCT user_id, 1 FROM task WHERE id IN ({placeholders})
+                ON DUPLICATE KEY UPDATE version = version + 1
+                """,
+                task_ids
+            )
+            cursor.execute(f"DELETE FROM task WHERE id IN ({placeholders})", task_ids)
+            cursor.execute(f"DELETE FROM task_closure WHERE descendant_id IN ({placeholders})", task_ids)
+        archived += len(task_ids)
+    return archived
+
+
+def archive(after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH):
+    """Archive old completed tasks on every shard"""
+    cutoff = datetime.now() - timedelta(days=after_days)
+    # Users being moved between shards are archived after the move
+    moving = [row['user_id'] for row in
+              db_manager.execute_query("SELECT user_id FROM shard_move", fetch=True)]
+    return sum(archive_shard(db, cutoff, moving, batch_size) for db in shards.all())
+
+
+def main():
+    """Archive completed tasks"""
+    archived = archive()
+    print(f"Archived {archived} tasks completed more than {ARCHIVE_AFTER_DAYS} days ago")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Daily task digests for HaatKhata
+Run this script once a day (e.g. early each morning). It builds every
+user's digest of overdue tasks and tasks due today, shown on the dashboard.
+Instead of a query per user, each shard is read in one pass over the
+(due_date, status, user_id) index, streamed through a server-side cursor.
+Rows are grouped by user in a buffer of at most DIGEST_BATCH tasks, which is
+written back in batched inserts together with the position of the scan, so
+an interrupted run carries on where it stopped when started again the same
+day.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from database import db_manager, shards, TASK_STATUSES
+
+# Digest configuration from environment variables
+DIGEST_BATCH = int(os.getenv("DIGEST_BATCH", 5000))
+DIGEST_MAX_TASKS = int(os.getenv("DIGEST_MAX_TASKS", 10))
+DIGEST_KEEP_DAYS = int(os.getenv("DIGEST_KEEP_DAYS", 7))
+
+PRUNE_BATCH = 5000
+
+
+def scan_key(due_date, status, user_id, task_id):
+    """Position of a row in the scan order"""
+    # ENUMs sort by their position in the type, not by name
+    return due_date, TASK_STATUSES.index(status), user_id, task_id
+
+
+def load_run(db, day):
+    """The saved progress of day's run on a shard, or None"""
+    return db.execute_query(
+        "SELECT * FROM task_digest_run WHERE day = %s", (day,), fetch=True, fetch_all=False
+    )
+
+
+def write_batch(db, day, buffer, last, finished=False):
+    """Add a batch of grouped tasks to the digests and save the scan position"""
+    with db.transaction() as cursor:
+        if buffer:
+            user_ids = list(buffer)
+            placeholders = ', '.join(['%s'] * len(user_ids))
+
+            # Users already seen in earlier batches may have a full list
+            cursor.execute(
+                f"""
+                SELECT user_id, overdue + due_today as listed FROM task_digest
+                WHERE day = %s AND user_id IN ({placeholders})
+                """,
+                [day] + user_ids
+            )
+            listed = {row['user_id']: row['listed'] for row in cursor.fetchall()}
+            task_ids = []
+            for user_id, (_, _, first_ids) in buffer.items():
+                room = max(0, DIGEST_MAX_TASKS - listed.get(user_id, 0))
+                task_ids.extend(first_ids[:room])
+
+            # Only the listed tasks are read beyond the index
+            if task_ids:
+                cursor.execute(
+                    f"""
+                    INSERT IGNORE INTO task_digest_item (user_id, day, task_id, title, priority, due_date)
+                    SELECT user_id, %s, id, title, priority, due_date FROM task
+                    WHERE id IN ({', '.join(['%s'] * len(task_ids))})
+                    """,
+                    [day] + task_ids
+                )
+            cursor.execute(
+                f"""
+                INSERT INTO task_digest (user_id, day, overdue, due_today)
+                VALUES {', '.join(['(%s, %s, %s, %s)'] * len(buffer))}
+                ON DUPLICATE KEY UPDATE overdue = overdue + VALUES(overdue),
+                                        due_today = due_today + VALUES(due_today)
+                """,
+                [value for user_id, (overdue, due_today, _) in buffer.items()
+                 for value in (user_id, day, overdue, due_today)]
+            )
+            # Cached dashboards of these users need the digest
+            cursor.execute(
+                f"""
+                INSERT INTO task_owner_lock (user_id, version)
+                VALUES {', '.join(['(%s, 1)'] * len(user_ids))}
+                ON DUPLICATE KEY UPDATE version = version + 1
+                """,
+                user_ids
+            )
+
+        last = last or (None, None, None, None)
+        cursor.execute(
+            """
+            INSERT INTO task_digest_run (day, last_due_date, last_status, last_user_id, last_task_id, finished_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                last_due_date = COALESCE(VALUES(last_due_date), last_due_date),
+                last_status = COALESCE(VALUES(last_status), last_status),
+                last_user_id = COALESCE(VALUES(last_user_id), last_user_id),
+                last_task_id = COALESCE(VALUES(last_task_id), last_task_id),
+                finished_at = VALUES(finished_at)
+            """,
+            (day, *last, datetime.now() if finished else None)
+        )
+
+
+def digest_shard(db, day, skip_users=(), batch_size=DIGEST_BATCH):
+    """Build one shard's digests for day and return the number of tasks counted"""
+    run = load_run(db, day)
+    if run and run['finished_at']:
+        return 0
+
+    start_of_day = datetime.combine(day, datetime.min.time())
+    query = "SELECT due_date, status, user_id, id FROM task WHERE due_date < %s AND status != 'completed'"
+    params = [start_of_day + timedelta(days=1)]
+    resume_after = None
+    if run and run['last_due_date'] is not None:
+        # Rows sharing the saved due date are re-read and skipped below
+        query += " AND due_date >= %s"
+        params.append(run['last_due_date'])
+        resume_after = scan_key(run['last_due_date'], run['last_status'],
+                                run['last_user_id'], run['last_task_id'])
+    query += " ORDER BY due_date, status, user_id, id"
+
+    skip_users = set(skip_users)
+    buffer = {}
+    buffered = 0
+    seen = 0
+    last = None
+    for rows in db.stream_query(query, params):
+        for row in rows:
+            if resume_after:
+                if scan_key(row['due_date'], row['status'], row['user_id'], row['id']) <= resume_after:
+                    continue
+                resume_after = None
+            last = (row['due_date'], row['status'], row['user_id'], row['id'])
+            user_id = row['user_id']
+            if user_id in skip_users:
+                continue
+
+            entry = buffer.get(user_id)
+            if entry is None:
+                entry = buffer[user_id] = [0, 0, []]
+            entry[0 if row['due_date'] < start_of_day else 1] += 1
+            # The scan runs oldest first, so a user's first tasks are the most overdue
+            if len(entry[2]) < DIGEST_MAX_TASKS:
+                entry[2].append(row['id'])
+            buffered += 1
+            seen += 1
+
+            if buffered >= batch_size:
+                write_batch(db, day, buffer, last)
+                buffer = {}
+                buffered = 0
+
+    write_batch(db, day, buffer, last, finished=True)
+    return seen
+
+
+def prune(db, before):
+    """Delete digests from before the given day"""
+    for table in ('task_digest_item', 'task_digest', 'task_digest_run'):
+        while True:
+            with db.transaction() as cursor:
+                deleted = cursor.execute(f"DELETE FROM {table} WHERE day < %s LIMIT %s", (before, PRUNE_BATCH))
+            if not deleted:
+                break
+
+
+def digest(day=None):
+    """Build the day's digests on every shard"""
+    day = day or date.today()
+    # Users being moved between shards get their digest once they have landed
+    moving = [row['user_id'] for row in
+              db_manager.execute_query("SELECT user_id FROM shard_move", fetch=True)]
+    total = 0
+    for db in shards.all():
+        prune(db, day - timedelta(days=DIGEST_KEEP_DAYS))
+        total += digest_shard(db, day, moving)
+    return total
+
+
+def main():
+    """Build today's digests"""
+    counted = digest()
+    print(f"Digested {counted} overdue and due-today tasks")
+
+
+if __name__ == "__main__":
+    main()
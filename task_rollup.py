@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Daily task rollups for HaatKhata
+Task writes keep task_daily_rollup current: tasks created and completed per
+user, day and category, with the summed completion lead time. History charts
+read these few hundred rows instead of scanning task. Run this script once
+after upgrading, or any time to rebuild the rollups from the task and
+task_archive tables.
+"""
+
+import os
+from datetime import date, timedelta
+from database import db_manager, shards, Task, Category
+
+# Rollup configuration from environment variables
+HISTORY_DAYS = int(os.getenv("HISTORY_DAYS", 90))
+HISTORY_MAX_DAYS = 366
+
+PERIODS = ('day', 'week')
+
+# Each task once on its creation day, and completed tasks again on their completion day
+CONTRIBUTIONS = """
+SELECT user_id, DATE(created_at) as day, COALESCE(category_id, 0) as category_id,
+       1 as created, 0 as completed, 0 as lead_seconds
+FROM {table} WHERE {where}
+UNION ALL
+SELECT user_id, DATE(completed_at), COALESCE(category_id, 0),
+       0, 1, TIMESTAMPDIFF(SECOND, created_at, completed_at)
+FROM {table} WHERE {where} AND completed_at IS NOT NULL
+"""
+
+
+def insert_rollups(cursor, where, params):
+    """Compute the rollup rows of the users matching where, who must have none yet"""
+    contributions = ' UNION ALL '.join(CONTRIBUTIONS.format(table=table, where=where)
+                                       for table in ('task', 'task_archive'))
+    cursor.execute(
+        f"""
+        INSERT INTO task_daily_rollup (user_id, day, category_id, created, completed, lead_seconds)
+        SELECT user_id, day, category_id, SUM(created), SUM(completed), SUM(lead_seconds)
+        FROM ({contributions}) AS contribution
+        GROUP BY user_id, day, category_id
+        """,
+        tuple(params) * 4
+    )
+
+
+def rebuild_user(db, user_id):
+    """Recompute one user's rollup rows on a shard from their tasks"""
+    with db.transaction() as cursor:
+        # Holding the owner lock keeps task writes out until the rows are back
+        Task.lock_owner(cursor, user_id)
+        cursor.execute("DELETE FROM task_daily_rollup WHERE user_id = %s", (user_id,))
+        insert_rollups(cursor, "user_id = %s", (user_id,))
+
+
+def backfill():
+    """Rebuild the rollups of every user on every shard and return the user count"""
+    # Users being moved between shards are rebuilt by the move itself
+    moving = {row['user_id'] for row in
+              db_manager.execute_query("SELECT user_id FROM shard_move", fetch=True)}
+    rebuilt = 0
+    for db in shards.all():
+        users = db.execute_query(
+            "SELECT user_id FROM task UNION SELECT user_id FROM task_archive", fetch=True
+        )
+        for row in users:
+            if row['user_id'] not in moving:
+                rebuild_user(db, row['user_id'])
+                rebuilt += 1
+    return rebuilt
+
+
+def period_start(day, period):
+    """First day of the bucket that day falls in"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _average_lead_hours(totals):
+    if not totals['completed']:
+        return None
+    return round(totals['lead_seconds'] / totals['completed'] / 3600, 1)
+
+
+def history(user_id, days=HISTORY_DAYS, period='day'):
+    """Created and completed counts per period and per category over the last days"""
+    days = max(1, min(days, HISTORY_MAX_DAYS))
+    today = date.today()
+    since = period_start(today - timedelta(days=days - 1), period)
+
+    # Every period gets a bucket, including the ones with no activity
+    buckets = {}
+    start = since
+    while start <= today:
+        buckets[start] = {'start': start.isoformat(), 'created': 0, 'completed': 0, 'lead_seconds': 0}
+        start += timedelta(days=7 if period == 'week' else 1)
+
+    categories = {}
+    looked_up = {0: None}
+    totals = {'created': 0, 'completed': 0, 'lead_seconds': 0}
+    for row in Task.get_daily_rollup(user_id, since):
+        bucket = buckets.get(period_start(row['day'], period))
+        if bucket is None:
+            # Imported tasks can be dated in the future
+            continue
+        # Deleted categories fall back to uncategorized
+        if row['category_id'] not in looked_up:
+            looked_up[row['category_id']] = Category.lookup(row['category_id'], user_id)
+        category = looked_up[row['category_id']]
+        key = category.id if category else 0
+        if key not in categories:
+            categories[key] = {
+                'id': category.id if category else None,
+                'name': category.name if category else 'Uncategorized',
+                'color': category.color if category else '#6c757d',
+                'created': 0, 'completed': 0, 'lead_seconds': 0,
+            }
+        for target in (bucket, categories[key], totals):
+            for field in ('created', 'completed', 'lead_seconds'):
+                target[field] += int(row[field])
+
+    for entry in list(buckets.values()) + list(categories.values()) + [totals]:
+        entry['avg_lead_hours'] = _average_lead_hours(entry)
+        del entry['lead_seconds']
+
+    return {
+        'period': period,
+        'since': since.isoformat(),
+        'buckets': list(buckets.values()),
+        'categories': sorted(categories.values(), key=lambda entry: -entry['created']),
+        'totals': totals,
+    }
+
+
+def main():
+    """Rebuild all rollups"""
+    rebuilt = backfill()
+    print(f"Rebuilt daily rollups for {rebuilt} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Delta sync for HaatKhata clients
+Every task write appends to the per-user task_changes log in the same
+transaction, so a client holding a cursor only downloads what changed since.
+Run this script periodically to compact log entries older than the
+retention window; clients whose cursor falls behind the compacted range are
+told to start over with a full snapshot.
+
+Every shard hands out change ids from its own range, so a cursor issued by
+one shard is never mistaken for a position on another: after a user moves,
+their old cursor simply expires.
+"""
+
+import os
+from datetime import datetime, timedelta
+from database import shards, Task
+
+# Sync configuration from environment variables
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 200))
+SYNC_RETENTION_DAYS = int(os.getenv("SYNC_RETENTION_DAYS", 30))
+SYNC_COMPACT_BATCH = int(os.getenv("SYNC_COMPACT_BATCH", 5000))
+
+TASK_COLUMNS = """
+    t.id, t.title, t.description, t.status, t.priority, t.due_date, t.created_at,
+    t.updated_at, t.user_id, t.category_id, t.parent_id
+"""
+
+
+class CursorExpired(Exception):
+    """The client's cursor points into a compacted part of the log"""
+
+
+def compacted_through(db):
+    """Highest change id removed by compaction so far on a shard"""
+    row = db.execute_query(
+        "SELECT value FROM sync_state WHERE name = 'task_changes_compacted'",
+        fetch=True,
+        fetch_all=False
+    )
+    return row['value'] if row else 0
+
+
+def cursor_floor(db):
+    """Lowest cursor that is still valid on a shard"""
+    start, _ = db.change_id_range()
+    return max(compacted_through(db), start)
+
+
+def latest_cursor(user_id):
+    """The user's newest change id, or the shard's floor if there is none"""
+    db = shards.for_user(user_id)
+    row = db.execute_query(
+        "SELECT COALESCE(MAX(id), 0) as latest FROM task_changes WHERE user_id = %s",
+        (user_id,),
+        fetch=True,
+        fetch_all=False
+    )
+    return max(row['latest'], cursor_floor(db))
+
+
+def changes_since(user_id, since, limit=SYNC_BATCH_SIZE):
+    """Return (changes, cursor, has_more) for changes after the cursor"""
+    db = shards.for_user(user_id)
+    _, end = db.change_id_range()
+    if since < cursor_floor(db) or since >= end:
+        raise CursorExpired()
+
+    query = f"""
+    SELECT ch.id as change_id, ch.task_id, ch.action, {TASK_COLUMNS}
+    FROM task_changes ch
+    LEFT JOIN task t ON t.id = ch.task_id
+    WHERE ch.user_id = %s AND ch.id > %s
+    ORDER BY ch.id
+    LIMIT %s
+    """
+    rows = db.execute_query(query, (user_id, since, limit + 1), fetch=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Only the latest state of each task matters within one batch
+    latest = {}
+    for row in rows:
+        latest.pop(row['task_id'], None)
+        latest[row['task_id']] = row
+
+    # Tasks missing from the hot table may only have been archived
+    missing = [task_id for task_id, row in latest.items() if row['id'] is None]
+    archived = {}
+    if missing:
+        archived_rows = db.execute_query(
+            f"SELECT {TASK_COLUMNS} FROM task_archive t WHERE t.id IN ({', '.join(['%s'] * len(missing))})",
+            missing,
+            fetch=True
+        )
+        archived = {row['id']: row for row in archived_rows}
+
+    changes = []
+    for task_id, row in latest.items():
+        if task_id in archived:
+            changes.append({'action': 'updated', 'task': Task.from_row(archived[task_id]).to_dict()})
+            continue
+        if row['id'] is None:
+            # Deleted since (or in) this batch: send a tombstone
+            changes.append({'action': 'deleted', 'id': task_id})
+            continue
+        task_fields = {key: value for key, value in row.items()
+                       if key not in ('change_id', 'task_id', 'action')}
+        changes.append({'action': row['action'], 'task': Task.from_row(task_fields).to_dict()})
+
+    # The cursor follows the change batch, never the archive lookup
+    cursor = rows[-1]['change_id'] if rows else since
+    return changes, cursor, has_more
+
+
+def snapshot(user_id, after=0, limit=SYNC_BATCH_SIZE):
+    """Return (tasks, next_after, has_more) for a full download in id order"""
+    query = f"""
+    SELECT {TASK_COLUMNS} FROM task t WHERE t.user_id = %s AND t.id > %s
+    UNION ALL
+    SELECT {TASK_COLUMNS} FROM task_archive t WHERE t.user_id = %s AND t.id > %s
+    ORDER BY id
+    LIMIT %s
+    """
+    db = shards.for_user(user_id)
+    rows = db.execute_query(query, (user_id, after, user_id, after, limit + 1), fetch=True)
+    has_more = len(rows) > limit
+    tasks = [Task.from_row(row).to_dict() for row in rows[:limit]]
+    next_after = tasks[-1]['id'] if tasks else after
+    return tasks, next_after, has_more
+
+
+def compact(retention_days=SYNC_RETENTION_DAYS, batch_size=SYNC_COMPACT_BATCH):
+    """Delete change log entries older than the retention window on every shard"""
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    return sum(compact_shard(db, cutoff, batch_size) for db in shards.all())
+
+
+def compact_shard(db, cutoff, batch_size=SYNC_COMPACT_BATCH):
+    """Delete one shard's change log entries older than cutoff, in batches"""
+    removed = 0
+    while True:
+        batch = db.execute_query(
+            """
+            SELECT MAX(id) as max_id, COUNT(*) as count FROM (
+                SELECT id FROM task_changes WHERE changed_at < %s ORDER BY id LIMIT %s
+            ) old_changes
+            """,
+            (cutoff, batch_size),
+            fetch=True,
+            fetch_all=False
+        )
+        if not batch['count']:
+            break
+
+        with db.transaction() as cursor:
+            # Record the watermark first so no client trusts a cursor into the gap
+            cursor.execute(
+                """
+                INSERT INTO sync_state (name, value) VALUES ('task_changes_compacted', %s)
+                ON DUPLICATE KEY UPDATE value = GREATEST(value, VALUES(value))
+                """,
+                (batch['max_id'],)
+            )
+            cursor.execute("DELETE FROM task_changes WHERE id <= %s", (batch['max_id'],))
+            removed += cursor.rowcount
+    return removed
+
+
+def main():
+    """Compact the task change log"""
+    removed = compact()
+    print(f"Removed {removed} change log entries older than {SYNC_RETENTION_DAYS} days")
+
+
+if __name__ == "__main__":
+    main()
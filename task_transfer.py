@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Bulk task export and import for HaatKhata
+Exports stream straight from a server-side cursor and imports are written
+through batched multi-row INSERTs, so memory stays flat for any account size.
+
+Usage:
+    python task_transfer.py export <username> <csv|ndjson> [output file]
+    python task_transfer.py import <username> <input file>
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from itertools import islice
+from database import shards, User, Task, Category
+
+# Transfer configuration from environment variables
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 500))
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", 500))
+IMPORT_TRANSACTION_ROWS = int(os.getenv("IMPORT_TRANSACTION_ROWS", 5000))
+
+EXPORT_FIELDS = ['title', 'description', 'status', 'priority', 'due_date',
+                 'created_at', 'updated_at', 'category', 'completed_at']
+VALID_STATUSES = Task.STATUSES
+VALID_PRIORITIES = Task.PRIORITIES
+
+
+def _format_value(value):
+    """Render datetimes the way MySQL prints them"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def export_rows(user_id, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield chunks of exportable task rows for user"""
+    columns = "title, description, status, priority, due_date, created_at, updated_at, category_id, completed_at"
+    # Categories live in the directory database, so names come from the cache
+    category_names = {category.id: category.name for category in Category.get_for_user(user_id)}
+    db = shards.for_user(user_id)
+    # Archived tasks follow the hot ones so exports always hold everything
+    for table in ('task', 'task_archive'):
+        query = f"SELECT {columns} FROM {table} WHERE user_id = %s ORDER BY id"
+        for rows in db.stream_query(query, (user_id,), chunk_size=chunk_size):
+            for row in rows:
+                row['category'] = category_names.get(row['category_id'])
+            yield [{key: _format_value(row[key]) for key in EXPORT_FIELDS} for row in rows]
+
+
+def export_csv(user_id, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield the user's tasks as CSV text, one chunk at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for rows in export_rows(user_id, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when there were no rows
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def export_ndjson(user_id, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield the user's tasks as newline-delimited JSON, one chunk at a time"""
+    for rows in export_rows(user_id, chunk_size):
+        yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+
+def read_csv(stream):
+    """Yield task records from a binary CSV stream"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+    for record in reader:
+        yield record
+
+
+def read_ndjson(stream):
+    """Yield task records from a binary newline-delimited JSON stream"""
+    for line in io.TextIOWrapper(stream, encoding='utf-8'):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_records(stream, filename):
+    """Pick a reader based on the uploaded file name"""
+    if filename.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        return read_ndjson(stream)
+    return read_csv(stream)
+
+
+def _parse_datetime(value):
+    """Parse an exported date or datetime, returning None when empty"""
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).strip())
+
+
+def _task_values(record, user_id, category_ids):
+    """Turn an imported record into a row for the task table"""
+    title = (record.get('title') or '').strip()
+    if not title:
+        raise ValueError("Task title is required")
+
+    status = record.get('status') or 'pending'
+    if status not in VALID_STATUSES:
+        raise ValueError(f"Unknown status: {status}")
+
+    priority = record.get('priority') or 'medium'
+    if priority not in VALID_PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+
+    now = datetime.now().replace(microsecond=0)
+    completed_at = None
+    if status == 'completed':
+        # Older exports have no completion time; their last update stands in
+        completed_at = (_parse_datetime(record.get('completed_at'))
+                        or _parse_datetime(record.get('updated_at')) or now)
+
+    category = (record.get('category') or '').strip().lower()
+    return (
+        title[:100],
+        record.get('description') or None,
+        status,
+        priority,
+        _parse_datetime(record.get('due_date')),
+        _parse_datetime(record.get('created_at')) or now,
+        user_id,
+        category_ids.get(category),
+        completed_at,
+    )
+
+
+def import_tasks(user_id, records, batch_size=IMPORT_BATCH_ROWS,
+                 transaction_size=IMPORT_TRANSACTION_ROWS):
+    """Insert task records for user in batched transactions and return the count"""
+    # One lookup resolves every category name in the upload
+    category_ids = {category.name.lower(): category.id for category in Category.get_for_user(user_id)}
+
+    columns = "(title, description, status, priority, due_date, created_at, user_id, category_id, completed_at)"
+    placeholder = "(%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    imported = 0
+    records = iter(records)
+
+    while True:
+        chunk = [_task_values(record, user_id, category_ids)
+                 for record in islice(records, transaction_size)]
+        if not chunk:
+            break
+
+        with shards.for_user(user_id).transaction() as cursor:
+            Task.lock_owner(cursor, user_id)
+            # Only rows this transaction inserted; a user moved in from another
+            # shard can already have tasks with higher ids
+            ranges = []
+            for start in range(0, len(chunk), batch_size):
+                batch = chunk[start:start + batch_size]
+                cursor.execute(
+                    f"INSERT INTO task {columns} VALUES {', '.join([placeholder] * len(batch))}",
+                    [value for row in batch for value in row]
+                )
+                # A multi-row INSERT takes consecutive ids starting at lastrowid
+                ranges.append((cursor.lastrowid, cursor.lastrowid + cursor.rowcount - 1))
+            inserted = f"user_id = %s AND ({' OR '.join(['id BETWEEN %s AND %s'] * len(ranges))})"
+            params = [user_id] + [bound for id_range in ranges for bound in id_range]
+
+            # Log the new tasks for sync clients in the same transaction
+            cursor.execute(
+                f"""
+                INSERT INTO task_changes (user_id, task_id, action)
+                SELECT user_id, id, 'created' FROM task
+                WHERE {inserted}
+                ORDER BY id
+                """,
+                params
+            )
+
+            # Let the reminder scheduler pick up imported due dates
+            cursor.execute(
+                f"""
+                INSERT INTO task_due_change (task_id)
+                SELECT id FROM task
+                WHERE {inserted} AND due_date > NOW() AND status != 'completed'
+                """,
+                params
+            )
+
+            # Count the new tasks in the history charts
+            Task.roll_up(cursor, inserted, params)
+
+        imported += len(chunk)
+
+    return imported
+
+
+def main():
+    """Command line entry point"""
+    if len(sys.argv) < 4 or sys.argv[1] not in ('export', 'import'):
+        print(__doc__.strip().split('Usage:')[1])
+        sys.exit(1)
+
+    command, username = sys.argv[1], sys.argv[2]
+    user = User.get_by_username(username)
+    if not user:
+        print(f"Unknown user: {username}")
+        sys.exit(1)
+
+    if command == 'export':
+        fmt = sys.argv[3]
+        chunks = export_csv(user.id) if fmt == 'csv' else export_ndjson(user.id)
+        output = open(sys.argv[4], 'w', encoding='utf-8', newline='') if len(sys.argv) > 4 else sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        return
+
+    path = sys.argv[3]
+    with open(path, 'rb') as stream:
+        count = import_tasks(user.id, read_records(stream, path))
+    print(f"Imported {count} tasks for {username}")
+
+
+if __name__ == "__main__":
+    main()
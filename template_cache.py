@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Jinja bytecode cache for HaatKhata
+Compiled templates are stored on disk so new workers load bytecode instead of
+parsing and compiling every template on their first requests. Jinja checks
+each cached entry against the template source, so edited templates are
+recompiled automatically. Run this script at build time to warm the cache.
+"""
+
+import os
+import shutil
+import time
+from jinja2 import FileSystemBytecodeCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Template cache configuration from environment variables
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(BASE_DIR, '.jinja_cache'))
+
+
+def init_app(app):
+    """Attach the filesystem bytecode cache to the app's Jinja environment"""
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+def load_all(app):
+    """Load every HTML template and return how long it took in seconds"""
+    env = app.jinja_env
+    started = time.perf_counter()
+    for name in env.list_templates(extensions=['html']):
+        env.get_template(name)
+    return time.perf_counter() - started
+
+
+def precompile(app):
+    """Compile all templates into the bytecode cache and report the speed-up"""
+    env = app.jinja_env
+    bytecode_cache = env.bytecode_cache
+
+    # Cold: parse and compile from source, as a worker without a cache would
+    env.bytecode_cache = None
+    env.cache.clear()
+    cold = load_all(app)
+
+    # Rebuild the on-disk cache from scratch
+    shutil.rmtree(TEMPLATE_CACHE_DIR, ignore_errors=True)
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    env.bytecode_cache = bytecode_cache
+    env.cache.clear()
+    load_all(app)
+
+    # Warm: what a freshly booted worker pays with the cache in place
+    env.cache.clear()
+    warm = load_all(app)
+    return cold, warm
+
+
+def main():
+    """Warm the template bytecode cache"""
+    from app import app
+
+    count = len(app.jinja_env.list_templates(extensions=['html']))
+    cold, warm = precompile(app)
+    print(f"Precompiled {count} templates into {TEMPLATE_CACHE_DIR}")
+    print(f"Load time without cache: {cold * 1000:.1f} ms, with cache: {warm * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Task title suggestions for HaatKhata
+Each worker keeps a sorted array of the word starts in a user's task titles,
+built the first time the user types into the search box and kept current by
+the task listeners. Prefix lookups are a bisect into that array, so
+suggestions are answered without a query. Indexes are held in an LRU over
+users. Every TYPEAHEAD_CHECK_SECONDS an index is compared with the user's
+data version and rebuilt if another worker, an import or the archive job
+changed the user's tasks.
+"""
+
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from database import shards, data_version, on_task_change
+import metrics
+
+# Typeahead configuration from environment variables
+TYPEAHEAD_MAX_USERS = int(os.getenv("TYPEAHEAD_MAX_USERS", 1000))
+TYPEAHEAD_CHECK_SECONDS = int(os.getenv("TYPEAHEAD_CHECK_SECONDS", 10))
+TYPEAHEAD_LIMIT = int(os.getenv("TYPEAHEAD_LIMIT", 8))
+
+
+def fold(text):
+    """Case-insensitive form used for matching"""
+    return ' '.join(text.casefold().split())
+
+
+def word_starts(title):
+    """Every suffix of the folded title that begins a word, the whole title first"""
+    folded = fold(title)
+    return [folded[i:] for i in range(len(folded)) if i == 0 or folded[i - 1] == ' ']
+
+
+class TitleIndex:
+    """Sorted (suffix, task id) pairs for one user's task titles
+
+    Whole titles and later word starts are kept apart, so titles that begin
+    with the prefix can be listed first without scanning every match.
+    """
+
+    def __init__(self, version, titles=()):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.titles = {}
+        self.title_entries = []
+        self.word_entries = []
+        for task_id, title in titles:
+            self.titles[task_id] = title
+            suffixes = word_starts(title)
+            if suffixes:
+                self.title_entries.append((suffixes[0], task_id))
+                self.word_entries.extend((suffix, task_id) for suffix in suffixes[1:])
+        self.title_entries.sort()
+        self.word_entries.sort()
+
+    def put(self, task_id, title):
+        """Add a task or replace its title"""
+        self.remove(task_id)
+        self.titles[task_id] = title
+        suffixes = word_starts(title)
+        if suffixes:
+            bisect.insort(self.title_entries, (suffixes[0], task_id))
+            for suffix in suffixes[1:]:
+                bisect.insort(self.word_entries, (suffix, task_id))
+
+    def remove(self, task_id):
+        """Drop a task if it is indexed"""
+        title = self.titles.pop(task_id, None)
+        if title is None:
+            return
+        suffixes = word_starts(title)
+        if suffixes:
+            _discard(self.title_entries, (suffixes[0], task_id))
+            for suffix in suffixes[1:]:
+                _discard(self.word_entries, (suffix, task_id))
+
+    def search(self, prefix, limit):
+        """Up to limit (task id, title) pairs with a word starting with prefix
+
+        Titles that start with the prefix come before mid-title matches.
+        """
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        matches = []
+        seen = set()
+        for entries in (self.title_entries, self.word_entries):
+            index = bisect.bisect_left(entries, (prefix,))
+            while index < len(entries) and len(matches) < limit:
+                suffix, task_id = entries[index]
+                if not suffix.startswith(prefix):
+                    break
+                if task_id not in seen:
+                    seen.add(task_id)
+                    matches.append((task_id, self.titles[task_id]))
+                index += 1
+        return matches
+
+
+def _discard(entries, entry):
+    """Remove entry from a sorted list if present"""
+    index = bisect.bisect_left(entries, entry)
+    if index < len(entries) and entries[index] == entry:
+        del entries[index]
+
+
+class TypeaheadCache:
+    """LRU of per-user title indexes"""
+
+    def __init__(self, max_users=TYPEAHEAD_MAX_USERS):
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def suggest(self, user_id, prefix, limit=TYPEAHEAD_LIMIT):
+        """Titles of the user's tasks matching prefix, loading the index if needed"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                fresh = time.monotonic() - index.checked_at < TYPEAHEAD_CHECK_SECONDS
+                if fresh:
+                    return index.search(prefix, limit)
+
+        index = self._load(user_id, index)
+        with self._lock:
+            return index.search(prefix, limit)
+
+    def _load(self, user_id, index):
+        """Revalidate index against the data version, rebuilding it when stale"""
+        # Read the version first so a write racing the rebuild leaves it stale
+        version = data_version(user_id)
+        with self._lock:
+            if index is not None and index.version == version:
+                index.checked_at = time.monotonic()
+                return index
+
+        rows = shards.for_user(user_id).execute_query(
+            "SELECT id, title FROM task WHERE user_id = %s", (user_id,), fetch=True
+        )
+        index = TitleIndex(version, [(row['id'], row['title']) for row in rows])
+        metrics.incr('typeahead_rebuilds')
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def apply(self, action, task):
+        """Fold one of this worker's task writes into a loaded index"""
+        with self._lock:
+            index = self._indexes.get(task.user_id)
+            if index is None:
+                return
+            if action == 'deleted':
+                index.remove(task.id)
+            else:
+                index.put(task.id, task.title)
+            # Each task write bumps the data version once
+            index.version += 1
+
+
+cache = TypeaheadCache()
+
+
+@on_task_change
+def update_typeahead(action, task):
+    """Keep loaded title indexes in step with task writes"""
+    cache.apply(action, task)